@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""生成压测用的 OpenC3 主机和用户授权数据"""
+
+import random
+from typing import Dict, List, Any, Tuple
+
+
+def gen_trees(depth: int, fanout: int) -> List[str]:
+    """生成深度为 depth、每层 fanout 个子节点的服务树，返回所有叶子节点名称（a.b.c 格式）"""
+    level = ["biz"]
+    for d in range(1, depth):
+        level = [ f"{x}.n{d}_{i}" for x in level for i in range(fanout) ]
+    return level
+
+
+def gen_hosts(count: int, trees: List[str], windows_ratio: float = 0.05, multi_tree_ratio: float = 0.02, rnd = random) -> List[Dict[str, Any]]:
+    hosts = []
+    for i in range(count):
+        tree = trees[i % len(trees)]
+        if rnd.random() < multi_tree_ratio:
+            tree = f"{tree},{rnd.choice(trees)}"
+        hosts.append({
+            "hostName": f"host-{i:06d}",
+            "ip": f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}",
+            "os": "Windows" if rnd.random() < windows_ratio else "Linux",
+            "tree": tree,
+        })
+    return hosts
+
+
+def gen_users(count: int, trees: List[str], grants_per_user: int = 3, rnd = random) -> List[Dict[str, Any]]:
+    """每个用户在随机的若干个服务树（任意层级）上拥有 1-3 级权限"""
+    users = []
+    for i in range(count):
+        for _ in range(grants_per_user):
+            parts = rnd.choice(trees).split('.')
+            users.append({
+                "name": f"user{i:05d}",
+                "treename": '.'.join(parts[:rnd.randint(1, len(parts))]),
+                "level": str(rnd.randint(1, 3)),
+            })
+    return users
+
+
+def generate(hosts: int = 1000, depth: int = 4, fanout: int = 5, users: int = 200, seed: int = 1) -> Tuple[list, list]:
+    """返回 (OpenC3 主机列表, OpenC3 用户授权列表)"""
+    rnd = random.Random(seed)
+    trees = gen_trees(depth, fanout)
+    return gen_hosts(hosts, trees, rnd=rnd), gen_users(users, trees, rnd=rnd)
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""本地模拟的 JumpServer + OpenC3 服务，用于离线压测
+
+实现了 jumpserver/api.py 和 openc3/api.py 用到的接口，支持 limit/offset 分页、
+按 name/username/address 过滤、?spm= 批量删除、可配置的响应延迟和错误率。
+
+    python3 -m bench.mock_server --port 18080 --hosts 10000 --latency 0.005
+"""
+
+import re
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from collections import Counter
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from bench import datagen
+
+ID = r'([0-9a-f-]{36})'
+
+COLLECTIONS = {
+    "nodes": "/api/v1/assets/nodes/",
+    "hosts": "/api/v1/assets/hosts/",
+    "perms": "/api/v1/perms/asset-permissions/",
+    "users": "/api/v1/users/users/",
+}
+
+
+class MockState(object):
+    """模拟服务的全部数据和请求计数"""
+
+    def __init__(self, c3_hosts, c3_users, latency = 0.0, jitter = 0.0, error_rate = 0.0):
+        self.c3_hosts = c3_hosts
+        self.c3_users = c3_users
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.errors = Counter()
+        self.data = { x: {} for x in COLLECTIONS }
+        # 主机名计数，用于名称唯一性检查
+        self.host_names = Counter()
+        # spm -> 缓存的ID列表
+        self.resources = {}
+        self.add("nodes", {"value": "DEFAULT", "full_value": "/DEFAULT"})
+        for name in sorted(set( x["name"] for x in c3_users )):
+            self.add("users", {"username": name, "name": name})
+
+    def add(self, kind, obj):
+        obj["id"] = str(uuid.uuid4())
+        self.data[kind][obj["id"]] = obj
+        return obj
+
+    def create_node(self, body):
+        """按 full_value 创建节点，同时补齐缺失的中间节点"""
+        full_value = body["full_value"]
+        existing = set( x["full_value"] for x in self.data["nodes"].values() )
+        parts = full_value.split('/')
+        for i in range(2, len(parts)):
+            parent = '/'.join(parts[:i])
+            if parent not in existing:
+                self.add("nodes", {"value": parts[i - 1], "full_value": parent})
+        return self.add("nodes", {"value": body.get("value", parts[-1]), "full_value": full_value})
+
+    def add_host(self, body):
+        self.host_names[body.get("name")] += 1
+        return self.add("hosts", body)
+
+    def update(self, kind, obj_id, body):
+        obj = self.data[kind][obj_id]
+        if kind == "hosts" and "name" in body:
+            self.host_names[obj.get("name")] -= 1
+            self.host_names[body["name"]] += 1
+        obj.update(body)
+        return obj
+
+    def delete(self, kind, obj_id):
+        if kind == "nodes":
+            return self.delete_node(obj_id)
+        obj = self.data[kind].pop(obj_id)
+        if kind == "hosts":
+            self.host_names[obj.get("name")] -= 1
+
+    def delete_node(self, node_id):
+        full_value = self.data["nodes"].pop(node_id)["full_value"]
+        for k in [ k for k, v in self.data["nodes"].items() if v["full_value"].startswith(full_value + '/') ]:
+            del self.data["nodes"][k]
+
+    @staticmethod
+    def refs(items):
+        return [ {"id": x.get("pk") or x.get("id")} for x in items or [] ]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    state: MockState = None
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, code, obj = None):
+        body = b'' if obj is None else json.dumps(obj).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def page(self, items, query):
+        if 'limit' not in query:
+            return items
+        limit, offset = int(query['limit'][0]), int(query.get('offset', ['0'])[0])
+        return {"count": len(items), "next": None, "previous": None, "results": items[offset:offset + limit]}
+
+    def handle_request(self, method):
+        url = urlsplit(self.path)
+        path, query = url.path, parse_qs(url.query)
+        state = self.state
+
+        if path == '/__bench/calls':
+            with state.lock:
+                return self.send(200, {"calls": dict(state.calls), "errors": dict(state.errors)})
+        if path == '/__bench/reset':
+            with state.lock:
+                state.calls.clear()
+                state.errors.clear()
+            return self.send(200, {})
+
+        endpoint = f"{method} {re.sub('/' + ID + '/', '/{id}/', path)}"
+        body = self.read_body() if method in ('POST', 'PUT', 'PATCH') else {}
+        with state.lock:
+            state.calls[endpoint] += 1
+
+        if state.latency or state.jitter:
+            time.sleep(state.latency + random.random() * state.jitter)
+        if state.error_rate and random.random() < state.error_rate:
+            with state.lock:
+                state.errors[endpoint] += 1
+            return self.send(random.choice([429, 500, 502, 503]), {"detail": "injected error"})
+
+        with state.lock:
+            code, obj = self.route(method, path, query, body)
+        self.send(code, obj)
+
+    def route(self, method, path, query, body):
+        state = self.state
+        if path == '/api/ci/c3mc/jumpserver':
+            return 200, {"stat": True, "data": state.c3_hosts}
+        if path == '/api/connector/default/auth/tree/userauth':
+            return 200, {"stat": True, "data": state.c3_users}
+        if path == '/api/v1/common/resources/cache/' and method == 'POST':
+            spm = str(uuid.uuid4())
+            state.resources[spm] = body.get("resources") or []
+            return 201, {"spm": spm}
+
+        for kind, base in COLLECTIONS.items():
+            objects = state.data[kind]
+            if path == base and method == 'GET':
+                items = list(objects.values())
+                for field in ('name', 'username', 'address'):
+                    if field in query:
+                        items = [ x for x in items if x.get(field) == query[field][0] ]
+                return 200, self.page(items, query)
+
+            if path == base and method == 'DELETE':
+                ids = state.resources.pop(query.get('spm', [''])[0], None)
+                if ids is None:
+                    return 400, {"detail": "spm is required"}
+                for obj_id in ids:
+                    if obj_id in objects:
+                        state.delete(kind, obj_id)
+                return 204, None
+
+            if path == base and method == 'POST':
+                if kind == "nodes":
+                    return 201, state.create_node(body)
+                if kind == "hosts":
+                    if state.host_names[body.get("name")] > 0:
+                        return 400, {"name": ["字段必须唯一"]}
+                    body["nodes"] = state.refs(body.get("nodes"))
+                    return 201, state.add_host(body)
+                if kind == "perms":
+                    body["users"] = state.refs(body.get("users"))
+                    body["nodes"] = state.refs(body.get("nodes"))
+                return 201, state.add(kind, body)
+
+            match = re.fullmatch(re.escape(base) + ID + '/', path)
+            if match:
+                obj_id = match.group(1)
+                if obj_id not in objects:
+                    return 404, {"detail": "Not found."}
+                if method == 'GET':
+                    return 200, objects[obj_id]
+                if method == 'DELETE':
+                    state.delete(kind, obj_id)
+                    return 204, None
+                if method in ('PUT', 'PATCH'):
+                    for field in ('users', 'nodes'):
+                        if field in body:
+                            body[field] = state.refs(body[field])
+                    return 200, state.update(kind, obj_id, body)
+
+        return 404, {"detail": f"No route: {method} {path}"}
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def do_PATCH(self):
+        self.handle_request('PATCH')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+
+def make_server(state: MockState, host = '127.0.0.1', port = 0) -> ThreadingHTTPServer:
+    handler = type('BoundMockHandler', (MockHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in JumpServer/OpenC3 server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--hosts', type=int, default=1000, help="number of OpenC3 hosts")
+    parser.add_argument('--depth', type=int, default=4, help="service tree depth")
+    parser.add_argument('--fanout', type=int, default=5, help="children per tree node")
+    parser.add_argument('--users', type=int, default=200, help="number of OpenC3 users")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.0, help="fixed delay per request (seconds)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="extra random delay per request (seconds)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests answered with 429/5xx")
+    args = parser.parse_args()
+
+    c3_hosts, c3_users = datagen.generate(args.hosts, args.depth, args.fanout, args.users, args.seed)
+    server = make_server(MockState(c3_hosts, c3_users, args.latency, args.jitter, args.error_rate), args.host, args.port)
+    print(f"listening on http://{args.host}:{server.server_address[1]}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""离线压测：在本地模拟服务上运行 sync()，按阶段统计耗时、请求数和内存峰值
+
+    python3 -m bench.run --hosts 20000 --users 2000 --latency 0.002
+
+依次执行三次同步：cold（空的 JumpServer 全量同步）、steady（无变化的全量同步）、
+incremental（无变化的增量同步）。
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+import urllib.request
+from contextlib import contextmanager
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIG_TEMPLATE = """[JumpServer]
+weburl = {url}
+key_id = bench
+secret = bench
+
+[OpenC3]
+api_url = {url}
+api_key = bench
+
+[Settings]
+state_dir = {state_dir}
+
+[Metrics]
+json_file = {state_dir}/metrics.json
+
+[Templates]
+template_id = 00000000-0000-0000-0000-000000000000
+account_name = bench
+"""
+
+
+class RssSampler(object):
+    """后台线程定期采样进程 RSS，记录每个阶段的峰值（MB）"""
+
+    def __init__(self, interval = 0.005):
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+    def rss(self) -> float:
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * self.page_size / 1048576
+        except OSError:
+            # 非 Linux 平台只能拿到进程生命周期内的峰值
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, self.rss())
+
+    def reset(self):
+        self.peak = self.rss()
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+
+class PhaseRecorder(object):
+    """phase hook：记录每个阶段的耗时、服务端收到的请求数、错误数和 RSS 峰值"""
+
+    def __init__(self, url, sampler):
+        self.url = url
+        self.sampler = sampler
+        self.results = []
+
+    def server_calls(self):
+        with urllib.request.urlopen(f"{self.url}/__bench/calls") as response:
+            data = json.load(response)
+        return sum(data["calls"].values()), sum(data["errors"].values())
+
+    @contextmanager
+    def __call__(self, name):
+        calls, errors = self.server_calls()
+        self.sampler.reset()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            peak = max(self.sampler.peak, self.sampler.rss())
+            calls_after, errors_after = self.server_calls()
+            self.results.append({
+                "phase": name,
+                "wall": round(wall, 4),
+                "calls": calls_after - calls,
+                "errors": errors_after - errors,
+                "peak_rss_mb": round(peak, 1),
+            })
+
+
+def start_server(args):
+    cmd = [sys.executable, '-m', 'bench.mock_server', '--port', '0',
+           '--hosts', str(args.hosts), '--depth', str(args.depth), '--fanout', str(args.fanout),
+           '--users', str(args.users), '--seed', str(args.seed),
+           '--latency', str(args.latency), '--jitter', str(args.jitter), '--error-rate', str(args.error_rate)]
+    process = subprocess.Popen(cmd, cwd=BASE_DIR, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line.startswith("listening on "):
+        process.kill()
+        raise RuntimeError(f"mock server failed to start: {line}")
+    return process, line.split()[-1]
+
+
+def print_report(runs):
+    print(f"{'run':<12} {'phase':<14} {'wall(s)':>9} {'calls':>8} {'errors':>7} {'peak RSS(MB)':>13}")
+    for run in runs:
+        for x in run["phases"]:
+            print(f"{run['run']:<12} {x['phase']:<14} {x['wall']:>9.3f} {x['calls']:>8} {x['errors']:>7} {x['peak_rss_mb']:>13.1f}")
+        print(f"{run['run']:<12} {'total':<14} {run['wall']:>9.3f} {sum(x['calls'] for x in run['phases']):>8} "
+              f"{sum(x['errors'] for x in run['phases']):>7} {max([x['peak_rss_mb'] for x in run['phases']] or [0]):>13.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sync() against local stand-in servers")
+    parser.add_argument('--hosts', type=int, default=1000)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--fanout', type=int, default=5)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--runs', default='cold,steady,incremental', help="comma separated runs: cold, steady, incremental")
+    parser.add_argument('--json', help="write the results to this file")
+    parser.add_argument('--verbose', action='store_true', help="keep the sync log output")
+    args = parser.parse_args()
+
+    process, url = start_server(args)
+    state_dir = tempfile.mkdtemp(prefix='sync-bench-')
+    config_file = os.path.join(state_dir, 'config.ini')
+    with open(config_file, 'w') as f:
+        f.write(CONFIG_TEMPLATE.format(url=url, state_dir=state_dir))
+
+    sys.path.insert(0, BASE_DIR)
+    import sync
+    from utils.config import configure, Settings
+    from utils.logger import setup_logging
+    from utils.phase import add_phase_hook, remove_phase_hook
+    configure(Settings(config_file))
+    setup_logging(None)
+    if not args.verbose:
+        logging.getLogger('sync').setLevel(logging.WARNING)
+
+    sampler = RssSampler()
+    sampler.start()
+    runs = []
+    try:
+        for run in args.runs.split(','):
+            recorder = PhaseRecorder(url, sampler)
+            add_phase_hook(recorder)
+            start = time.perf_counter()
+            sync.sync(full=(run != 'incremental'))
+            runs.append({"run": run, "wall": round(time.perf_counter() - start, 4), "phases": recorder.results})
+            remove_phase_hook(recorder)
+    finally:
+        sampler.stop()
+        process.kill()
+
+    print_report(runs)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"args": vars(args), "runs": runs}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
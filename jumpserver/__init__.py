@@ -1,5 +1,6 @@
 from .service import JumpServerService
 from .api import JumpServerAPI
+from .plan import ChangeSet
 
-__all__ = ["JumpServerService", "JumpServerAPI"] 
+__all__ = ["JumpServerService", "JumpServerAPI", "ChangeSet"] 
 
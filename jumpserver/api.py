@@ -1,28 +1,31 @@
 # -*- coding: utf-8 -*-
 
-import os
-import sys
 import json
-import time
-import logging
-import requests
 from typing import Dict, List, Any, Tuple
-from httpsig.requests_auth import HTTPSignatureAuth
-from utils.logger import logger
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from utils.logger import logger_for
+from utils.journal import journaled
+from utils.transport import HttpTransport
+from .models import Asset
+from utils import config
 
 class JumpServerAPI(object):
     """JumpServer API 客户端类"""
 
-    def __init__(self, base_url, key_id, secret):
+    def __init__(self, base_url, key_id, secret, http=None,
+                 page_size=None, page_workers=None, name='', settings=None):
+        # httpsig 依赖较重，只在创建客户端时导入
+        from httpsig.requests_auth import HTTPSignatureAuth
+
         self.base_url = base_url
         self.key_id = key_id
         self.secret = secret
 
         self.signature_headers = ['(request-target)', 'accept', 'date']
-        self.localtime = time.asctime(time.localtime(time.time()))
         self.headers = {
+            'accept': 'application/json',
             'content-type': 'application/json',
-            'date': self.localtime
         }
         self.auth = HTTPSignatureAuth(
             key_id=self.key_id,
@@ -30,36 +33,81 @@ class JumpServerAPI(object):
             algorithm='hmac-sha256',
             headers=self.signature_headers
         )
-        self.logger = logger
+        settings = settings or config.settings
+        # date 头由 transport 在每个请求发出时生成
+        self.http = http or HttpTransport(headers=self.headers, auth=self.auth, sign_date=True, target=name, settings=settings)
+        self.page_size = page_size or settings.JUMPSERVER_PAGE_SIZE
+        self.page_workers = settings.JUMPSERVER_PAGE_WORKERS if page_workers is None else page_workers
+        self.logger = logger_for(name)
+        # 不为空时所有写请求都记录到写操作日志
+        self.journal = None
+
+    def get_page(self, url, params, offset):
+        """获取列表接口的一页数据"""
+        response = self.http.get(url, params=dict(params, limit=self.page_size, offset=offset))
+        response.raise_for_status()
+        return response.json()
+
+    def list_objects(self, path, params=None):
+        """按 limit/offset 分页遍历列表接口，逐条产出结果
+
+        第一页返回总数后，剩余页最多 page_workers 个并发获取，按顺序产出，
+        同一时间内存中最多保留 page_workers 页数据。
+        """
+        url = f"{self.base_url}{path}"
+        params = dict(params or {})
+        first = self.get_page(url, params, 0)
+        # 服务端未开启分页时直接返回列表
+        if isinstance(first, list):
+            yield from first
+            return
+        yield from first.get("results", [])
+
+        offsets = iter(range(self.page_size, first.get("count", 0), self.page_size))
+        if self.page_workers <= 1:
+            for offset in offsets:
+                yield from self.get_page(url, params, offset).get("results", [])
+            return
+
+        with ThreadPoolExecutor(max_workers=self.page_workers) as executor:
+            pending = deque(executor.submit(self.get_page, url, params, x) for x in self.first_n(offsets, self.page_workers))
+            while pending:
+                page = pending.popleft().result()
+                for offset in self.first_n(offsets, 1):
+                    pending.append(executor.submit(self.get_page, url, params, offset))
+                yield from page.get("results", [])
+
+    @staticmethod
+    def first_n(iterator, n):
+        return [ x for _, x in zip(range(n), iterator) ]
 
     def get_nodes_info(self):
         """获取节点信息"""
         nodes_dict = {}
-        url = f"{self.base_url}/api/v1/assets/nodes/"
-        response = requests.get(url, auth=self.auth, headers=self.headers).json()
-        for i in response:
-            tmp = {i['full_value']: i['id']}
-            nodes_dict.update(tmp)
+        for i in self.list_objects("/api/v1/assets/nodes/"):
+            nodes_dict[i['full_value']] = i['id']
         return nodes_dict
  
     def get_host_from_node(self, node_id):
         """获取指定node下面的服务器列表"""
-        host_dict = {}
         query_params = {"node": node_id}
         # 获取所有服务器的全量列表。 上面的过滤条件没用
-        url = f"{self.base_url}/api/v1/assets/hosts/"
-        response = requests.get(url, auth=self.auth, headers=self.headers, params=query_params).json()
-        for i in response:
-            tmp = {
-                i["name"]: {
-                    "ID": i["id"],
-                    "address": i["address"],
-                    "NODES": i["nodes"][0]["id"] if i["nodes"] else ""
-                }
-            }
-            host_dict.update(tmp)
+        return self.format_host_list(self.list_objects("/api/v1/assets/hosts/", query_params))
+
+    def get_hosts_by_address(self, address):
+        """获取指定IP的服务器列表"""
+        hosts = self.list_objects("/api/v1/assets/hosts/", {"address": address})
+        return self.format_host_list(x for x in hosts if x["address"] == address)
+
+    @staticmethod
+    def format_host_list(hosts):
+        """主机名 -> Asset"""
+        host_dict = {}
+        for i in hosts:
+            host_dict[i["name"]] = Asset.from_wire(i)
         return host_dict
  
+    @journaled("create_node", lambda full_name: full_name)
     def create_node(self, full_name):
         node_name = full_name.split('/')[-1]
         """在指定父节点下创建新节点
@@ -79,11 +127,9 @@ class JumpServerAPI(object):
                 "full_value": full_name
             }
             
-            response = requests.post(
+            response = self.http.post(
                 url=url, 
-                data=json.dumps(payload), 
-                auth=self.auth, 
-                headers=self.headers
+                data=json.dumps(payload)
             )
             
             if response.status_code in [200, 201]:
@@ -98,64 +144,80 @@ class JumpServerAPI(object):
             self.logger.error(f"Error creating node {node_name}: {str(e)}")
             return {}
 
+    @journaled("delete_node", lambda id: id)
     def delete_node(self, id):
-        """删除服务器"""
+        """删除节点，节点已经不存在时同样视为成功"""
         url = f"{self.base_url}/api/v1/assets/nodes/{id}/"
-        response = requests.delete(url=url, auth=self.auth, headers=self.headers)
-        return response.status_code in [200, 204]
+        response = self.http.delete(url=url)
+        return response.status_code in [200, 204, 404]
 
+    @journaled("add_host", lambda params: params["address"])
     def add_host(self, params):
         """添加服务器"""
         url = f"{self.base_url}/api/v1/assets/hosts/"
-        response = requests.post(url=url, data=json.dumps(params), auth=self.auth, headers=self.headers).json()
+        response = self.http.post(url=url, data=json.dumps(params)).json()
         return response
 
-    def delete_host(self, host_id):
-        """删除服务器"""
+    @journaled("patch_host", lambda host_id, params: host_id)
+    def patch_host(self, host_id, params):
+        """只更新服务器中指定的字段"""
         url = f"{self.base_url}/api/v1/assets/hosts/{host_id}/"
-        response = requests.delete(url=url, auth=self.auth, headers=self.headers)
-        return response.status_code in [200, 204]
+        response = self.http.patch(url=url, data=json.dumps(params))
+        return response.status_code == 200, response.json()
 
-    def delete_auth(self, auth_id):
-        """删除服务器"""
-        url = f"{self.base_url}/api/v1/perms/asset-permissions/{auth_id}/"
-        response = requests.delete(url=url, auth=self.auth, headers=self.headers)
-        return response.status_code in [200, 204]
+    @journaled("delete", lambda path, object_id: object_id)
+    def delete_object(self, path, object_id):
+        """删除一个对象，对象已经不存在时同样视为成功"""
+        url = f"{self.base_url}{path}{object_id}/"
+        response = self.http.delete(url=url)
+        return response.status_code in [200, 204, 404]
+
+    @journaled("bulk_delete", lambda path, ids: list(ids))
+    def bulk_delete(self, path, ids):
+        """
+        批量删除：先把ID列表缓存成 spm，再对列表接口发送 DELETE ?spm=
+        返回 HTTP 状态码，接口不存在时为 404/405
+        """
+        url = f"{self.base_url}/api/v1/common/resources/cache/"
+        response = self.http.post(url=url, data=json.dumps({"resources": list(ids)}))
+        if response.status_code not in [200, 201]:
+            return response.status_code
+        spm = response.json().get("spm")
+        if not spm:
+            return 400
+        response = self.http.delete(url=f"{self.base_url}{path}", params={"spm": spm})
+        return response.status_code
 
     # 创建授权规则
     def get_asset_permissions(self, params):
         """获取授权规则信息"""
-        url = f"{self.base_url}/api/v1/perms/asset-permissions/"
-        response = requests.get(url=url, params=params, auth=self.auth, headers=self.headers).json()
-        return response
+        return list(self.list_objects("/api/v1/perms/asset-permissions/", params))
 
     def get_asset_permissions_details(self, permissions_id):
         """获取授权规则信息"""
         url = f"{self.base_url}/api/v1/perms/asset-permissions/{permissions_id}/"
-        response = requests.get(url=url, auth=self.auth, headers=self.headers).json()
+        response = self.http.get(url=url).json()
         return response
 
     # 创建授权规则
+    @journaled("create_rule", lambda params: params["name"])
     def create_asset_permissions(self, params):
         """添加授权规则"""
         url = f"{self.base_url}/api/v1/perms/asset-permissions/"
-        response = requests.post(url=url, data=json.dumps(params), auth=self.auth, headers=self.headers).json()
+        response = self.http.post(url=url, data=json.dumps(params)).json()
         return response
 
     # 修改授权规则
-    def update_asset_permissions(self, permissions_id, params):
-        """更新授权规则"""
+    @journaled("patch_rule", lambda permissions_id, params: permissions_id)
+    def patch_asset_permissions(self, permissions_id, params):
+        """只更新授权规则中指定的字段，返回 (是否成功, 响应内容)"""
         url = f"{self.base_url}/api/v1/perms/asset-permissions/{permissions_id}/"
-        response = requests.put(url=url, data=json.dumps(params), auth=self.auth, headers=self.headers).json()
-        return response
-
-    # 获取指定用户名的id
-    def get_user_id(self, params):
-        """获取用户信息"""
-        user_id = ""
-        url = f"{self.base_url}/api/v1/users/users/"
-        response = requests.get(url=url, params=params, auth=self.auth, headers=self.headers).json()
-        if response:
-            user_id = response[0]["id"]
-        return user_id
+        response = self.http.patch(url=url, data=json.dumps(params))
+        return response.status_code == 200, response.json()
 
+    def get_users_map(self):
+        """获取全部用户 用户名 -> id"""
+        users_dict = {}
+        for i in self.list_objects("/api/v1/users/users/"):
+            users_dict[i["username"]] = i["id"]
+        return users_dict
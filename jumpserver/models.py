@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Any, Tuple
+
+# JumpServer 主机上的自定义字段 -> OpenC3 主机字段
+CUSTOM_FIELDS = {
+    "specific_system_environments": "environment",
+    "specific_owner": "owner",
+}
+
+
+class Platform(object):
+    """JumpServer 平台描述，所有主机共用同一个实例"""
+
+    __slots__ = ("id", "name", "protocols", "username", "secret_type", "secret_label")
+
+    def __init__(self, id, name, protocols, username, secret_type, secret_label):
+        self.id = id
+        self.name = name
+        # ((协议名, 端口), ...)
+        self.protocols = protocols
+        self.username = username
+        self.secret_type = secret_type
+        self.secret_label = secret_label
+
+    def to_wire(self) -> Dict[str, Any]:
+        return {"id": self.id, "name": self.name}
+
+    def protocols_wire(self) -> List[Dict[str, Any]]:
+        return [ {"name": name, "port": port} for name, port in self.protocols ]
+
+
+LINUX = Platform(1, 'Linux', (('ssh', 22),), 'root', 'ssh_key', 'SSH 密钥')
+WINDOWS = Platform(2, 'Windows', (('rdp', 3389),), 'administrator', 'password', '密码')
+
+# 映射OpenC3平台名称到JumpServer平台
+PLATFORMS = {
+    'linux': LINUX,
+    'windows': WINDOWS,
+    'centos': LINUX,
+    'ubuntu': LINUX,
+    'redhat': LINUX,
+    'windows server': WINDOWS,
+}
+
+
+class HostSpec(object):
+    """期望在 JumpServer 上存在的主机
+
+    platform 和 template 是共享的描述对象，nodes 用 full_value 表示，
+    接口需要的 dict 只在 to_wire 时生成。
+    """
+
+    __slots__ = ("name", "address", "platform", "template", "trees", "environment", "owner")
+
+    def __init__(self, name, address, platform, template, trees, environment = None, owner = None):
+        self.name = name
+        self.address = address
+        self.platform = platform
+        # {"template_id": .., "account_name": ..}，同一网段的主机共用
+        self.template = template
+        self.trees = trees
+        self.environment = environment
+        self.owner = owner
+
+    def to_wire(self, nodes, comment) -> Dict[str, Any]:
+        """生成添加主机接口的参数，nodes 为 [{"id": .., "name": ..}]"""
+        platform = self.platform
+        params = {
+            "name": self.name,
+            "address": self.address,
+            "platform": platform.to_wire(),
+            "accounts": [{
+                'template': self.template["template_id"],
+                'name': self.template["account_name"],
+                'username': platform.username,
+                'secret_type': {
+                    'value': platform.secret_type,
+                    'label': platform.secret_label
+                },
+                'privileged': True,
+            }],
+            "nodes": nodes,
+            "is_active": True,
+            "protocols": platform.protocols_wire(),
+            "comment": comment
+        }
+
+        # 添加自定义字段
+        if self.environment is not None:
+            params["specific_system_environments"] = self.environment
+        if self.owner is not None:
+            params["specific_owner"] = self.owner
+        return params
+
+    def fields(self, nodes = None) -> Dict[str, Any]:
+        """参与漂移比较的字段，键与 to_wire 的参数名一致；nodes 为预期存在的节点 full_value 集合"""
+        trees = self.trees if nodes is None else [ x for x in self.trees if x in nodes ]
+        fields = {
+            "name": self.name,
+            "platform": self.platform.id,
+            "nodes": tuple(sorted(trees)),
+            "accounts": (self.template["template_id"],),
+        }
+        for field, attr in CUSTOM_FIELDS.items():
+            if getattr(self, attr) is not None:
+                fields[field] = getattr(self, attr)
+        return fields
+
+    def to_dict(self) -> Dict[str, Any]:
+        """写操作日志检查点中的格式，平台只保存名称"""
+        data = { x: getattr(self, x) for x in self.__slots__ }
+        data["platform"] = self.platform.name
+        data["trees"] = list(self.trees)
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["name"], data["address"], PLATFORMS[data["platform"].lower()], data["template"],
+                   data["trees"], data.get("environment"), data.get("owner"))
+
+
+class Asset(object):
+    """JumpServer 上已存在的主机
+
+    accounts 和 extra 只保存接口实际返回的内容，没有返回的字段为 None / 不出现，不参与比较。
+    """
+
+    __slots__ = ("id", "name", "address", "nodes", "platform", "accounts", "extra")
+
+    def __init__(self, id, name, address, nodes = (), platform = None, accounts = None, extra = None):
+        self.id = id
+        self.name = name
+        self.address = address
+        # 所属节点ID
+        self.nodes = nodes
+        # 平台ID
+        self.platform = platform
+        # 账号使用的模板ID
+        self.accounts = accounts
+        # 自定义字段
+        self.extra = extra or {}
+
+    @classmethod
+    def from_wire(cls, data):
+        platform = data.get("platform")
+        if isinstance(platform, dict):
+            platform = platform.get("id")
+        accounts = data.get("accounts")
+        if accounts is not None:
+            templates = ( x.get("template") for x in accounts if isinstance(x, dict) )
+            accounts = tuple( x.get("id") if isinstance(x, dict) else x for x in templates if x )
+        extra = { k: data[k] for k in CUSTOM_FIELDS if k in data }
+        return cls(data["id"], data["name"], data["address"], tuple( x["id"] for x in data.get("nodes") or [] ),
+                   platform, accounts, extra)
+
+    def fields(self, node_names) -> Dict[str, Any]:
+        """当前的字段，格式同 HostSpec.fields；node_names 为节点 id -> full_value"""
+        fields = {
+            "name": self.name,
+            "platform": self.platform,
+            "nodes": tuple(sorted( node_names.get(x, x) for x in self.nodes )),
+        }
+        if self.accounts is not None:
+            fields["accounts"] = tuple(sorted(set(self.accounts)))
+        fields.update(self.extra)
+        return fields
+
+
+# 授权规则的动作，所有规则共用
+ACTIONS = ("connect", "upload", "download", "copy", "paste", "delete")
+
+# 根据用户级别获取账户权限列表
+ACCOUNTS_BY_LEVEL = {
+    "1": ("@SPEC", "backend"),
+    "2": ("@SPEC", "root"),
+    "3": ("@ALL",),
+}
+
+
+class RuleSpec(object):
+    """期望的 C3_ 授权规则，由同一服务树、同一级别的用户组成"""
+
+    __slots__ = ("name", "treename", "level", "usernames", "users", "nodes", "accounts", "actions")
+
+    def __init__(self, name, treename, level):
+        self.name = name
+        self.treename = treename
+        self.level = level
+        self.usernames = []
+        # 以下字段在规划时填充：用户ID、节点 full_value、账号、动作
+        self.users = ()
+        self.nodes = ()
+        self.accounts = ()
+        self.actions = ACTIONS
+
+    def fields(self) -> Dict[str, Any]:
+        """参与比较的字段"""
+        return {"users": self.users, "nodes": self.nodes, "accounts": self.accounts, "actions": self.actions}
+
+    def to_dict(self) -> Dict[str, Any]:
+        """写操作日志检查点中的格式"""
+        return { x: list(getattr(self, x)) if isinstance(getattr(self, x), (tuple, list)) else getattr(self, x) for x in self.__slots__ }
+
+    @classmethod
+    def from_dict(cls, data):
+        spec = cls(data["name"], data["treename"], data["level"])
+        spec.usernames = list(data["usernames"])
+        spec.users = tuple(data["users"])
+        spec.nodes = tuple(data["nodes"])
+        spec.accounts = tuple(data["accounts"])
+        spec.actions = tuple(data["actions"])
+        return spec
+
+    def to_wire(self, node_pks) -> Dict[str, Any]:
+        """生成创建授权规则接口的参数，node_pks 为 [{"pk": ..}]"""
+        # 获取当前UTC时间
+        now = datetime.now(timezone.utc)
+
+        # 长期有效
+        expired_date = now + timedelta(days=365 * 100)
+
+        return {
+            "assets": [],
+            "nodes": node_pks,
+            "users": [ {"pk": x} for x in self.users ],
+            "accounts": list(self.accounts),
+            "actions": list(self.actions),
+            "is_active": True,
+            # 时间格式化
+            "date_start": now.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z",
+            "date_expired": expired_date.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z",
+            "name": self.name
+        }
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+from typing import Dict, List, Any, NamedTuple, Tuple
+from collections import Counter
+from .models import HostSpec, RuleSpec
+
+
+class NodeCreate(NamedTuple):
+    full_value: str
+
+
+class NodeDelete(NamedTuple):
+    full_value: str
+    id: str
+
+
+class HostAdd(NamedTuple):
+    name: str
+    address: str
+    # 期望的主机，接口参数在执行时生成，节点 full_value 再转换成节点ID
+    spec: HostSpec
+
+
+class HostUpdate(NamedTuple):
+    name: str
+    address: str
+    id: str
+    # 期望的主机，执行时只提交 fields 中列出的字段
+    spec: HostSpec
+    fields: Tuple[str, ...]
+    # 主机上 C3 以外的节点ID，更新节点时一并提交，保持不变
+    other_nodes: Tuple[str, ...] = ()
+
+
+class HostDelete(NamedTuple):
+    name: str
+    address: str
+    id: str
+
+
+class RuleCreate(NamedTuple):
+    name: str
+    # 期望的授权规则，其中 nodes 为节点 full_value
+    spec: RuleSpec
+
+
+class RuleUpdate(NamedTuple):
+    name: str
+    id: str
+    # 只包含有变化的字段
+    changes: Dict[str, Any]
+
+
+class RuleDelete(NamedTuple):
+    name: str
+    id: str
+
+
+# 每一类变更对应的写接口
+ENDPOINTS = {
+    NodeCreate: "POST /api/v1/assets/nodes/",
+    NodeDelete: "DELETE /api/v1/assets/nodes/{id}/",
+    HostAdd: "POST /api/v1/assets/hosts/",
+    HostUpdate: "PATCH /api/v1/assets/hosts/{id}/",
+    HostDelete: "DELETE /api/v1/assets/hosts/{id}/",
+    RuleCreate: "POST /api/v1/perms/asset-permissions/",
+    RuleUpdate: "PATCH /api/v1/perms/asset-permissions/{id}/",
+    RuleDelete: "DELETE /api/v1/perms/asset-permissions/{id}/",
+}
+
+# 支持批量删除的变更对应的列表接口，每批还需要一次缓存ID列表的请求
+BULK_ENDPOINTS = {
+    HostDelete: "DELETE /api/v1/assets/hosts/",
+    RuleDelete: "DELETE /api/v1/perms/asset-permissions/",
+}
+BULK_CACHE_ENDPOINT = "POST /api/v1/common/resources/cache/"
+
+# ChangeSet 中的变更列表 -> 变更类型，用于写操作日志检查点的转换
+CHANGE_LISTS = {
+    "nodes_create": NodeCreate,
+    "nodes_delete": NodeDelete,
+    "hosts_add": HostAdd,
+    "hosts_update": HostUpdate,
+    "hosts_delete": HostDelete,
+    "rules_create": RuleCreate,
+    "rules_update": RuleUpdate,
+    "rules_delete": RuleDelete,
+}
+COUNTERS = ("hosts_unchanged", "rules_unchanged", "hosts_total", "rules_total")
+
+
+class ChangeSet(object):
+    """一次同步需要执行的全部变更，由 JumpServerService.plan_* 生成，apply 执行"""
+
+    def __init__(self):
+        self.nodes_create: List[NodeCreate] = []
+        self.nodes_delete: List[NodeDelete] = []
+        self.hosts_add: List[HostAdd] = []
+        self.hosts_update: List[HostUpdate] = []
+        self.hosts_delete: List[HostDelete] = []
+        self.rules_create: List[RuleCreate] = []
+        self.rules_update: List[RuleUpdate] = []
+        self.rules_delete: List[RuleDelete] = []
+        # 已存在且无需变更的主机、规则数量
+        self.hosts_unchanged = 0
+        self.rules_unchanged = 0
+        # JumpServer 上已有的主机、C3_ 授权规则数量，用于删除保护
+        self.hosts_total = 0
+        self.rules_total = 0
+        # 执行完成后预期存在的节点 full_value，plan_nodes 之前为 None
+        self.nodes = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换成可以保存为 JSON 的格式（写操作日志检查点），不包含只在规划阶段使用的 nodes"""
+        data = { k: [ self.change_to_dict(x) for x in getattr(self, k) ] for k in CHANGE_LISTS }
+        data.update( (k, getattr(self, k)) for k in COUNTERS )
+        return data
+
+    @staticmethod
+    def change_to_dict(change) -> Dict[str, Any]:
+        data = change._asdict()
+        if "spec" in data:
+            data["spec"] = data["spec"].to_dict()
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        plan = cls()
+        for name, kind in CHANGE_LISTS.items():
+            setattr(plan, name, [ cls.change_from_dict(kind, x) for x in data.get(name, []) ])
+        for name in COUNTERS:
+            setattr(plan, name, data.get(name, 0))
+        return plan
+
+    @staticmethod
+    def change_from_dict(kind, data):
+        data = dict(data)
+        if kind in (HostAdd, HostUpdate):
+            data["spec"] = HostSpec.from_dict(data["spec"])
+        elif kind is RuleCreate:
+            data["spec"] = RuleSpec.from_dict(data["spec"])
+        for field in ("fields", "other_nodes"):
+            if field in data:
+                data[field] = tuple(data[field])
+        return kind(**data)
+
+    def changes(self) -> list:
+        return (self.nodes_create + self.hosts_add + self.hosts_update + self.hosts_delete + self.rules_delete
+                + self.rules_create + self.rules_update + self.nodes_delete)
+
+    def __len__(self):
+        return len(self.changes())
+
+    def call_budget(self, bulk_size = 0) -> Counter:
+        """执行本计划需要的写请求数量（按接口统计，不含名称冲突时的重试和批量删除失败后的逐个删除）"""
+        budget = Counter()
+        for x in self.changes():
+            if bulk_size > 0 and type(x) in BULK_ENDPOINTS:
+                continue
+            budget[ENDPOINTS[type(x)]] += 1
+        if bulk_size > 0:
+            for kind, changes in ((HostDelete, self.hosts_delete), (RuleDelete, self.rules_delete)):
+                batches = (len(changes) + bulk_size - 1) // bulk_size
+                if batches:
+                    budget[BULK_ENDPOINTS[kind]] += batches
+                    budget[BULK_CACHE_ENDPOINT] += batches
+        return budget
+
+    def over_delete_limit(self, ratio, minimum = 0) -> List[str]:
+        """删除数量超过已有数量 ratio 比例的对象类型，ratio 为 0 时不检查"""
+        over = []
+        if ratio <= 0:
+            return over
+        for kind, count, total in (("hosts", len(self.hosts_delete), self.hosts_total),
+                                   ("rules", len(self.rules_delete), self.rules_total)):
+            if count > minimum and count > ratio * total:
+                over.append(f"{kind} {count}/{total}")
+        return over
+
+    def summary(self) -> str:
+        return (f"nodes +{len(self.nodes_create)} -{len(self.nodes_delete)}, "
+                f"hosts +{len(self.hosts_add)} ~{len(self.hosts_update)} -{len(self.hosts_delete)} ={self.hosts_unchanged}, "
+                f"rules +{len(self.rules_create)} ~{len(self.rules_update)} -{len(self.rules_delete)} ={self.rules_unchanged}")
+
+    def format(self) -> str:
+        lines = []
+        for x in self.changes():
+            if isinstance(x, (NodeCreate, NodeDelete)):
+                lines.append(f"{type(x).__name__:<12} {x.full_value}")
+            elif isinstance(x, HostUpdate):
+                lines.append(f"{type(x).__name__:<12} {x.name} ({x.address}) [{', '.join(x.fields)}]")
+            elif isinstance(x, (HostAdd, HostDelete)):
+                lines.append(f"{type(x).__name__:<12} {x.name} ({x.address})")
+            elif isinstance(x, RuleUpdate):
+                lines.append(f"{type(x).__name__:<12} {x.name} [{', '.join(x.changes)}]")
+            else:
+                lines.append(f"{type(x).__name__:<12} {x.name}")
+        return "\n".join(lines)
@@ -1,345 +1,636 @@
 # -*- coding: utf-8 -*-
 
-import os
-import sys
-import json
 import time
-import logging
-import requests
 from typing import Dict, List, Any, Tuple
-from datetime import datetime, timedelta, timezone
-from httpsig.requests_auth import HTTPSignatureAuth
-from utils.logger import logger
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from utils.logger import logger_for
 from .api import JumpServerAPI
+from .models import Platform, HostSpec, Asset, RuleSpec, LINUX, PLATFORMS, ACCOUNTS_BY_LEVEL
+from .plan import ChangeSet, NodeCreate, NodeDelete, HostAdd, HostUpdate, HostDelete, RuleCreate, RuleUpdate, RuleDelete
 from utils import common
+from openc3.models import C3Host
+from utils import config
+from utils.phase import phase
+from utils.snapshot import rule_name_of
+
+# 所有同步节点的根节点
+C3_ROOT = '/DEFAULT/C3'
 
 class JumpServerService(object):
 
-    def __init__(self, base_url, key_id, secret):
-        self.api = JumpServerAPI(base_url, key_id, secret )
-        self.logger = logger
+    def __init__(self, base_url, key_id, secret, name = '', settings = None ):
+        # 同步目标名称，默认目标为空；每个目标有独立的连接池、请求策略和缓存
+        self.name = name
+        self.settings = settings or config.settings
+        self.api = JumpServerAPI(base_url, key_id, secret, page_size=self.settings.JUMPSERVER_PAGE_SIZE,
+                                 page_workers=self.settings.JUMPSERVER_PAGE_WORKERS, name=name,
+                                 settings=self.settings )
+        self.logger = logger_for(name)
+        self.node_info = None
+        self.user_ids = None
+        self.bulk_delete_supported = True
+
+    def reset_caches(self):
+        """清空节点索引和用户目录，下次使用时重新拉取"""
+        self.node_info = None
+        self.user_ids = None
+
+    def get_node_info(self, force_refresh = False ):
+        """获取节点索引 full_value -> id，一次运行内只拉取一次"""
+        if (force_refresh) or ( self.node_info is None ):
+            self.node_info = self.api.get_nodes_info()
+        return self.node_info
+
+    def get_user_id(self, username: str) -> str:
+        """从用户目录查询用户ID，目录一次运行内只拉取一次，不存在的用户也会缓存"""
+        if self.user_ids is None:
+            self.user_ids = self.api.get_users_map()
+        if username not in self.user_ids:
+            self.logger.warning(f"User not found in JumpServer: {username}")
+            self.user_ids[username] = ""
+        return self.user_ids[username]
 
-    def sync_node(self, js_trees):
+    def plan_nodes(self, js_trees, prune = True, plan = None, scope = None ) -> ChangeSet:
+        """
+        规划节点变更：期望的节点树包含每个服务树的所有上级节点，缺失的节点逐个创建，
+        prune 为 False 时不删除多余节点（增量同步）；scope 不为空时只处理范围内的节点
+        """
+        if plan is None:
+            plan = ChangeSet()
         c3_trees = common.treename_js_to_c3(js_trees)
+        if scope is not None:
+            c3_trees = [ x for x in c3_trees if scope.contains(x) ]
 
-        node_info = self.api.get_nodes_info()
+        node_info = self.get_node_info()
 
-        for tree in common.treename_zip(c3_trees):
-            ( tree,  ) = common.treename_c3_to_js([tree])
-            if node_info.get(tree):
-                continue
-            self.api.create_node(tree)
+        # 期望的节点树（含 /DEFAULT/C3 根节点和所有中间节点）
+        desired = set(common.treename_c3_to_js(common.treename_unzip(c3_trees)))
+        if desired:
+            desired.add(C3_ROOT)
 
-        trees_unzip = common.treename_c3_to_js(common.treename_unzip(c3_trees))
-        for treename, treeid in node_info.items():
-            if treename not in trees_unzip and treename.startswith('/DEFAULT/C3/'):
-                self.api.delete_node(treeid)
+        # 按层排序，执行时同一层的节点并发创建
+        for tree in sorted(desired, key=lambda x: (x.count('/'), x)):
+            if not node_info.get(tree):
+                plan.nodes_create.append(NodeCreate(tree))
 
-    def format_host_params(self, host_data: Dict[str, Any] ) -> Dict[str, Any]:
-        """格式化主机参数为JumpServer可接受的格式"""
+        nodes = set(node_info) | desired
+
+        if prune:
+            for treename, treeid in node_info.items():
+                if treename not in desired and treename.startswith(C3_ROOT + '/') and (scope is None or scope.contains_node(treename)):
+                    plan.nodes_delete.append(NodeDelete(treename, treeid))
+                    nodes.discard(treename)
+
+        plan.nodes = nodes
+        return plan
+
+    @staticmethod
+    def group_by_depth(changes, deepest_first = False) -> list:
+        """按节点深度分层，返回 [[同一层的变更], ...]"""
+        levels = {}
+        for change in changes:
+            levels.setdefault(change.full_value.count('/'), []).append(change)
+        return [ levels[x] for x in sorted(levels, reverse=deepest_first) ]
+
+    def apply_nodes_create(self, changes: List[NodeCreate], workers = None) -> int:
+        """从上到下逐层创建节点，同一层的节点并发创建，上级节点创建失败时跳过其下级节点，返回失败（含跳过）的数量"""
+        workers = self.settings.HOST_WORKERS if workers is None else workers
+        if not changes:
+            return 0
+        node_info = self.get_node_info()
+
+        failed = set()
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for level in self.group_by_depth(changes):
+                todo = []
+                for change in level:
+                    if change.full_value.rsplit('/', 1)[0] in failed:
+                        failed.add(change.full_value)
+                    else:
+                        todo.append(change)
+                # 直接用创建结果更新节点索引，不需要重新拉取
+                for change, node in zip(todo, executor.map(lambda x: self.api.create_node(x.full_value), todo)):
+                    if node.get("id"):
+                        node_info[change.full_value] = node["id"]
+                    else:
+                        failed.add(change.full_value)
 
-        hostname = host_data.get('hostName', '')
-        ip = host_data.get('ip', '')
-        platform = host_data.get('os', 'Linux')
-        department = host_data.get('tree', '')
-    
+        if failed:
+            self.logger.error(f"Failed to create {len(failed)} nodes: {', '.join(sorted(failed))}")
+        return len(failed)
+
+    def apply_nodes_delete(self, changes: List[NodeDelete], workers = None) -> int:
+        """从最深的一层开始逐层删除节点，同一层的节点并发删除，下级节点删除失败时保留其上级节点，返回失败的数量"""
+        workers = self.settings.HOST_WORKERS if workers is None else workers
+        if not changes:
+            return 0
+        node_info = self.get_node_info()
+
+        failed = set()
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for level in self.group_by_depth(changes, deepest_first = True):
+                todo = []
+                for change in level:
+                    if any( x.startswith(change.full_value + '/') for x in failed ):
+                        failed.add(change.full_value)
+                    else:
+                        todo.append(change)
+                for change, ok in zip(todo, executor.map(lambda x: self.api.delete_node(x.id), todo)):
+                    if ok:
+                        node_info.pop(change.full_value, None)
+                    else:
+                        failed.add(change.full_value)
+
+        if failed:
+            self.logger.error(f"Failed to delete {len(failed)} nodes: {', '.join(sorted(failed))}")
+        return len(failed)
+
+    def ensure_root(self, trees = ()):
+        """
+        分片同步前先创建 C3 根节点和 trees（服务树）对应的所有节点，避免多个进程同时创建共用的上级节点，
+        也避免主机的其他服务树由另一个分片创建、添加主机时节点还不存在，返回创建失败的数量
+        """
+        node_info = self.get_node_info()
+        full_values = [C3_ROOT] + common.treename_c3_to_js(common.treename_unzip(trees))
+        changes = [ NodeCreate(x) for x in sorted(set(full_values), key=lambda x: (x.count('/'), x)) if not node_info.get(x) ]
+        return self.apply_nodes_create(changes)
+
+    def build_host_spec(self, host: C3Host) -> HostSpec:
+        """把OpenC3主机转换成期望的JumpServer主机，平台和模板使用共享对象"""
         # 获取平台信息
-        platform_info = self.get_platform_id(platform)
-        
+        platform = self.get_platform_id(host.os or 'Linux')
+
         # 根据IP获取模板ID
-        template_info = common.get_template_id_by_ip(ip)
-        
-        # 根据部门创建节点结构，现在返回节点ID列表
-        nodes = self.create_node_structure(department)
-        
-        # 获取对应平台的协议配置
-        protocols = self.get_protocols_by_platform(platform_info['id'])
-        
-        # 创建账号信息
-        accounts = [{
-            'template': template_info["template_id"],
-            'name': template_info["account_name"],
-            'username': 'root' if platform_info['name'] == 'Linux' else 'administrator',
-            'secret_type': {
-                'value': 'ssh_key' if platform_info['name'] == 'Linux' else 'password',
-                'label': 'SSH 密钥' if platform_info['name'] == 'Linux' else '密码'
-            },
-            'privileged': True,
-        }]
-        
-        params = {
-            "name": hostname,
-            "address": ip,
-            "platform": platform_info,
-            "accounts": accounts,
-            "nodes": nodes,  # 使用构建的节点列表
-            "is_active": True,
-            "protocols": protocols,
-            "comment": f"Synced from OpenC3 on {time.strftime('%Y-%m-%d %H:%M:%S')}"
-        }
-        
-        # 添加自定义字段
-        if 'environment' in host_data:
-            params["specific_system_environments"] = host_data['environment']
-        if 'owner' in host_data:
-            params["specific_owner"] = host_data['owner']
-        
-        return params
-
-    def get_platform_id(self, platform_name: str) -> Dict[str, Any]:
+        template = common.get_template_id_by_ip(host.ip, self.settings)
+
+        # 节点先用 full_value 表示，执行时再转换成节点ID（节点可能在同一次计划中创建）
+        trees = self.get_department_trees(host.tree or '')
+
+        return HostSpec(host.name, host.ip, platform, template, trees, host.environment, host.owner)
+
+    def format_host_params(self, host: C3Host) -> Dict[str, Any]:
+        """格式化主机参数为JumpServer可接受的格式"""
+        spec = self.build_host_spec(host)
+        return spec.to_wire(self.get_node_refs(spec.trees), f"Synced from OpenC3 on {time.strftime('%Y-%m-%d %H:%M:%S')}")
+
+    def get_platform_id(self, platform_name: str) -> Platform:
         """获取平台信息"""
-        # 映射OpenC3平台名称到JumpServer平台名称和ID
-        platform_map = {
-            'linux': {'id': 1, 'name': 'Linux'},
-            'windows': {'id': 2, 'name': 'Windows'}, 
-            'centos': {'id': 1, 'name': 'Linux'},
-            'ubuntu': {'id': 1, 'name': 'Linux'},
-            'redhat': {'id': 1, 'name': 'Linux'},
-            'windows server': {'id': 2, 'name': 'Windows'},
-        }
-        return platform_map.get(platform_name.lower(), {'id': 1, 'name': 'Linux'})
+        return PLATFORMS.get(platform_name.lower(), LINUX)
 
-    def create_node_structure(self, department: str) -> list:
-        """根据department创建节点结构，返回所有创建的最终节点ID列表"""
-        
+    def get_department_trees(self, department: str) -> list:
+        """把department转换成JumpServer节点 full_value 列表"""
         # 处理可能包含多个树结构的情况
         departments = [dept.strip() for dept in department.split(',') if dept.strip()]
-        
-        node_info = self.api.get_nodes_info()
-        return [ dict( id=node_info.get(x), name= x.split('/')[-1] )for x in common.treename_c3_to_js(departments) if node_info.get(x)]
-    
-    def get_protocols_by_platform(self,platform_id: int) -> List[Dict[str, Any]]:
-        """根据平台ID获取对应的协议配置"""
-        if platform_id == 2:  # Windows
-            return [{'name': 'rdp', 'port': 3389}]
-        else:  # 默认为Linux
-            return [{'name': 'ssh', 'port': 22}]
-    
-    def add_host_to_jumpsever(self, params_list, node_cvm_dict, EXCLUDED_IPS):
-        """批量更新节点上的主机资产信息"""
+        return common.treename_c3_to_js(departments)
+
+    def get_node_refs(self, trees: list) -> list:
+        """把节点 full_value 列表转换成 [{"id": .., "name": ..}]，不存在的节点会被忽略"""
+        node_info = self.get_node_info()
+        return [ dict( id=node_info.get(x), name= x.split('/')[-1] )for x in trees if node_info.get(x)]
+
+    def add_one_host(self, params):
+        """添加单台主机，名称冲突时以 名称-IP 重命名后重试一次，成功返回主机ID，失败返回空字符串"""
+        try:
+            response_info = self.api.add_host(params)
+            if isinstance(response_info, dict) and response_info.get("name") and response_info["name"][0] == "字段必须唯一":
+                params["name"] = params["name"] + '-' + params["address"]
+                new_response = self.api.add_host(params)
+                if 'id' in new_response:
+                    self.logger.info(f"Added host with renamed: {params['name']}")
+                    return new_response['id']
+                self.logger.error(f"Failed to add host after rename: {params['name']} - {new_response}")
+            elif 'id' in response_info:
+                self.logger.info(f"Added host: {params['name']}")
+                return response_info['id']
+            else:
+                self.logger.error(f"Failed to add host: {params['name']} - {response_info}- {params}")
+        except Exception as e:
+            self.logger.error(f"Exception when adding host {params['address']}: {str(e)}")
+        return ""
+
+    @staticmethod
+    def map_bounded(executor, func, items, window):
+        """与 executor.map 相同，但同一时间最多提交 window 个任务，items 可以是生成器"""
+        pending = deque()
+        for item in items:
+            if len(pending) >= window:
+                yield pending.popleft().result()
+            pending.append(executor.submit(func, item))
+        while pending:
+            yield pending.popleft().result()
+
+    def add_hosts(self, changes: List[HostAdd], workers = None):
+        """
+        批量添加主机，最多 workers 个主机并发创建，返回 (成功数, 失败数)
+        接口参数在工作线程中生成，同一时间只有正在提交的少量主机的参数在内存中
+        """
+        workers = max(1, self.settings.HOST_WORKERS if workers is None else workers)
         added = 0
-        updated = 0
         failed = 0
-        ip_list = []
-        add_host_list = []
-        
-        # 构建当前主机IP列表
-        for x in node_cvm_dict.keys():
-            ip_list.append(node_cvm_dict[x]["address"])
-
-        for params in params_list:
-            if params["address"] not in ip_list and params["address"] not in EXCLUDED_IPS:
-                try:
-                    response_info = self.api.add_host(params)
-                    if isinstance(response_info, dict) and response_info.get("name") and response_info["name"][0] == "字段必须唯一":
-                        params["name"] = params["name"] + '-' + params["address"]
-                        new_response = self.api.add_host(params)
-                        if 'id' in new_response:
-                            self.logger.info(f"Added host with renamed: {params['name']}")
-                            added += 1
-                            add_host_list.append(new_response['id'])
-                        else:
-                            self.logger.error(f"Failed to add host after rename: {params['name']} - {new_response}")
-                            failed += 1
-                    elif 'id' in response_info:
-                        self.logger.info(f"Added host: {params['name']}")
-                        added += 1
-                        add_host_list.append(response_info['id'])
-                    else:
-                        self.logger.error(f"Failed to add host: {params['name']} - {response_info}- {params}")
-                        failed += 1
-                except Exception as e:
-                    self.logger.error(f"Exception when adding host {params['address']}: {str(e)}")
+        comment = f"Synced from OpenC3 on {time.strftime('%Y-%m-%d %H:%M:%S')}"
+        add_one = lambda x: self.add_one_host(x.spec.to_wire(self.get_node_refs(x.spec.trees), comment))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for host_id in self.map_bounded(executor, add_one, changes, workers * 2):
+                if host_id:
+                    added += 1
+                else:
                     failed += 1
-            else:
-                updated += 1
+        return added, failed
 
-        return {"added": added, "updated": updated, "failed": failed}
+    def update_one_host(self, change: HostUpdate, comment) -> bool:
+        """只 PATCH 发生漂移的字段"""
+        spec = change.spec
+        nodes = []
+        if "nodes" in change.fields:
+            # C3 以外的节点原样保留，否则 PATCH 会把主机从这些节点中移除
+            node_names = { v: k for k, v in self.get_node_info().items() }
+            nodes = self.get_node_refs(spec.trees) + [ dict( id=x, name=node_names.get(x, x).split('/')[-1] ) for x in change.other_nodes ]
+        params = spec.to_wire(nodes, comment)
+        params = { k: params[k] for k in change.fields }
+        try:
+            ok, response = self.api.patch_host(change.id, params)
+            if ok:
+                self.logger.info(f"Updated host: {change.name} ({', '.join(change.fields)})")
+                return True
+            self.logger.error(f"Failed to update host: {change.name} - {response}")
+        except Exception as e:
+            self.logger.error(f"Exception when updating host {change.address}: {str(e)}")
+        return False
+
+    def update_hosts(self, changes: List[HostUpdate], workers = None):
+        """批量更新主机，并发方式与 add_hosts 相同，返回 (成功数, 失败数)"""
+        workers = max(1, self.settings.HOST_WORKERS if workers is None else workers)
+        updated = 0
+        failed = 0
+        comment = f"Synced from OpenC3 on {time.strftime('%Y-%m-%d %H:%M:%S')}"
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for ok in self.map_bounded(executor, lambda x: self.update_one_host(x, comment), changes, workers * 2):
+                if ok:
+                    updated += 1
+                else:
+                    failed += 1
+        return updated, failed
 
     def get_host_from_node(self,*args):
         return self.api.get_host_from_node(*args)
 
-    def delete_host(self,*args):
-        return self.api.delete_host(*args)
+    def get_hosts_by_address(self, ips, workers = None):
+        """按IP查询JumpServer上的主机，返回格式同 get_host_from_node"""
+        workers = self.settings.HOST_WORKERS if workers is None else workers
+        host_dict = {}
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for hosts in executor.map(self.api.get_hosts_by_address, ips):
+                host_dict.update(hosts)
+        return host_dict
+
+    def plan_hosts(self, c3_hosts, c3_ips,EXCLUDED_IPS, js_hosts = None, plan = None, scope = None ) -> ChangeSet:
+        """
+        规划主机变更（添加、更新漂移字段、删除），js_hosts 为空时获取JumpServer全量主机；增量同步时只传入受影响的主机
+        scope 不为空时只处理属于范围的主机：OpenC3 主机按服务树判断，JumpServer 上的主机按所在节点判断
+        """
+        if plan is None:
+            plan = ChangeSet()
+        if js_hosts is None:
+            js_hosts = self.get_host_from_node('')
+
+        # 按IP索引当前主机，同一IP有多台时以第一台为准；范围外的主机也需要索引，避免主机换了服务树后重复添加
+        assets = {}
+        for asset in js_hosts.values():
+            assets.setdefault(asset.address, asset)
+
+        nodes = plan.nodes if plan.nodes is not None else self.get_node_info()
+        node_names = { v: k for k, v in self.get_node_info().items() }
+
+        if scope is not None:
+            js_hosts = { k: v for k, v in js_hosts.items() if scope.owns_nodes( node_names.get(x, '') for x in v.nodes ) }
+        plan.hosts_total += len(js_hosts)
+
+        # 逐台比较：不存在的主机添加，字段有漂移的主机只更新变化的字段
+        seen = set()
+        for host in c3_hosts:
+            if not host.is_linux or host.ip in seen:
+                continue
+            seen.add(host.ip)
+            if scope is not None and not scope.owns(host.trees):
+                continue
+            if host.ip in EXCLUDED_IPS:
+                plan.hosts_unchanged += 1
+                continue
+            spec = self.build_host_spec(host)
+            asset = assets.get(host.ip)
+            if asset is None:
+                plan.hosts_add.append(HostAdd(host.name, host.ip, spec))
+                continue
+            fields = self.diff_host(asset, spec, node_names, nodes)
+            if fields:
+                other_nodes = tuple( x for x in asset.nodes if not self.is_c3_node(node_names.get(x, x)) )
+                plan.hosts_update.append(HostUpdate(asset.name, host.ip, asset.id, spec, fields, other_nodes))
+            else:
+                plan.hosts_unchanged += 1
+
+        for host_name, asset in js_hosts.items():
+            if asset.address and asset.address not in c3_ips and asset.address not in EXCLUDED_IPS:
+                plan.hosts_delete.append(HostDelete(host_name, asset.address, asset.id))
+
+        return plan
 
-    def sync_host(self, c3_hosts, c3_ips,EXCLUDED_IPS):
-        host_params_list = [self.format_host_params(x) for x in c3_hosts if x.get("os") and x.get("os").lower() == "linux" ]
-        js_hosts = self.get_host_from_node('')
-        result = self.add_host_to_jumpsever( host_params_list, js_hosts, EXCLUDED_IPS )
+    @staticmethod
+    def is_c3_node(full_value) -> bool:
+        return full_value == C3_ROOT or full_value.startswith(C3_ROOT + '/')
 
-        self.logger.info(f"Sync result: Added {result['added']}, Updated {result['updated']}, Failed {result['failed']}")
+    def diff_host(self, asset: Asset, spec: HostSpec, node_names, nodes = None) -> tuple:
+        """
+        比较已有主机和期望的主机，返回发生漂移的字段名，没有漂移时返回空元组
+        只比较接口返回了的字段
+        主机上 C3 以外的节点不由同步管理，不参与比较
+        """
+        current = asset.fields(node_names)
+        current["nodes"] = tuple( x for x in current["nodes"] if self.is_c3_node(x) )
+        desired = spec.fields(nodes)
+        desired = { k: v for k, v in desired.items() if k in current }
 
+        # 名称冲突时主机以 名称-IP 添加，视为名称一致
+        if current["name"] == f"{spec.name}-{spec.address}":
+            current["name"] = spec.name
+        # 主机上可能还有其他账号，只要期望的模板账号已存在即可
+        if "accounts" in current and set(desired["accounts"]) <= set(current["accounts"]):
+            current["accounts"] = desired["accounts"]
+
+        return tuple( k for k, v in desired.items() if current.get(k) != v )
+
+    def delete_objects(self, path, changes, bulk_size = None, workers = None) -> Dict[str, bool]:
+        """
+        删除一组对象，返回 {id: 是否删除成功}
+        优先按 bulk_size 分批调用批量删除接口，接口不可用或某一批失败时，该批改为并发逐个删除
+        """
+        if bulk_size is None:
+            bulk_size = self.settings.JUMPSERVER_BULK_DELETE_SIZE
+        workers = self.settings.HOST_WORKERS if workers is None else workers
+        results = {}
+        changes = list(changes)
+        todo = changes
+        if bulk_size > 0 and self.bulk_delete_supported:
+            todo = []
+            for i in range(0, len(changes), bulk_size):
+                if not self.bulk_delete_supported:
+                    todo.extend(changes[i:])
+                    break
+                batch = changes[i:i + bulk_size]
+                try:
+                    status = self.api.bulk_delete(path, [ x.id for x in batch ])
+                except Exception as e:
+                    self.logger.error(f"Exception when bulk deleting {len(batch)} objects from {path}: {str(e)}")
+                    status = None
+                if status in [200, 204]:
+                    results.update( (x.id, True) for x in batch )
+                    continue
+                if status in [404, 405]:
+                    # 当前 JumpServer 版本不支持批量删除，之后不再尝试
+                    self.logger.warning(f"Bulk delete is not supported by JumpServer ({status}), deleting one by one")
+                    self.bulk_delete_supported = False
+                todo.extend(batch)
+
+        def delete_one(change):
+            try:
+                return self.api.delete_object(path, change.id)
+            except Exception as e:
+                self.logger.error(f"Exception when deleting {change.name}: {str(e)}")
+                return False
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for change, ok in zip(todo, executor.map(delete_one, todo)):
+                results[change.id] = ok
+        return results
+
+    def delete_hosts(self, changes: List[HostDelete]) -> int:
         deleted_count = 0
-        for host_name, host_info in js_hosts.items():
-            host_ip = host_info.get("address", "")
-            if host_ip and host_ip not in c3_ips and host_ip not in EXCLUDED_IPS:
-                host_id = host_info["ID"]
-                if self.delete_host(host_id):
-                    deleted_count += 1
-                    self.logger.info(f"Deleted host {host_name} with ID {host_id} from JumpServer")
-                else:
-                    self.logger.error(f"Failed to delete host {host_name} with ID {host_id}")
-         
-        self.logger.info(f"Total deleted hosts: {deleted_count}")
-    
-    def update_asset_permissions_format_params(self, user_info: Dict[str, Any], rule_info: Dict[str, Any] ):
+        results = self.delete_objects("/api/v1/assets/hosts/", changes)
+        for change in changes:
+            if results.get(change.id):
+                deleted_count += 1
+                self.logger.info(f"Deleted host {change.name} with ID {change.id} from JumpServer")
+            else:
+                self.logger.error(f"Failed to delete host {change.name} with ID {change.id}")
+        return deleted_count
+
+    def delete_rules(self, changes: List[RuleDelete]) -> int:
+        deleted_count = 0
+        results = self.delete_objects("/api/v1/perms/asset-permissions/", changes)
+        for change in changes:
+            if results.get(change.id):
+                deleted_count += 1
+                self.logger.info(f"Deleted permission rule: {change.name}")
+            else:
+                self.logger.error(f"Failed to delete permission rule: {change.name}")
+        return deleted_count
+
+    @staticmethod
+    def get_pk_set(items) -> set:
+        """把接口返回的 [{"id": ..}] / [{"pk": ..}] / [".."] / [{"value": ..}] 统一成集合"""
+        values = set()
+        for item in items or []:
+            if isinstance(item, dict):
+                item = item.get("pk") or item.get("id") or item.get("value")
+            if item:
+                values.add(item)
+        return values
+
+    def diff_asset_permissions(self, rule_info: Dict[str, Any], spec: RuleSpec, node_names = None ) -> Dict[str, Any]:
         """
-        更新资产授权规则参数
+        比较已有授权规则和期望的规则，只返回内容有变化的字段
+        spec 中的 nodes 为节点 full_value，node_names 为节点 id -> full_value
         """
-        params = rule_info
-        # 获取用户信息
-        username = user_info["name"]
-   
-        # 获取用户_id
-        user_id = self.api.get_user_id({"username": username})
-   
-        # 获取当前UTC时间
-        now = datetime.now(timezone.utc)
-   
-        # 长期有效
-        expired_date = now + timedelta(days=365 * 100)  
-   
-        # 时间格式化
-        date_start = now.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
-        date_expired = expired_date.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
-   
-        id_exists = False
-        for user in params["users"]:
-            if user.get("id") == user_id or user.get("pk") == user_id:
-                id_exists = True
-                break
-        
-        # 如果ID不存在，则添加
-        if not id_exists:
-            params["users"].append({"pk": user_id})
-   
-        params["date_start"] = date_start
-        params["date_expired"] = date_expired
-        return params
-   
-    def create_asset_permissions_format_params(self, user_info: Dict[str, Any] ) -> Dict[str, Any]:
+        if node_names is None:
+            node_names = { v: k for k, v in self.get_node_info().items() }
+        current = {
+            "users": self.get_pk_set(rule_info.get("users")),
+            "nodes": set( node_names.get(x, x) for x in self.get_pk_set(rule_info.get("nodes")) ),
+            "accounts": self.get_pk_set(rule_info.get("accounts")),
+            "actions": self.get_pk_set(rule_info.get("actions")),
+        }
+        changed = {}
+        for field, value in spec.fields().items():
+            if current[field] != set(value):
+                changed[field] = list(value)
+        if "users" in changed:
+            changed["users"] = [ {"pk": x} for x in spec.users ]
+        return changed
+
+    def build_rule_specs(self, c3_user, nodes = None ) -> Dict[str, RuleSpec]:
         """
-        创建资产授权规则参数
+        按treename和level分组用户，生成期望的授权规则
+        nodes 为执行后预期存在的节点 full_value 集合，默认使用当前的节点索引
         """
-        # 获取用户信息
-        username = user_info["name"]
-    
-        # 获取用户ID
-        user_id = self.api.get_user_id({"username": username})
-    
-        # 获取用户信息
-        department = user_info["treename"]
-        level = user_info["level"]
-        
-        # 生成带有level信息的规则名称
-        rule_name = f"C3_{department}_level_{level}"
-        
-        # 根据用户级别获取账户权限
-        accounts = self.get_accounts_by_level(level)
-    
-        # 根据部门创建节点结构，现在返回节点ID列表
-        node_ids = [ x.get("id") for x in self.create_node_structure(department) ]
-    
-        # 构建节点列表
-        nodes = [{"pk": node_id} for node_id in node_ids]
-    
-        # 获取当前UTC时间
-        now = datetime.now(timezone.utc)
-    
-        # 长期有效
-        expired_date = now + timedelta(days=365 * 100)  
-    
-        # 时间格式化
-        date_start = now.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
-        date_expired = expired_date.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
-    
-        params = {
-            "assets": [],
-            "nodes": nodes,  # 使用构建的节点列表
-            "users": [
-                {
-                    "pk": user_id
-                }
-            ],
-            "accounts": accounts,
-            "actions": [
-                "connect",
-                "upload",
-                "download",
-                "copy",
-                "paste",
-                "delete"
-            ],
-            "is_active": True,
-            "date_start": date_start,
-            "date_expired": date_expired,
-            "name": rule_name
-        }   
-    
-        return params
-    
-    def sync_auth(self,c3_user):
-
-        # 按treename和level分组用户
-        grouped_users = {}
+        specs = {}
         for user in c3_user:
             treename = user["treename"]
             level = user["level"]
+            # 生成带有level信息的规则名称
             key = f"C3_{treename}_level_{level}"
-            
-            if key not in grouped_users:
-                grouped_users[key] = []
-            grouped_users[key].append(user)
-     
-        for x in self.api.get_asset_permissions({}):
-            if x.get("name") not in grouped_users.keys() and x.get("name").startswith("C3_"):
-                self.api.delete_auth(x.get("id"))
+            if key not in specs:
+                specs[key] = RuleSpec(key, treename, level)
+            specs[key].usernames.append(user["name"])
+
+        if nodes is None:
+            nodes = self.get_node_info()
+        for spec in specs.values():
+            # 用户ID去重，JumpServer 上不存在的用户跳过
+            user_ids = dict.fromkeys( self.get_user_id(x) for x in spec.usernames )
+            user_ids.pop("", None)
+            spec.users = tuple(user_ids)
+            # 根据部门获取节点列表，执行时再转换成节点ID
+            spec.nodes = tuple( x for x in self.get_department_trees(spec.treename) if x in nodes )
+            # 根据用户级别获取账户权限
+            spec.accounts = ACCOUNTS_BY_LEVEL.get(spec.level, ACCOUNTS_BY_LEVEL["1"])
+        return specs
+
+    def plan_auth(self,c3_user, rule_names = None, plan = None, scope = None ) -> ChangeSet:
+        """规划授权规则变更，rule_names 不为空时只处理这些规则（增量同步），scope 不为空时只处理范围内的规则"""
+        if plan is None:
+            plan = ChangeSet()
+
+        if scope is not None:
+            c3_user = [ x for x in c3_user if scope.owns_rule(rule_name_of(x)) ]
+        specs = self.build_rule_specs(c3_user, plan.nodes)
+
+        if rule_names is None:
+            asset_permissions = self.api.get_asset_permissions({})
+        else:
+            specs = { k: v for k, v in specs.items() if k in rule_names }
+            asset_permissions = [ x for name in rule_names for x in self.api.get_asset_permissions({"name": name}) ]
+        if scope is not None:
+            asset_permissions = [ x for x in asset_permissions if not x.get("name").startswith("C3_") or scope.owns_rule(x.get("name")) ]
+
+        node_names = { v: k for k, v in self.get_node_info().items() }
+        rule_dict = {}
+        plan.rules_total += sum( 1 for x in asset_permissions if x.get("name").startswith("C3_") )
+        for x in asset_permissions:
+            if x.get("name") not in specs and x.get("name").startswith("C3_"):
+                plan.rules_delete.append(RuleDelete(x.get("name"), x.get("id")))
+            else:
+                rule_dict[x.get("name")] = x
 
         # 处理每个分组
-        for rule_name, users in grouped_users.items():
-            # 获取该rule_name的权限规则
-            asset_permissions = self.api.get_asset_permissions({"name": rule_name})
-    
-            if asset_permissions:
-                # 获取规则详情
-                asset_permissions_info = self.api.get_asset_permissions_details(asset_permissions[0]["id"])
-                # 如果规则已存在，为每个用户更新规则
-                asset_permissions_params = None
-                for user in users:
-                    asset_permissions_params = self.update_asset_permissions_format_params(user, asset_permissions_info)
-                
-                if asset_permissions_params:
-                    self.api.update_asset_permissions(asset_permissions[0]["id"], asset_permissions_params)
-                    self.logger.info(f"Updated permission rule: {rule_name} with {len(users)} users")
+        for rule_name, spec in specs.items():
+            rule = rule_dict.get(rule_name)
+            if rule:
+                # 列表接口没有返回完整字段时再获取规则详情
+                if not all(x in rule for x in ("users", "nodes", "accounts", "actions")):
+                    rule = self.api.get_asset_permissions_details(rule["id"])
+
+                # 只提交有变化的字段，不在分组内的用户会被移除
+                changed = self.diff_asset_permissions(rule, spec, node_names)
+                if changed:
+                    plan.rules_update.append(RuleUpdate(rule_name, rule["id"], changed))
+                else:
+                    plan.rules_unchanged += 1
             else:
                 # 如果规则不存在，创建新规则
-                if not users:
-                    continue
-                    
-                # 使用第一个用户的信息创建基本规则
-                asset_permissions_params = self.create_asset_permissions_format_params(users[0])
-                
-                # 添加其他用户到同一规则
-                for user in users[1:]:
-                    user_id = self.api.get_user_id({"username": user["name"]})
-                    if user_id:
-                        asset_permissions_params["users"].append({"pk": user_id})
-                
-                self.api.create_asset_permissions(asset_permissions_params)
-                self.logger.info(f"Created new permission rule: {rule_name} with {len(users)} users")
-
-
-    # 根据用户级别获取账户权限列表
-    def get_accounts_by_level(self,level: str) -> List[str]:
-        """根据用户级别返回相应的账户权限列表"""
-        if level == "1":
-            return ["@SPEC", "backend"]
-        elif level == "2":
-            return ["@SPEC", "root"]
-        elif level == "3":
-            return ["@ALL"]
-        else:
-            # 默认权限，如果level不在预期范围内
-            return ["@SPEC", "backend"]
-    
-    
+                plan.rules_create.append(RuleCreate(rule_name, spec))
+
+        return plan
+
+    def get_node_pks(self, trees: list) -> list:
+        return [ {"pk": x["id"]} for x in self.get_node_refs(trees) ]
+
+    def create_one_rule(self, change: RuleCreate) -> bool:
+        params = change.spec.to_wire(self.get_node_pks(change.spec.nodes))
+        try:
+            response = self.api.create_asset_permissions(params)
+            if 'id' in response:
+                self.logger.info(f"Created new permission rule: {change.name} with {len(params['users'])} users")
+                return True
+            self.logger.error(f"Failed to create permission rule: {change.name} - {response}")
+        except Exception as e:
+            self.logger.error(f"Exception when creating permission rule {change.name}: {str(e)}")
+        return False
+
+    def update_one_rule(self, change: RuleUpdate) -> bool:
+        """只 PATCH 有变化的字段"""
+        changes = dict(change.changes)
+        if "nodes" in changes:
+            changes["nodes"] = self.get_node_pks(changes["nodes"])
+        try:
+            ok, response = self.api.patch_asset_permissions(change.id, changes)
+            if ok:
+                self.logger.info(f"Updated permission rule: {change.name} ({', '.join(changes)})")
+                return True
+            self.logger.error(f"Failed to update permission rule: {change.name} - {response}")
+        except Exception as e:
+            self.logger.error(f"Exception when updating permission rule {change.name}: {str(e)}")
+        return False
+
+    def apply_rules(self, plan: ChangeSet, delete = True):
+        """删除、创建、更新授权规则，返回 (创建数, 更新数, 删除数, 失败数)"""
+        deleted = self.delete_rules(plan.rules_delete) if delete else 0
+        failed = len(plan.rules_delete) - deleted if delete else 0
+
+        created = sum( 1 for x in plan.rules_create if self.create_one_rule(x) )
+        updated = sum( 1 for x in plan.rules_update if self.update_one_rule(x) )
+        failed += len(plan.rules_create) - created + len(plan.rules_update) - updated
+
+        self.logger.info(f"Permission rules: Created {created}, Updated {updated}, Deleted {deleted}, Unchanged {plan.rules_unchanged}, Failed {failed}")
+        return created, updated, deleted, failed
+
+    def apply(self, plan: ChangeSet, max_delete_ratio = None) -> Dict[str, int]:
+        """
+        按依赖顺序执行计划：创建节点 -> 添加/更新主机 -> 删除主机 -> 授权规则 -> 删除节点
+        计划删除的主机或授权规则超过 max_delete_ratio（为空时使用配置中的值）时跳过所有删除（包括节点）
+        返回结果中的 failed 为所有失败的写操作数量（节点、主机、授权规则），不为 0 时下一次运行需要全量同步
+        """
+        if max_delete_ratio is None:
+            max_delete_ratio = self.settings.MAX_DELETE_RATIO
+        over = plan.over_delete_limit(max_delete_ratio, self.settings.MAX_DELETE_MIN)
+        if over:
+            self.logger.error(f"Deletion skipped, plan deletes more than {max_delete_ratio:.0%} of existing objects: {', '.join(over)}")
+
+        with phase("apply.node"):
+            failed = self.apply_nodes_create(plan.nodes_create)
+
+        with phase("apply.host"):
+            added, add_failed = self.add_hosts(plan.hosts_add)
+            updated, update_failed = self.update_hosts(plan.hosts_update)
+            result = {"added": added, "updated": updated, "unchanged": plan.hosts_unchanged, "delete_blocked": bool(over)}
+            if plan.hosts_add or plan.hosts_update or plan.hosts_unchanged:
+                self.logger.info(f"Sync result: Added {added}, Updated {updated}, Unchanged {plan.hosts_unchanged}, Failed {add_failed + update_failed}")
+            failed += add_failed + update_failed
+
+            if plan.hosts_delete and not over:
+                result["deleted"] = self.delete_hosts(plan.hosts_delete)
+                self.logger.info(f"Total deleted hosts: {result['deleted']}")
+                failed += len(plan.hosts_delete) - result["deleted"]
+
+        with phase("apply.auth"):
+            if plan.rules_delete or plan.rules_create or plan.rules_update or plan.rules_unchanged:
+                _, _, _, rules_failed = self.apply_rules(plan, delete = not over)
+                failed += rules_failed
+
+        # 主机和授权规则处理完之后再删除多余节点
+        with phase("apply.prune"):
+            if not over:
+                failed += self.apply_nodes_delete(plan.nodes_delete)
+        result["failed"] = failed
+        return result
+
+    def resume_plan(self, plan: ChangeSet, done, pending) -> ChangeSet:
+        """
+        继续被中断的计划：去掉写操作日志中已经完成的变更，done / pending 为已完成 / 结果未知的 (操作, 对象) 集合
+        结果未知的创建先查询 JumpServer 是否已经存在，避免重复创建或触发主机名称冲突的重命名；更新和删除可以重复执行
+        """
+        node_info = self.get_node_info( force_refresh = True )
+        plan.nodes_create = [ x for x in plan.nodes_create if not node_info.get(x.full_value) ]
+        plan.nodes_delete = [ x for x in plan.nodes_delete if ("delete_node", x.id) not in done ]
+
+        in_doubt = [ x.address for x in plan.hosts_add if ("add_host", x.address) in pending ]
+        landed = set( x.address for x in self.get_hosts_by_address(in_doubt).values() )
+        plan.hosts_add = [ x for x in plan.hosts_add if ("add_host", x.address) not in done and x.address not in landed ]
+        plan.hosts_update = [ x for x in plan.hosts_update if ("patch_host", x.id) not in done ]
+        plan.hosts_delete = [ x for x in plan.hosts_delete if ("delete", x.id) not in done ]
+
+        landed = set( x.name for x in plan.rules_create
+                      if ("create_rule", x.name) in pending and self.api.get_asset_permissions({"name": x.name}) )
+        plan.rules_create = [ x for x in plan.rules_create if ("create_rule", x.name) not in done and x.name not in landed ]
+        plan.rules_update = [ x for x in plan.rules_update if ("patch_rule", x.id) not in done ]
+        plan.rules_delete = [ x for x in plan.rules_delete if ("delete", x.id) not in done ]
+        return plan
@@ -1,5 +1,6 @@
 from .service import OpenC3Service
 from .api import OpenC3API
+from .models import C3Host
 
-__all__ = ["OpenC3Service", "OpenC3API"] 
+__all__ = ["OpenC3Service", "OpenC3API", "C3Host"] 
 
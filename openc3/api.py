@@ -1,27 +1,23 @@
 # -*- coding: utf-8 -*-
 
-import os
-import sys
-import json
-import time
-import logging
-import requests
 from typing import Dict, List, Any, Tuple
-import configparser
-from httpsig.requests_auth import HTTPSignatureAuth
 from utils.logger import logger
+from utils.transport import HttpTransport
+from utils.jsonstream import JsonStream
+from .models import C3Host
 
 class OpenC3API(object):
 
-    def __init__(self, base_url, secret):
+    def __init__(self, base_url, secret, http=None, settings=None):
         self.base_url = base_url
         self.headers = { 'appkey': secret, 'appname': 'jobx', 'Content-Type': 'application/json' }
+        self.http = http or HttpTransport(headers=self.headers, settings=settings)
         self.logger = logger
 
     def get_hosts(self):
         """从OpenC3 API获取主机数据"""
         url = f"{self.base_url}/api/ci/c3mc/jumpserver"
-        response = requests.get(url, headers=self.headers)
+        response = self.http.get(url)
         if response.status_code == 200:
             data = response.json()
             logger.info(f"Successfully fetched {len(data['data'] if 'data' in data else data)} hosts from OpenC3")
@@ -35,24 +31,47 @@ class OpenC3API(object):
     
         else:
             logger.error(f"Failed to fetch data from OpenC3: {response.status_code}, {response.text}")
-            return []
+            raise RuntimeError(f"Open-C3 Service Error: HTTP {response.status_code}")
+
+    def iter_hosts(self, chunk_size = 65536):
+        """流式获取OpenC3主机数据，边下载边解析 data 数组，逐个产出 C3Host 记录"""
+        url = f"{self.base_url}/api/ci/c3mc/jumpserver"
+        response = self.http.get(url, stream=True)
+        with response:
+            if response.status_code != 200:
+                logger.error(f"Failed to fetch data from OpenC3: {response.status_code}, {response.text}")
+                raise RuntimeError(f"Open-C3 Service Error: HTTP {response.status_code}")
+
+            stream = JsonStream(response.iter_content(chunk_size=chunk_size))
+            count = 0
+            for host in stream.iter_array("data"):
+                # stat 一般在 data 之前，出错时尽早停止
+                if "stat" in stream.fields and not stream.fields["stat"]:
+                    raise RuntimeError("Open-C3 Service Error: stat false")
+                count += 1
+                yield C3Host.from_wire(host)
+
+        logger.info(f"Successfully fetched {count} hosts from OpenC3")
+        if not stream.fields.get("stat"):
+            raise RuntimeError("Open-C3 Service Error: stat false")
+        if not count:
+            raise RuntimeError("Open-C3 Service Error: data null")
 
     def get_users(self):
-       try:
-           url = f"{self.base_url}/api/connector/default/auth/tree/userauth"
-           response = requests.get(url, headers=self.headers)
-           if response.status_code == 200:
-               data = response.json()
-               logger.info(f"Successfully fetched {len(data['data'] if 'data' in data else data)} user from OpenC3")
-               if not data.get("stat"):
-                   raise RuntimeError("Open-C3 Service Error: stat false")
-   
-               if not data or not data.get("data"):
-                   raise RuntimeError("Open-C3 Service Error: data null")
-               
-               return data.get("data")
-
-       except Exception as e:
-           logger.error(f"Error fetching data from OpenC3: {str(e)}")
-           return []
+       """获取用户授权数据，失败时抛出异常（返回空列表会导致删除所有 C3_ 授权规则）"""
+       url = f"{self.base_url}/api/connector/default/auth/tree/userauth"
+       response = self.http.get(url)
+       if response.status_code != 200:
+           logger.error(f"Failed to fetch users from OpenC3: {response.status_code}, {response.text}")
+           raise RuntimeError(f"Open-C3 Service Error: HTTP {response.status_code}")
+
+       data = response.json()
+       logger.info(f"Successfully fetched {len(data['data'] if 'data' in data else data)} user from OpenC3")
+       if not data.get("stat"):
+           raise RuntimeError("Open-C3 Service Error: stat false")
+
+       if not data or not data.get("data"):
+           raise RuntimeError("Open-C3 Service Error: data null")
+
+       return data.get("data")
     
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+import sys
+
+# 同步只用到主机的这些字段，其余字段在解析时直接丢弃
+HOST_FIELDS = ("hostName", "ip", "os", "tree", "environment", "owner")
+
+
+def intern_str(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class C3Host(object):
+    """OpenC3 主机记录
+
+    os、tree 等大量重复的字符串会被驻留，trees 为拆分后的服务树列表。
+    """
+
+    __slots__ = ("name", "ip", "os", "tree", "environment", "owner", "trees")
+
+    def __init__(self, name, ip, os, tree, environment = None, owner = None):
+        self.name = name
+        self.ip = ip
+        self.os = intern_str(os)
+        self.tree = intern_str(tree)
+        self.environment = intern_str(environment)
+        self.owner = intern_str(owner)
+        self.trees = tuple( intern_str(x.strip()) for x in (tree or '').split(",") if x.strip() )
+
+    @classmethod
+    def from_wire(cls, data):
+        return cls(data.get("hostName", ''), data.get("ip", ''), data.get("os"), data.get("tree", ''),
+                   data.get("environment"), data.get("owner"))
+
+    @property
+    def is_linux(self) -> bool:
+        return bool(self.os) and self.os.lower() == "linux"
+
+    def key(self) -> tuple:
+        """参与内容比较的字段"""
+        return (self.name, self.ip, self.os, self.tree, self.environment, self.owner)
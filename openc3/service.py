@@ -1,33 +1,71 @@
 # -*- coding: utf-8 -*-
 
-import os
-import sys
-import json
 import time
 from typing import Dict, List, Any, Tuple
+from concurrent.futures import ThreadPoolExecutor
 from utils.logger import logger
 from .api import OpenC3API
+from .models import C3Host
+from utils import config
 
 class OpenC3Service(object):
 
-    def __init__(self, base_url, secret):
-        self.api = OpenC3API(base_url, secret )
+    def __init__(self, base_url, secret, stream = None, settings = None ):
+        self.settings = settings or config.settings
+        self.api = OpenC3API(base_url, secret, settings=self.settings )
+        self.stream = self.settings.OpenC3_STREAM if stream is None else stream
         self.logger = logger
         self.hosts = None
+        self.users = None
+        self.trees = None
+        self.ips = None
+        # 最近一次成功获取开始的时间（time.time()），数据反映的是这个时间点之后的 OpenC3
+        self.loaded_at = None
+
+    def load(self, force_refresh = False ):
+        """
+        并发获取主机和用户，解析主机数据的同时生成服务树和 Linux IP 集合
+        主机和用户都获取成功后才替换已有数据，中途失败时保留上一次的完整数据
+        """
+        if (not force_refresh) and self.hosts:
+            return
+
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            users = executor.submit(self.api.get_users)
+            # 流式模式下边下载边解析主机数据，不保留完整的响应体
+            if self.stream:
+                stream = self.api.iter_hosts()
+            else:
+                stream = map(C3Host.from_wire, self.api.get_hosts())
+            hosts = []
+            trees = set()
+            ips = set()
+            for x in stream:
+                hosts.append(x)
+                trees.update(x.trees)
+                if x.is_linux:
+                    ips.add(x.ip)
+            users = users.result()
+
+        self.hosts = hosts
+        self.users = users
+        self.trees = trees
+        self.ips = ips
+        self.loaded_at = started
 
     def get_hosts(self, force_refresh = False ):
-        if (force_refresh) or ( not self.hosts):
-            self.hosts = self.api.get_hosts()
+        self.load( force_refresh )
         return self.hosts
 
     def get_trees(self, force_refresh = False ):
-        hosts = self.get_hosts( force_refresh )
-        trees = set( [ y.strip() for x in hosts for y in x.get("tree").split(",") ] )
-        return trees
+        self.load( force_refresh )
+        return self.trees
 
     def get_ips(self, force_refresh = False ):
-        hosts = self.get_hosts( force_refresh )
-        return set( [ x.get("ip")for x in hosts if x.get("os") and x.get("os").lower() == "linux" ] )
+        self.load( force_refresh )
+        return self.ips
 
-    def get_users(self):
-        return self.api.get_users()
+    def get_users(self, force_refresh = False ):
+        self.load( force_refresh )
+        return self.users
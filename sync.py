@@ -3,37 +3,526 @@
 
 import os
 import sys
-import json
-from jumpserver import JumpServerService
+import time
+import random
+import signal
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from jumpserver import JumpServerService, ChangeSet
 from openc3 import OpenC3Service
-from utils.config import *
-from utils.logger import logger
+from utils.config import settings, configure, Settings
+from utils.logger import logger, setup_logging
+from utils.snapshot import Snapshot, SnapshotDelta, rule_name_of
+from utils.lock import RunLock
+from utils.journal import Journal
+from utils.scope import TreeScope, ShardScope
+from utils.phase import phase, add_phase_hook, target_scope
+from utils.metrics import metrics
 from utils import common
 
-def sync():
-    jss = JumpServerService(JUMPSERVER_WEBURL, JUMPSERVER_KEY_ID, JUMPSERVER_SECRET)
-    c3s = OpenC3Service(OpenC3_API_URL, OpenC3_API_KEY)
+def plan_full(jss, c3_trees, c3_hosts, c3_users, c3_ips, scope=None):
+    """全量同步，scope 不为空时只处理范围内的节点、主机和授权规则（包括删除）"""
+    plan = ChangeSet()
 
+    with phase("plan.node"):
+        jss.plan_nodes(common.treename_c3_to_js(c3_trees), plan=plan, scope=scope)
+    with phase("plan.host"):
+        jss.plan_hosts(c3_hosts, c3_ips, jss.settings.EXCLUDED_IPS, plan=plan, scope=scope)
+    with phase("plan.auth"):
+        jss.plan_auth(c3_users, plan=plan, scope=scope)
+    return plan
+
+def plan_delta(jss, delta, c3_users, c3_ips):
+    """增量同步：只处理快照之后变化的主机和授权规则，不删除多余节点"""
+    jss.logger.info(f"Incremental sync: {len(delta.changed_hosts)} hosts changed, {len(delta.removed_ips)} hosts removed, {len(delta.changed_rules)} rules changed")
+    plan = ChangeSet()
+
+    trees = set( [ y for x in delta.changed_hosts for y in x.trees ] )
+    if trees:
+        with phase("plan.node"):
+            jss.plan_nodes(common.treename_c3_to_js(trees), prune=False, plan=plan)
+
+    if delta.changed_hosts or delta.removed_ips:
+        with phase("plan.host"):
+            js_hosts = jss.get_hosts_by_address(set( x.ip for x in delta.changed_hosts ) | delta.removed_ips)
+            jss.plan_hosts(delta.changed_hosts, c3_ips, jss.settings.EXCLUDED_IPS, js_hosts, plan=plan)
+        # 增量同步只查询了受影响的对象，删除保护按快照中的数量计算
+        plan.hosts_total = delta.hosts_total
+
+    if delta.changed_rules:
+        with phase("plan.auth"):
+            jss.plan_auth(c3_users, delta.changed_rules, plan=plan)
+        plan.rules_total = delta.rules_total
+
+    return plan
+
+def plan_events(jss, c3s, ips, rules):
+    """变更通知：只处理通知中的主机IP和授权规则，主机和用户内容以 OpenC3 当前数据为准"""
+    c3_hosts = c3s.get_hosts()
+    c3_users = c3s.get_users()
+    c3_ips = c3s.get_ips()
+    current_ips = set( x.ip for x in c3_hosts )
+
+    changed_hosts = [ x for x in c3_hosts if x.ip in ips ]
+    removed_ips = set(ips) - current_ips
+    rules_total = len(set( rule_name_of(x) for x in c3_users ))
+    delta = SnapshotDelta(changed_hosts, removed_ips, set(rules), len(current_ips) + len(removed_ips), rules_total)
+    return plan_delta(jss, delta, c3_users, c3_ips)
+
+def make_services():
+    """每个 JumpServer 同步目标使用独立的 JumpServerService：连接池、请求策略、缓存和请求计数互不影响"""
+    return { x["name"]: JumpServerService(x["weburl"], x["key_id"], x["secret"], name=x["name"]) for x in settings.JUMPSERVER_TARGETS }
+
+def state_dir_of(name):
+    """默认目标的快照在 STATE_DIR 下，其他目标在 STATE_DIR/<name> 下"""
+    return os.path.join(settings.STATE_DIR, name) if name else settings.STATE_DIR
+
+def for_each_target(services, func, *args):
+    """
+    在各自的线程中并发对每个目标执行 func(jss, *args)，返回 (目标 -> 结果, 失败的目标)
+    一个目标失败只记录日志并清空该目标的缓存，不影响其他目标
+    """
+    def call(jss):
+        with target_scope(jss.name):
+            return func(jss, *args)
+
+    with ThreadPoolExecutor(max_workers=len(services) or 1) as executor:
+        futures = { name: executor.submit(call, jss) for name, jss in services.items() }
+    results, failed = {}, []
+    for name, future in futures.items():
+        try:
+            results[name] = future.result()
+        except Exception:
+            services[name].logger.exception("Sync failed.")
+            services[name].reset_caches()
+            failed.append(name or "default")
+    return results, failed
+
+def journal_of(jss, scope=None):
+    """每个目标一个写操作日志，分片同步时每个分片单独一个"""
+    name = f"journal-shard{scope.index + 1}" if isinstance(scope, ShardScope) else 'journal'
+    return Journal(state_dir_of(jss.name), name)
+
+def apply_with_journal(jss, journal, plan, max_delete_ratio, checkpoint=None):
+    """
+    执行计划并把所有写请求记录到写操作日志，成功后由调用方 journal.finish()；
+    checkpoint 不为空时先保存检查点（新计划），为空时继续已经 reopen 的日志（--resume）；
+    空计划没有写请求，不保存检查点也不写日志
+    """
+    if checkpoint is not None:
+        if journal.is_interrupted():
+            jss.logger.warning("The previous run was interrupted, its remaining changes are replaced by this plan (use --resume to finish it instead).")
+        if not len(plan):
+            journal.discard()
+            return jss.apply(plan, max_delete_ratio)
+        journal.begin(dict(checkpoint, plan=plan.to_dict()))
+    jss.api.journal = journal
+    try:
+        return jss.apply(plan, max_delete_ratio)
+    except Exception:
+        # 保留检查点，之后可以 --resume
+        journal.close()
+        raise
+    finally:
+        jss.api.journal = None
+
+def is_dirty(result):
+    """有写操作失败（节点、主机、授权规则）或删除被跳过时，快照标记为需要全量同步"""
+    return result["failed"] > 0 or result["delete_blocked"]
+
+def apply_events(jss, c3s, ips, rules, max_delete_ratio):
+    plan = plan_events(jss, c3s, ips, rules)
+    jss.logger.info(f"Plan: {plan.summary()}")
+    journal = journal_of(jss)
+    result = apply_with_journal(jss, journal, plan, max_delete_ratio, {"snapshot": False})
+    if is_dirty(result):
+        # 下一次定时同步做全量同步
+        snapshot = Snapshot(state_dir_of(jss.name))
+        snapshot.set_dirty()
+        snapshot.close()
+    journal.finish(result)
+
+def handle_events(ips, rules, since, services, c3s, allow_mass_delete=False):
+    """
+    处理一批合并后的变更通知，与定时同步共用运行锁，定时同步运行时等待其结束
+    since 为这批中第一个通知的接收时间，OpenC3 数据在这之后获取过（例如定时同步刚刚运行）时直接复用
+    """
+    lock = RunLock(settings.STATE_DIR)
+    lock.acquire( blocking = True )
+    try:
+        logger.info(f"Event sync start: {len(ips)} hosts, {len(rules)} rules.")
+        with phase("openc3"):
+            c3s.load( force_refresh = c3s.loaded_at is None or c3s.loaded_at < since )
+        _, failed = for_each_target(services, apply_events, c3s, ips, rules, 0 if allow_mass_delete else settings.MAX_DELETE_RATIO)
+        if failed:
+            raise RuntimeError(f"Event sync failed for targets: {', '.join(failed)}")
+        logger.info("Event sync done.")
+    finally:
+        lock.release()
+
+def event_worker(queue, stopped, services, c3s, allow_mass_delete=False):
+    while not stopped.is_set():
+        batch = queue.take(stopped)
+        if batch is None:
+            break
+        try:
+            handle_events(*batch, services, c3s, allow_mass_delete)
+        except Exception:
+            logger.exception("Event sync failed.")
+
+def print_plan(plan, reads, max_delete_ratio = None):
+    """输出计划内容，以及规划阶段已发出的读请求（reads，接口 -> 次数）和执行阶段需要的写请求数量"""
+    if max_delete_ratio is None:
+        max_delete_ratio = settings.MAX_DELETE_RATIO
+    writes = plan.call_budget(settings.JUMPSERVER_BULK_DELETE_SIZE)
+
+    print(plan.format())
+    print(f"\nPlan: {plan.summary()}")
+    over = plan.over_delete_limit(max_delete_ratio, settings.MAX_DELETE_MIN)
+    if over:
+        print(f"\nDeletion would be skipped, more than {max_delete_ratio:.0%} of existing objects: {', '.join(over)}")
+    print(f"\n{'HTTP calls':<56} {'planned':>8}")
+    for endpoint, count in sorted((reads + writes).items()):
+        print(f"{endpoint:<56} {count:>8}")
+    print(f"{'total':<56} {sum(reads.values()) + sum(writes.values()):>8}")
+
+def sync(full=False, dry_run=False, allow_mass_delete=False, services=None, c3s=None, scope=None, shards=1, resume_only=False):
+    """运行一次同步，同一状态目录已有同步在运行时跳过并返回 False"""
+    with RunLock(settings.STATE_DIR) as locked:
+        if not locked:
+            logger.warning("Another sync is running, skipped.")
+            return False
+        run_with_metrics(full, dry_run, allow_mass_delete, services, c3s, scope, shards, resume_only)
+        return True
+
+def run_with_metrics(full=False, dry_run=False, allow_mass_delete=False, services=None, c3s=None, scope=None, shards=1, resume_only=False):
+    # 各阶段耗时记录到 metrics，分片的子进程通过 fork 继承
+    add_phase_hook(metrics.phase)
+    metrics.reset()
+    success = False
+    try:
+        if resume_only:
+            resume(dry_run, allow_mass_delete, services)
+        elif shards > 1:
+            run_sharded(shards, dry_run, allow_mass_delete, services, c3s)
+        else:
+            run(full, dry_run, allow_mass_delete, services, c3s, scope)
+        success = True
+    finally:
+        try:
+            data = metrics.export(settings.METRICS_JSON_FILE, settings.METRICS_TEXTFILE, success)
+        except OSError as e:
+            logger.error(f"Failed to export metrics: {str(e)}")
+            data = metrics.to_dict(success)
+        calls = sum( x["calls"] for x in data["endpoints"] )
+        errors = sum( x["errors"] for x in data["endpoints"] )
+        logger.info(f"Metrics: {calls} HTTP calls, {errors} errors in {data['duration']:.1f}s, " +
+                    ", ".join( f"{k} {v:.1f}s" for k, v in data["phases"].items() ))
+
+def run(full=False, dry_run=False, allow_mass_delete=False, services=None, c3s=None, scope=None):
+    """
+    OpenC3 数据只获取一次，之后并发同步到每个 JumpServer 目标，每个目标使用自己的快照
+    services（目标名称 -> JumpServerService）、c3s 由守护进程传入时在多次运行之间复用连接池和 JumpServer 索引
+    scope 不为空时只在范围内做全量同步，不读写快照
+    """
+    if services is None:
+        services = make_services()
+    if c3s is None:
+        c3s = OpenC3Service(settings.OpenC3_API_URL, settings.OpenC3_API_KEY)
+    if not services:
+        raise RuntimeError("No JumpServer target configured.")
+
+    with phase("openc3"):
+        c3s.load( force_refresh = True )
+    max_delete_ratio = 0 if allow_mass_delete else settings.MAX_DELETE_RATIO
+
+    if scope is not None:
+        logger.info(f"Sync scope: {scope}")
+    results, failed = for_each_target(services, run_target, c3s, full, dry_run, max_delete_ratio, scope)
+
+    if dry_run:
+        for i, (name, (plan, _)) in enumerate(results.items()):
+            if len(services) > 1:
+                print(f"\n===== {name or 'default'} =====")
+            # OpenC3 的读请求只发出一次，计入第一个目标
+            reads = services[name].api.http.calls + (c3s.api.http.calls if i == 0 else Counter())
+            print_plan(plan, reads, max_delete_ratio)
+
+    if failed:
+        raise RuntimeError(f"Sync failed for targets: {', '.join(failed)}")
+
+def run_target(jss, c3s, full, dry_run, max_delete_ratio, scope=None):
+    """
+    同步一个 JumpServer 目标，返回 (计划, 执行结果)，dry_run 时执行结果为 None；c3s 的数据在各目标之间只读共享
+    快照记录的是全部服务树的状态，限定范围的同步总是在范围内全量规划，不读写快照
+    """
     c3_trees = c3s.get_trees()
     c3_hosts = c3s.get_hosts()
     c3_users = c3s.get_users()
     c3_ips = c3s.get_ips()
 
-    logger.info(f"sync node start.")
-    jss.sync_node(common.treename_c3_to_js(c3_trees))
-    logger.info(f"sync node done.")
+    snapshot = Snapshot(state_dir_of(jss.name)) if scope is None else None
+    try:
+        full = full or scope is not None or snapshot.is_full_due(settings.FULL_SYNC_INTERVAL)
+        if full:
+            # 全量同步重新拉取节点索引和用户目录，修正复用的缓存与 JumpServer 之间的偏差
+            jss.reset_caches()
+            plan = plan_full(jss, c3_trees, c3_hosts, c3_users, c3_ips, scope)
+        else:
+            plan = plan_delta(jss, snapshot.diff(c3_hosts, c3_users), c3_users, c3_ips)
+        jss.logger.info(f"Plan: {plan.summary()}")
+
+        if dry_run:
+            return plan, None
+
+        journal = journal_of(jss, scope)
+        # 检查点只保存 --resume 需要的内容：计划和执行后写入快照的哈希
+        checkpoint = {"snapshot": False}
+        if snapshot is not None:
+            checkpoint = {"snapshot": True, "hosts": Snapshot.hash_hosts(c3_hosts), "users": Snapshot.hash_users(c3_users), "full": full}
+        result = apply_with_journal(jss, journal, plan, max_delete_ratio, checkpoint)
+
+        # 删除被跳过时下次运行仍然需要全量同步
+        if snapshot is not None:
+            snapshot.save_hashes(checkpoint["hosts"], checkpoint["users"], full=full, dirty=is_dirty(result))
+        journal.finish(result)
+        return plan, result
+    finally:
+        if snapshot is not None:
+            snapshot.close()
+
+def resume(dry_run=False, allow_mass_delete=False, services=None):
+    """--resume：继续每个目标上被中断的计划，不重新获取 OpenC3 数据和 JumpServer 主机列表"""
+    if services is None:
+        services = make_services()
+    max_delete_ratio = 0 if allow_mass_delete else settings.MAX_DELETE_RATIO
+    results, failed = for_each_target(services, resume_target, dry_run, max_delete_ratio)
+    if dry_run:
+        for name, plans in results.items():
+            for journal_name, plan in plans:
+                print(f"\n===== {name or 'default'} {journal_name} =====")
+                print_plan(plan, services[name].api.http.calls, max_delete_ratio)
+    if failed:
+        raise RuntimeError(f"Resume failed for targets: {', '.join(failed)}")
+
+def resume_target(jss, dry_run, max_delete_ratio):
+    """继续一个目标上所有被中断的计划（分片同步时可能有多个），返回 [(日志名称, 剩余的计划)]"""
+    plans = []
+    for journal in Journal.interrupted(state_dir_of(jss.name)):
+        name = os.path.basename(journal.path)
+        checkpoint = journal.load()
+        done, pending = journal.replay()
+        with phase("resume"):
+            plan = jss.resume_plan(ChangeSet.from_dict(checkpoint["plan"]), done, pending)
+        jss.logger.info(f"Resume {name}: {len(done)} writes done, {len(pending)} unknown, remaining plan: {plan.summary()}")
+        plans.append((name, plan))
+        if dry_run:
+            continue
+
+        journal.reopen(checkpoint["run"])
+        result = apply_with_journal(jss, journal, plan, max_delete_ratio)
+        if checkpoint["snapshot"]:
+            snapshot = Snapshot(state_dir_of(jss.name))
+            snapshot.save_hashes(checkpoint["hosts"], checkpoint["users"], full=checkpoint["full"],
+                                 dirty=is_dirty(result))
+            snapshot.close()
+        journal.finish(result)
+
+    if not plans:
+        jss.logger.info("Nothing to resume.")
+    return plans
+
+# 分片同步时子进程通过 fork 继承已经获取的 OpenC3 数据，不需要重新获取或序列化
+shard_source = None
+
+def run_shard(scope, dry_run, max_delete_ratio):
+    """
+    在子进程中对所有目标同步一个分片，返回 (目标 -> (计划, 执行结果, 读请求), 统计数据)
+    计划只在 dry_run 时返回，失败的目标不出现在结果中
+    """
+    metrics.reset()
+    services = make_services()
+    logger.info(f"Shard {scope} start.")
+    results, _ = for_each_target(services, run_target, shard_source, True, dry_run, max_delete_ratio, scope)
+    logger.info(f"Shard {scope} done.")
+    outcome = { name: (plan if dry_run else None, result, services[name].api.http.calls) for name, (plan, result) in results.items() }
+    return outcome, metrics.dump()
+
+def run_sharded(shards, dry_run=False, allow_mass_delete=False, services=None, c3s=None):
+    """
+    分片全量同步：OpenC3 数据获取一次后按服务树子树分成 shards 个互不重叠的范围，
+    每个范围在单独的子进程中同步；所有分片都成功的目标更新快照
+    """
+    # 只有分片同步用到多进程
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    global shard_source
+    if services is None:
+        services = make_services()
+    if c3s is None:
+        c3s = OpenC3Service(settings.OpenC3_API_URL, settings.OpenC3_API_KEY)
+    if not services:
+        raise RuntimeError("No JumpServer target configured.")
+
+    with phase("openc3"):
+        c3s.load( force_refresh = True )
+    max_delete_ratio = 0 if allow_mass_delete else settings.MAX_DELETE_RATIO
+    # 没有分到服务树的分片不需要运行，没有匹配的对象都属于第 0 个分片
+    scopes = [ x for x in ShardScope.split(c3s.get_hosts(), shards) if x.index == 0 or x.trees ]
+    logger.info(f"Sharded sync: {len(scopes)} of {shards} shards have trees.")
+
+    if not dry_run:
+        # 缺失的节点先在主进程中创建，分片中只删除多余的节点
+        for_each_target(services, JumpServerService.ensure_root, c3s.get_trees())
 
-    logger.info(f"sync host start.")
-    jss.sync_host(c3_hosts, c3_ips, EXCLUDED_IPS)
-    logger.info(f"sync host done.")
+    shard_source = c3s
+    try:
+        with ProcessPoolExecutor(max_workers=len(scopes), mp_context=multiprocessing.get_context('fork')) as executor:
+            outcomes = list(executor.map(run_shard, scopes, [dry_run] * len(scopes), [max_delete_ratio] * len(scopes)))
+    finally:
+        shard_source = None
 
-    logger.info(f"sync auth start.")
-    jss.sync_auth(c3_users)
-    logger.info(f"sync auth done.")
+    failed = []
+    for name, jss in services.items():
+        results = [ outcome.get(name) for outcome, _ in outcomes ]
+        if None in results:
+            failed.append(name or "default")
+            continue
+        if dry_run:
+            for scope, (plan, _, reads) in zip(scopes, results):
+                print(f"\n===== {name or 'default'} shard {scope} =====")
+                print_plan(plan, reads, max_delete_ratio)
+            continue
+        # 所有分片合起来覆盖全部服务树，相当于一次全量同步
+        snapshot = Snapshot(state_dir_of(name))
+        snapshot.save(c3s.get_hosts(), c3s.get_users(), full=True,
+                      dirty=any( is_dirty(x) for _, x, _ in results ))
+        snapshot.close()
+    for _, (endpoints, phases) in outcomes:
+        metrics.merge(endpoints, phases)
 
-    jss.sync_node(common.treename_c3_to_js(c3_trees))
+    if failed:
+        raise RuntimeError(f"Sync failed for targets: {', '.join(failed)}")
+
+def daemon(interval=None, jitter=None, allow_mass_delete=False, listen=None):
+    """
+    守护进程：每隔 interval 秒（加上 0~jitter 秒的随机抖动）运行一次同步，
+    一次运行结束后才会开始计时下一次，配置文件修改后重新启动进程加载新配置
+    listen 不为空时同时接收 OpenC3 变更通知，合并后只同步受影响的对象，定时同步作为兜底
+    参数为空时使用 [Daemon] 和 [Receiver] 配置中的值
+    """
+    interval = settings.DAEMON_INTERVAL if interval is None else interval
+    jitter = settings.DAEMON_JITTER if jitter is None else jitter
+    listen = settings.RECEIVER_LISTEN if listen is None else listen
+    stopped = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: stopped.set())
+
+    config_file = settings.path
+    config_mtime = config_file and os.path.getmtime(config_file)
+    services = make_services()
+    c3s = OpenC3Service(settings.OpenC3_API_URL, settings.OpenC3_API_KEY)
+    logger.info(f"Daemon start, interval {interval}s, jitter {jitter}s, {len(services)} JumpServer targets.")
+
+    receiver = None
+    if listen:
+        # 只有守护进程接收变更通知，http.server 只在这里导入
+        from utils.receiver import EventQueue, make_receiver
+        queue = EventQueue(settings.RECEIVER_WINDOW, settings.RECEIVER_MIN_INTERVAL)
+        try:
+            receiver = make_receiver(listen, queue, settings.RECEIVER_TOKEN)
+        except ValueError as e:
+            logger.error(str(e))
+            return
+        threading.Thread(target=receiver.serve_forever, daemon=True).start()
+        threading.Thread(target=event_worker, args=(queue, stopped, services, c3s, allow_mass_delete), daemon=True).start()
+        logger.info(f"Listening for change notifications on {listen}.")
+
+    while not stopped.is_set():
+        start = time.time()
+        try:
+            logger.info("Sync start.")
+            if sync(allow_mass_delete=allow_mass_delete, services=services, c3s=c3s):
+                logger.info("Sync done.")
+        except Exception:
+            # 各目标的失败已经单独记录并清空了缓存
+            logger.exception("Sync failed.")
+
+        if stopped.wait(max(0, start + interval + random.uniform(0, jitter) - time.time())):
+            break
+
+        # 配置只在启动时读取一次，配置文件变化后重新执行当前进程
+        if config_file and os.path.getmtime(config_file) != config_mtime:
+            logger.info("Config file changed, restarting daemon.")
+            # 等待正在处理的变更通知结束
+            RunLock(settings.STATE_DIR).acquire( blocking = True )
+            os.execv(sys.executable, [sys.executable] + sys.argv)
+
+    if receiver is not None:
+        receiver.shutdown()
+    logger.info("Daemon stopped.")
 
 if __name__ == '__main__':
-    logger.info(f"Sync start.")
-    sync()
-    logger.info(f"Sync done.")
+    parser = argparse.ArgumentParser(description="Sync hosts, trees and permissions from OpenC3 to JumpServer")
+    parser.add_argument('--config', help="config file (default $SYNC_CONFIG or config.ini)")
+    parser.add_argument('--full', action='store_true', help="ignore the snapshot and run a full sync")
+    parser.add_argument('--dry-run', action='store_true', help="print the plan and the HTTP call budget without writing to JumpServer")
+    parser.add_argument('--allow-mass-delete', action='store_true', help="run the deletion stage even if it exceeds max_delete_ratio")
+    parser.add_argument('--daemon', action='store_true', help="keep running and sync every [Daemon] interval seconds")
+    parser.add_argument('--interval', type=float, help="seconds between two syncs in daemon mode (default [Daemon] interval)")
+    parser.add_argument('--jitter', type=float, help="random extra delay in daemon mode (default [Daemon] jitter)")
+    parser.add_argument('--listen', help="[host:]port for OpenC3 change notifications (default [Receiver] listen), implies --daemon")
+    parser.add_argument('--tree', help="only sync these comma separated OpenC3 subtrees, e.g. biz.app (always a full sync within the subtree)")
+    parser.add_argument('--shards', type=int, default=1, help="run a full sync split by top-level tree across this many processes")
+    parser.add_argument('--resume', action='store_true', help="finish the plan of an interrupted run from its journal instead of planning again")
+    parser.add_argument('--profile', nargs='?', const='', metavar='DIR',
+                        help="profile each phase (cProfile, tracemalloc, slowest HTTP calls) into DIR (default state_dir/profile-<time>)")
+    parser.add_argument('--profile-top', type=int, default=20, metavar='N', help="number of functions, allocations and HTTP calls to report")
+    args = parser.parse_args()
+
+    setup_logging()
+    if args.config:
+        if not os.path.exists(args.config):
+            parser.error(f"config file not found: {args.config}")
+        configure(Settings(args.config))
+
+    if args.resume and (args.tree or args.shards > 1 or args.full or args.daemon or args.listen):
+        parser.error("--resume can not be combined with --tree, --shards, --full or daemon mode")
+
+    if args.profile is not None and (args.shards > 1 or args.daemon or args.listen):
+        parser.error("--profile only supports a single run in one process, not --shards or daemon mode")
+
+    if (args.tree or args.shards > 1) and (args.daemon or args.listen):
+        parser.error("--tree and --shards are not supported in daemon mode")
+    if args.tree and args.shards > 1:
+        parser.error("--tree and --shards can not be used together")
+    if args.shards < 1:
+        parser.error("--shards must be at least 1")
+    try:
+        scope = TreeScope(args.tree.split(',')) if args.tree else None
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.daemon or args.listen:
+        daemon(args.interval, args.jitter, allow_mass_delete=args.allow_mass_delete,
+               listen=args.listen)
+        sys.exit(0)
+
+    profiler = None
+    if args.profile is not None:
+        from utils.profiler import Profiler
+        profiler = Profiler(args.profile or os.path.join(settings.STATE_DIR, time.strftime("profile-%Y%m%d-%H%M%S")), args.profile_top)
+        profiler.start()
+
+    try:
+        logger.info("Sync start.")
+        if sync(full=args.full, dry_run=args.dry_run, allow_mass_delete=args.allow_mass_delete,
+                scope=scope, shards=args.shards, resume_only=args.resume):
+            logger.info("Sync done.")
+    finally:
+        if profiler is not None:
+            profiler.stop()
+            logger.info(f"Profile written to {profiler.report()}")
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+# 与 bench/run.py 相同，直接从仓库根目录导入各模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from utils.cidr import CidrIndex, parse_ip
+
+
+def test_longest_prefix_wins_regardless_of_insert_order():
+    index = CidrIndex([("10.0.0.0/8", "wide"), ("10.1.2.0/24", "narrow"), ("10.1.0.0/16", "middle")])
+    assert index.lookup("10.1.2.3") == "narrow"
+    assert index.lookup("10.1.3.3") == "middle"
+    assert index.lookup("10.2.0.1") == "wide"
+    assert index.lookup("11.0.0.1") is None
+    assert index.lookup("11.0.0.1", "default") == "default"
+
+
+def test_single_ip_and_host_bits():
+    index = CidrIndex([("192.168.1.10", "host"), ("192.168.1.77/24", "net")])
+    assert index.lookup("192.168.1.10") == "host"
+    # strict=False：主机位不为 0 的网段按网络地址处理
+    assert index.lookup("192.168.1.200") == "net"
+
+
+def test_ipv6():
+    index = CidrIndex([("2001:db8::/32", "v6-wide"), ("2001:db8:1::/48", "v6-narrow"), ("10.0.0.0/8", "v4")])
+    assert index.lookup("2001:db8:1::5") == "v6-narrow"
+    assert index.lookup("2001:db8:2::5") == "v6-wide"
+    assert index.lookup("2001:db9::1") is None
+    # IPv4 和 IPv6 的网段互不影响
+    assert index.lookup("::ffff:10.0.0.1") is None
+    assert index.lookup("10.0.0.1") == "v4"
+
+
+def test_duplicate_network_keeps_first_value():
+    index = CidrIndex()
+    index.add("10.0.0.0/24", "first")
+    index.add("10.0.0.128/24", "second")
+    index.add(" 10.0.0.0/24 ", "third")
+    assert index.lookup("10.0.0.1") == "first"
+    assert len(index) == 1
+
+
+def test_invalid_input():
+    index = CidrIndex([("10.0.0.0/8", True)])
+    with pytest.raises(ValueError):
+        index.lookup("not-an-ip")
+    with pytest.raises(ValueError):
+        parse_ip("10.0.0.256")
+    with pytest.raises(ValueError):
+        index.add("10.0.0.0/33")
+    assert "not-an-ip" not in index
+
+
+def test_excluded_ips_from_list():
+    excluded = CidrIndex.from_list(["10.0.0.0/24", " 192.168.1.5 ", "", "fd00::/8", "host-a", "10.0.0.300"])
+    assert "10.0.0.9" in excluded
+    assert "10.0.1.9" not in excluded
+    assert "192.168.1.5" in excluded
+    assert "192.168.1.6" not in excluded
+    assert "fd12::1" in excluded
+    # 无法解析的条目按字符串精确匹配
+    assert "host-a" in excluded
+    assert "host-b" not in excluded
+    assert "10.0.0.300" in excluded
+    assert len(excluded) == 5
+
+
+def test_empty_excluded_list():
+    excluded = CidrIndex.from_list("".split(','))
+    assert len(excluded) == 0
+    assert "10.0.0.1" not in excluded
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+import json
+import pytest
+from utils.jsonstream import JsonStream
+
+
+def chunked(data: bytes, size):
+    return [ data[i:i + size] for i in range(0, len(data), size) ]
+
+
+def parse(data: bytes, size, key = "data"):
+    stream = JsonStream(chunked(data, size))
+    return list(stream.iter_array(key)), stream.fields
+
+
+HOSTS = [
+    {"hostName": "主机-01", "ip": "10.0.0.1", "tree": "业务.应用", "os": "Linux"},
+    {"hostName": "emoji-😀", "ip": "10.0.0.2", "tree": "biz", "os": "Windows"},
+    {"hostName": "escaped \"quote\" \\ back\\slash\n", "ip": "10.0.0.3", "tree": "a,b", "os": None},
+    {"n": 12345678901234567890, "f": -1.5e-3, "z": 0, "t": True, "l": [1, [2, {}]]},
+]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 64, 1 << 16])
+def test_any_chunk_size(size):
+    """任意分块大小（包括把多字节 UTF-8 字符、转义序列和数字从中间截断）都得到相同结果"""
+    data = json.dumps({"stat": True, "data": HOSTS}, ensure_ascii=False).encode('utf-8')
+    items, fields = parse(data, size)
+    assert items == HOSTS
+    assert fields == {"stat": True}
+
+
+@pytest.mark.parametrize("size", [1, 4, 1 << 16])
+def test_fields_after_array(size):
+    data = json.dumps({"data": HOSTS[:2], "stat": False, "info": {"msg": "错误"}}, ensure_ascii=False).encode('utf-8')
+    stream = JsonStream(chunked(data, size))
+    items = []
+    for item in stream.iter_array("data"):
+        items.append(item)
+        # 数组后面的字段在数组读完之前还没有解析
+        assert "stat" not in stream.fields
+    assert items == HOSTS[:2]
+    assert stream.fields == {"stat": False, "info": {"msg": "错误"}}
+
+
+def test_number_split_at_chunk_end():
+    """数字恰好在块末尾时不能提前结束（12 与 123 不同）"""
+    items, _ = parse(b'{"data":[123,4.56e7],"stat":true}', 4)
+    assert items == [123, 4.56e7]
+    stream = JsonStream([b'{"data":[1', b'23', b']}'])
+    assert list(stream.iter_array("data")) == [123]
+
+
+def test_whitespace_and_empty():
+    assert parse(b' \n{ "stat" : true , "data" : [ ] } ', 2) == ([], {"stat": True})
+    assert parse(b'{}', 1) == ([], {})
+    # 没有目标数组时其他字段仍然解析
+    assert parse(b'{"stat": false, "msg": "x"}', 3) == ([], {"stat": False, "msg": "x"})
+
+
+def test_other_key_is_not_streamed():
+    items, fields = parse(b'{"other": [1, 2], "data": [3]}', 2)
+    assert items == [3]
+    assert fields == {"other": [1, 2]}
+
+
+@pytest.mark.parametrize("data", [b'', b'[1, 2]', b'{"data": [1, 2', b'{"data": [1 2]}', b'{"data": [1], "stat": tru}'])
+def test_invalid_json(data):
+    with pytest.raises(ValueError):
+        parse(data, 3)
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from openc3.models import C3Host
+from openc3.service import OpenC3Service
+from utils.config import Settings
+
+
+class FakeAPI(object):
+
+    def __init__(self, hosts, users, fail_after = None):
+        self.hosts = hosts
+        self.users = users
+        self.fail_after = fail_after
+
+    def get_users(self):
+        return list(self.users)
+
+    def iter_hosts(self):
+        for i, x in enumerate(self.hosts):
+            if i == self.fail_after:
+                raise ConnectionError("stream broken")
+            yield C3Host.from_wire(x)
+
+
+HOSTS = [
+    {"hostName": "a", "ip": "10.0.0.1", "os": "Linux", "tree": "biz.app"},
+    {"hostName": "b", "ip": "10.0.0.2", "os": "Windows", "tree": "biz.db"},
+    {"hostName": "c", "ip": "10.0.0.3", "os": "Linux", "tree": "ops"},
+]
+USERS = [{"name": "u1", "treename": "biz", "level": "1"}]
+
+
+def test_failed_load_keeps_previous_data():
+    c3s = OpenC3Service("http://openc3", "key", stream = True, settings = Settings())
+    c3s.api = FakeAPI(HOSTS, USERS)
+    c3s.load()
+    assert [ x.name for x in c3s.get_hosts() ] == ["a", "b", "c"]
+    assert c3s.get_ips() == {"10.0.0.1", "10.0.0.3"}
+
+    # 主机数据中途断开：已有的主机、用户、服务树和 IP 保持上一次的完整结果
+    c3s.api = FakeAPI(HOSTS[:1] + [{"hostName": "d", "ip": "10.0.0.4", "os": "Linux", "tree": "new"}] * 3, [], fail_after = 2)
+    with pytest.raises(ConnectionError):
+        c3s.load( force_refresh = True )
+    assert [ x.name for x in c3s.get_hosts() ] == ["a", "b", "c"]
+    assert c3s.get_users() == USERS
+    assert c3s.get_trees() == {"biz.app", "biz.db", "ops"}
+    assert c3s.get_ips() == {"10.0.0.1", "10.0.0.3"}
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+import time
+from email.utils import formatdate
+import pytest
+import requests
+from utils import policy
+from utils.policy import RequestPolicy, AimdLimiter
+
+
+class FakeRequest(object):
+    path_url = "/api/v1/assets/hosts/"
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, headers = None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.request = FakeRequest()
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSend(object):
+    """依次返回给定的响应；元素为异常类时抛出该异常"""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = 0
+
+    def __call__(self):
+        result = self.results[min(self.calls, len(self.results) - 1)]
+        self.calls += 1
+        if isinstance(result, type) and issubclass(result, Exception):
+            raise result("fake")
+        return result
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(policy.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def make_policy(max_retries = 3, backoff = 0.1, backoff_max = 5.0):
+    return RequestPolicy(max_retries = max_retries, backoff = backoff, backoff_max = backoff_max,
+                         read_rate = 0, write_rate = 0, burst = 1, concurrency = 4, target_latency = 0)
+
+
+@pytest.mark.parametrize("method", ["POST", "PATCH"])
+@pytest.mark.parametrize("status", [429, 503])
+def test_write_retried_when_rejected(sleeps, method, status):
+    send = FakeSend(FakeResponse(status), FakeResponse(201))
+    response = make_policy().execute(method, send)
+    assert response.status_code == 201
+    assert send.calls == 2
+    assert len(sleeps) == 1
+
+
+@pytest.mark.parametrize("method", ["POST", "PATCH"])
+@pytest.mark.parametrize("status", [500, 502, 504])
+def test_write_not_retried_on_server_error(sleeps, method, status):
+    send = FakeSend(FakeResponse(status), FakeResponse(201))
+    response = make_policy().execute(method, send)
+    assert response.status_code == status
+    assert send.calls == 1
+    assert sleeps == []
+
+
+@pytest.mark.parametrize("method", ["POST", "PATCH"])
+@pytest.mark.parametrize("error", [requests.Timeout, requests.ConnectionError])
+def test_write_not_retried_on_timeout(sleeps, method, error):
+    send = FakeSend(error, FakeResponse(201))
+    with pytest.raises(error):
+        make_policy().execute(method, send)
+    assert send.calls == 1
+    assert sleeps == []
+
+
+def test_read_retried_on_server_error_and_timeout(sleeps):
+    send = FakeSend(FakeResponse(500), requests.Timeout, FakeResponse(200))
+    response = make_policy().execute("GET", send)
+    assert response.status_code == 200
+    assert send.calls == 3
+    assert len(sleeps) == 2
+
+
+def test_retries_exhausted(sleeps):
+    send = FakeSend(FakeResponse(503))
+    response = make_policy(max_retries = 2).execute("POST", send)
+    assert response.status_code == 503
+    assert send.calls == 3
+    assert len(sleeps) == 2
+
+
+def test_rejected_response_closed(sleeps):
+    rejected = FakeResponse(429)
+    make_policy().execute("POST", FakeSend(rejected, FakeResponse(201)))
+    assert rejected.closed
+
+
+@pytest.mark.parametrize("value, backoff_max, expected", [
+    ("2", 5.0, 2.0),
+    ("0", 5.0, 0.0),
+    ("120", 5.0, 5.0),
+])
+def test_retry_after_seconds(sleeps, value, backoff_max, expected):
+    send = FakeSend(FakeResponse(429, {"Retry-After": value}), FakeResponse(201))
+    make_policy(backoff_max = backoff_max).execute("POST", send)
+    assert sleeps == [expected]
+
+
+def test_retry_after_http_date(sleeps):
+    when = formatdate(time.time() + 30, usegmt = True)
+    send = FakeSend(FakeResponse(503, {"Retry-After": when}), FakeResponse(201))
+    make_policy(backoff_max = 60).execute("POST", send)
+    assert 25 <= sleeps[0] <= 30
+
+    sleeps.clear()
+    send = FakeSend(FakeResponse(503, {"Retry-After": when}), FakeResponse(201))
+    make_policy(backoff_max = 5).execute("POST", send)
+    assert sleeps == [5]
+
+
+def test_retry_after_in_the_past(sleeps):
+    when = formatdate(time.time() - 30, usegmt = True)
+    send = FakeSend(FakeResponse(503, {"Retry-After": when}), FakeResponse(201))
+    make_policy().execute("POST", send)
+    assert sleeps == [0]
+
+
+def test_backoff_without_retry_after(sleeps):
+    send = FakeSend(FakeResponse(503), FakeResponse(503), FakeResponse(503), FakeResponse(201))
+    make_policy(backoff = 1, backoff_max = 3).execute("GET", send)
+    assert len(sleeps) == 3
+    for attempt, value in enumerate(sleeps):
+        assert 0 <= value <= min(3, 2 ** attempt)
+
+
+def test_aimd_halves_once_per_window():
+    limiter = AimdLimiter(8)
+    for _ in range(8):
+        limiter.acquire()
+    # 同一批并发请求全部失败，只减半一次
+    for _ in range(8):
+        limiter.release(0.01, True)
+    assert limiter.limit == 4
+
+    # 下一个窗口（当前上限个请求）内再失败才会继续减半
+    for _ in range(3):
+        limiter.acquire()
+        limiter.release(0.01, True)
+    assert limiter.limit == 4
+    limiter.acquire()
+    limiter.release(0.01, True)
+    assert limiter.limit == 2
+
+
+def test_aimd_latency_and_recovery():
+    limiter = AimdLimiter(4, minimum = 2, target_latency = 1.0)
+    limiter.acquire()
+    limiter.release(2.0, False)
+    assert limiter.limit == 2
+    # 不低于下限
+    for _ in range(4):
+        limiter.acquire()
+        limiter.release(2.0, False)
+    assert limiter.limit == 2
+    # 成功请求缓慢恢复，不超过上限
+    for _ in range(20):
+        limiter.acquire()
+        limiter.release(0.1, False)
+    assert limiter.limit == 4
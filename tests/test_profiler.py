@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import cProfile
+import threading
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from utils.phase import phase
+from utils.profiler import Profiler
+
+
+class SingleProfile(cProfile.Profile):
+    """模拟 Python 3.12 起的 cProfile：同一时间只能开启一个"""
+
+    active = 0
+    lock = threading.Lock()
+
+    def enable(self, *args, **kwargs):
+        with self.lock:
+            if SingleProfile.active:
+                raise ValueError("Another profiling tool is already active")
+            SingleProfile.active += 1
+        super().enable(*args, **kwargs)
+
+    def disable(self):
+        super().disable()
+        with self.lock:
+            SingleProfile.active = max(0, SingleProfile.active - 1)
+
+
+def work(n):
+    return sum( x * x for x in range(n) )
+
+
+def run_pool_phase(profiler):
+    """在线程池阶段中运行，超时说明工作线程退出、阶段无法结束"""
+    results = []
+
+    def run():
+        profiler.start()
+        try:
+            with phase("apply.host"):
+                with ThreadPoolExecutor(max_workers=4) as executor:
+                    results.extend(executor.map(work, [ 1000 ] * 16))
+        finally:
+            profiler.stop()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(30)
+    assert not thread.is_alive()
+    assert results == [ work(1000) ] * 16
+
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_thread_pool_phase(tmp_path, shared):
+    profiler = Profiler(str(tmp_path), shared=shared)
+    run_pool_phase(profiler)
+    summary = open(profiler.report(), encoding='utf-8').read()
+    assert "=== apply.host" in summary
+    assert (tmp_path / "apply.host.pstats").exists()
+
+
+def test_worker_profile_rejected(tmp_path, monkeypatch):
+    """工作线程开启 cProfile 失败时跳过这个线程，不能让工作线程退出"""
+    monkeypatch.setattr(cProfile, "Profile", SingleProfile)
+    profiler = Profiler(str(tmp_path), shared=False)
+    run_pool_phase(profiler)
+    assert len(profiler.phases[('', "apply.host")].profiles) == 1
+    profiler.report()
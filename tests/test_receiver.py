@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+import json
+import time
+import threading
+import http.client
+import pytest
+from utils.receiver import EventQueue, parse_events, make_receiver, is_loopback
+
+
+def test_parse_events():
+    assert parse_events({"ip": "10.0.0.1"}) == ({"10.0.0.1"}, set())
+    assert parse_events({"rule": "C3_biz_level_1"}) == (set(), {"C3_biz_level_1"})
+    assert parse_events({"treename": "biz.app", "level": 2}) == (set(), {"C3_biz.app_level_2"})
+    ips, rules = parse_events([{"ip": "10.0.0.1"}, {"ip": "10.0.0.1"}, {"treename": "biz", "level": "1"}, {"rule": "C3_biz_level_1"}])
+    assert ips == {"10.0.0.1"}
+    assert rules == {"C3_biz_level_1"}
+    assert parse_events([]) == (set(), set())
+
+
+@pytest.mark.parametrize("body", [None, "10.0.0.1", [1], {"treename": "biz"}, {"level": "1"}, {"ip": ""}])
+def test_parse_events_invalid(body):
+    with pytest.raises(ValueError):
+        parse_events(body)
+
+
+def test_queue_coalesces_window():
+    queue = EventQueue(window = 0.2)
+    stopped = threading.Event()
+    start = time.time()
+    queue.put(["10.0.0.1"])
+    threading.Timer(0.05, queue.put, (["10.0.0.2"], ["C3_biz_level_1"])).start()
+    ips, rules, since = queue.take(stopped)
+    assert ips == {"10.0.0.1", "10.0.0.2"}
+    assert rules == {"C3_biz_level_1"}
+    assert start <= since <= start + 0.05
+    assert time.time() - start >= 0.2
+
+
+def test_queue_min_interval():
+    """两批之间至少间隔 min_interval 秒，期间的事件合并到下一批"""
+    queue = EventQueue(window = 0.01, min_interval = 0.3)
+    stopped = threading.Event()
+    queue.put(["10.0.0.1"])
+    queue.take(stopped)
+    start = time.monotonic()
+    queue.put(["10.0.0.2"])
+    threading.Timer(0.1, queue.put, (["10.0.0.3"],)).start()
+    ips, _, _ = queue.take(stopped)
+    assert ips == {"10.0.0.2", "10.0.0.3"}
+    assert time.monotonic() - start >= 0.25
+
+
+def test_queue_ignores_empty_and_stops():
+    queue = EventQueue(window = 0.01)
+    stopped = threading.Event()
+    queue.put()
+    stopped.set()
+    assert queue.take(stopped) is None
+
+
+def test_loopback_and_token():
+    assert is_loopback("127.0.0.1") and is_loopback("localhost") and is_loopback("::1")
+    assert not is_loopback("0.0.0.0") and not is_loopback("10.0.0.1") and not is_loopback("example.com")
+    queue = EventQueue()
+    with pytest.raises(ValueError):
+        make_receiver("0.0.0.0:0", queue)
+    with pytest.raises(ValueError):
+        make_receiver("10.0.0.1:0", queue)
+    server = make_receiver("0", queue)
+    assert server.server_address[0] == "127.0.0.1"
+    server.server_close()
+    server = make_receiver("0.0.0.0:0", queue, "secret")
+    assert server.server_address[0] == "0.0.0.0"
+    server.server_close()
+
+
+@pytest.fixture
+def receiver():
+    queue = EventQueue()
+    server = make_receiver("127.0.0.1:0", queue, "secret", max_body = 1024)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield queue, server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def post(port, body, token = "secret", path = "/notify"):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    conn.request("POST", path, body=body, headers={"X-Sync-Token": token})
+    response = conn.getresponse()
+    data = json.loads(response.read())
+    conn.close()
+    return response.status, data
+
+
+def test_receiver_requests(receiver):
+    queue, port = receiver
+    assert post(port, json.dumps({"ip": "10.0.0.1"}), token = "wrong")[0] == 403
+    assert post(port, b"{}", path = "/other")[0] == 404
+    assert post(port, b"x" * 2048)[0] == 413
+    assert post(port, b"not json")[0] == 400
+    assert post(port, json.dumps([{"ip": "10.0.0.1"}, {"treename": "biz", "level": "1"}])) == (202, {"hosts": 1, "rules": 1})
+    assert queue.ips == {"10.0.0.1"}
+    assert queue.rules == {"C3_biz_level_1"}
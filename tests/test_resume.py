@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""写操作日志：执行计划 -> 进程中断 -> --resume，使用 bench.mock_server 模拟 OpenC3 和 JumpServer"""
+
+import os
+import json
+import threading
+import pytest
+import sync
+from bench import datagen
+from bench.mock_server import MockState, make_server
+from jumpserver import ChangeSet
+from openc3.service import OpenC3Service
+from utils import config
+from utils.journal import Journal
+from utils.snapshot import Snapshot
+
+
+class Crash(BaseException):
+    """模拟进程被杀死：不是 Exception，写方法来不及记录结果"""
+
+
+@pytest.fixture
+def mock(tmp_path, monkeypatch):
+    c3_hosts, c3_users = datagen.generate(60, 3, 3, 20, 1)
+    state = MockState(c3_hosts, c3_users)
+    server = make_server(state)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    monkeypatch.setattr(config, "current_settings", config.Settings(values={
+        "JumpServer": {"weburl": url, "key_id": "key", "secret": "secret"},
+        "OpenC3": {"api_url": url, "api_key": "key"},
+        "Settings": {"state_dir": str(tmp_path)},
+        "Metrics": {"json_file": ""},
+        "Templates": {"template_id": "template", "account_name": "root"},
+    }))
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+def crash_after(jss, count):
+    """第 count 个 POST 请求到达服务端之后中断，这个请求在写操作日志中只有 intent"""
+    post = jss.api.http.post
+    calls = []
+
+    def wrapper(*args, **kwargs):
+        response = post(*args, **kwargs)
+        calls.append(1)
+        if len(calls) == count:
+            raise Crash()
+        return response
+    jss.api.http.post = wrapper
+
+
+def run_crashed(count):
+    services = sync.make_services()
+    jss = services[""]
+    c3s = OpenC3Service(config.settings.OpenC3_API_URL, config.settings.OpenC3_API_KEY)
+    c3s.load( force_refresh = True )
+    crash_after(jss, count)
+    with pytest.raises(Crash):
+        sync.run_target(jss, c3s, True, False, 0)
+    return Journal(config.settings.STATE_DIR)
+
+
+def js_state(state):
+    hosts = sorted( (x["name"], x["address"]) for x in state.data["hosts"].values() )
+    nodes = sorted( x["full_value"] for x in state.data["nodes"].values() )
+    rules = sorted( x["name"] for x in state.data["perms"].values() )
+    return hosts, nodes, rules
+
+
+def test_resume_finishes_interrupted_plan(mock, tmp_path):
+    # 第一次运行：节点创建完成后，在添加主机的过程中中断
+    nodes = len(set( x["tree"] for x in mock.c3_hosts ))
+    journal = run_crashed(nodes + 20)
+    assert journal.is_interrupted()
+    done, pending = journal.replay()
+    assert len(pending) == 1
+    assert any( op == "add_host" for op, _ in done )
+
+    # 检查点是 JSON，只有计划和快照哈希，没有 OpenC3 原始数据
+    checkpoint = journal.load()
+    assert set(checkpoint) == {"snapshot", "hosts", "users", "full", "plan", "run"}
+    plan = ChangeSet.from_dict(json.loads(json.dumps(checkpoint["plan"])))
+    assert len(plan.hosts_add) > 20
+    assert Snapshot(str(tmp_path)).get_meta('dirty') is None
+
+    sync.resume()
+    assert not journal.is_interrupted()
+
+    # 结果与一次没有中断的全量同步相同：没有重复添加、没有按名称冲突重命名的主机
+    hosts, _, rules = js_state(mock)
+    assert len(hosts) == len(set( x["ip"] for x in mock.c3_hosts if x["os"] == "Linux" ))
+    assert all( not name.endswith(address) for name, address in hosts )
+    assert Snapshot(str(tmp_path)).get_meta('dirty') == '0'
+
+    before = js_state(mock)
+    mock.calls.clear()
+    sync.sync(full=True)
+    assert js_state(mock) == before
+    assert not [ x for x in mock.calls if not x.startswith("GET") ]
+
+
+def test_resume_plan_skips_done_and_landed(mock):
+    journal = run_crashed(3)
+    done, pending = journal.replay()
+    checkpoint = journal.load()
+    jss = sync.make_services()[""]
+    plan = ChangeSet.from_dict(checkpoint["plan"])
+    planned = [ x.full_value for x in plan.nodes_create ]
+    hosts_add = len(plan.hosts_add)
+    # 同一层的节点并发创建，第 3 个完成的节点不一定是计划中的第 3 个
+    (op, landed), = pending
+    assert op == "create_node" and landed in planned
+
+    # 结果未知的节点已经在 JumpServer 上创建，和已完成的节点一样不再创建
+    plan = jss.resume_plan(plan, done, pending)
+    _, nodes, _ = js_state(mock)
+    assert [ x.full_value for x in plan.nodes_create ] == [ x for x in planned if x not in nodes ]
+    assert landed in nodes
+    assert len(plan.hosts_add) == hosts_add
+
+
+def test_replay(tmp_path):
+    journal = Journal(str(tmp_path))
+    journal.begin({"snapshot": False, "plan": ChangeSet().to_dict()})
+    journal.outcome(journal.intent("add_host", "10.0.0.1"), True, "id-1")
+    journal.outcome(journal.intent("add_host", "10.0.0.2"), False, error="bad")
+    journal.intent("add_host", "10.0.0.3")
+    journal.outcome(journal.intent("bulk_delete", ["a", "b"]), True)
+    journal.intent("bulk_delete", ["c"])
+    journal.close()
+
+    done, pending = Journal(str(tmp_path)).replay()
+    assert done == {("add_host", "10.0.0.1"), ("delete", "a"), ("delete", "b")}
+    assert pending == {("add_host", "10.0.0.3"), ("delete", "c")}
+
+
+def test_empty_plan_is_not_journaled(mock, tmp_path):
+    sync.sync(full=True)
+    journal = Journal(str(tmp_path))
+    os.remove(journal.path)
+    sync.sync(full=True)
+    assert not os.path.exists(journal.path)
+    assert not journal.is_interrupted()
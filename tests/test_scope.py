@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from bench.datagen import generate
+from openc3.models import C3Host
+from utils import common
+from utils.scope import Scope, TreeScope, ShardScope, rule_trees
+from utils.snapshot import rule_name_of
+
+
+def make_hosts(*trees):
+    return [ C3Host(f"host-{i}", f"10.0.0.{i}", "Linux", tree) for i, tree in enumerate(trees) ]
+
+
+def prefixes(tree):
+    parts = tree.split('.')
+    return [ '.'.join(parts[:i]) for i in range(1, len(parts) + 1) ]
+
+
+@pytest.fixture(scope="module")
+def data():
+    hosts, users = generate(hosts = 600, depth = 4, fanout = 4, users = 100, seed = 3)
+    return [ C3Host.from_wire(x) for x in hosts ], users
+
+
+def test_scope_is_abstract():
+    with pytest.raises(TypeError):
+        Scope()
+
+
+def test_rule_trees():
+    assert rule_trees("C3_biz.app_level_2") == ["biz.app"]
+    assert rule_trees("C3_biz.a, biz.b_level_1") == ["biz.a", "biz.b"]
+
+
+@pytest.mark.parametrize("count", [1, 2, 3, 5, 8])
+def test_shards_never_overlap(data, count):
+    hosts, users = data
+    shards = ShardScope.split(hosts, count)
+    assert len(shards) == count
+    shared = shards[0].shared
+
+    # 每个服务树、主机和规则恰好属于一个分片
+    trees = { p for host in hosts for tree in host.trees for p in prefixes(tree) }
+    trees |= {"", "gone", "gone.app", "biz.gone"}
+    for tree in trees:
+        assert sum( x.contains(tree) for x in shards ) == 1, tree
+    for host in hosts + make_hosts(""):
+        assert sum( x.owns(host.trees) for x in shards ) == 1, host.tree
+    for rule in { rule_name_of(x) for x in users } | {"C3_gone_level_1"}:
+        assert sum( x.owns_rule(rule) for x in shards ) == 1, rule
+
+    # 节点最多属于一个分片；被拆分的上级节点不属于任何分片，不会被删除
+    for tree in trees - {""}:
+        node = common.treename_c3_to_js([tree])[0]
+        owners = sum( x.contains_node(node) for x in shards )
+        assert owners == (0 if tree in shared else 1), tree
+
+    # 分片的子树互不重叠
+    assigned = [ t for x in shards for t in x.trees ]
+    assert len(assigned) == len(set(assigned))
+
+
+def test_shard_split_below_top_level(data):
+    hosts, _ = data
+    shards = ShardScope.split(hosts, 4)
+    # 只有一个顶层服务树时需要继续拆分
+    assert "biz" in shards[0].shared
+    assert all( x.trees for x in shards )
+    node = common.treename_c3_to_js(["biz"])[0]
+    assert not any( x.contains_node(node) for x in shards )
+
+
+def test_shard_multi_tree_host():
+    hosts = make_hosts("a.x", "a.y", "b.x", "b.y", "a.x,b.y")
+    shards = ShardScope.split(hosts, 2)
+    owners = [ x for x in shards if x.owns(["b.y", "a.x"]) ]
+    assert len(owners) == 1
+    assert owners[0].contains("a.x")
+
+
+def test_tree_scope():
+    scope = TreeScope([" biz.app. ", "ops", ""])
+    assert scope.roots == ("biz.app", "ops")
+    assert str(scope) == "biz.app,ops"
+    assert scope.contains("biz.app")
+    assert scope.contains("biz.app.web")
+    assert not scope.contains("biz.application")
+    assert not scope.contains("biz")
+    assert not scope.contains("")
+    with pytest.raises(ValueError):
+        TreeScope([" ", "."])
+
+
+def test_tree_scope_multi_tree_owner():
+    scope = TreeScope(["biz.app"])
+    # 多服务树的主机只归排序后的第一个服务树所在的范围
+    assert scope.owns(["biz.app.web", "ops.db"])
+    assert scope.owns(["", "biz.app"])
+    assert not scope.owns(["biz.app.web", "aaa"])
+    assert not TreeScope(["ops"]).owns(["ops.db", "biz.app.web"])
+    assert not scope.owns([])
+
+    nodes = ["/DEFAULT/C3/ops/db", "/DEFAULT/C3/biz/app/web", "/DEFAULT/Other/aaa"]
+    assert scope.owns_nodes(nodes)
+    assert not TreeScope(["ops"]).owns_nodes(nodes)
+    assert scope.contains_node("/DEFAULT/C3/biz/app")
+    assert not scope.contains_node("/DEFAULT/C3/biz")
+
+
+def test_tree_scope_rules():
+    scope = TreeScope(["biz.app"])
+    assert scope.owns_rule("C3_biz.app_level_1")
+    assert scope.owns_rule("C3_ops,biz.app.web_level_2")
+    assert not scope.owns_rule("C3_biz_level_1")
+    assert not TreeScope(["ops"]).owns_rule("C3_ops.db,biz.app_level_3")
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import socket
+import ipaddress
+
+ADDRESS_BITS = {4: 32, 6: 128}
+
+
+def parse_ip(ip: str):
+    """把IP字符串转换成 (版本, 整数)，非法地址抛出 ValueError"""
+    try:
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big')
+    except (OSError, TypeError):
+        pass
+    try:
+        return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), 'big')
+    except (OSError, TypeError):
+        raise ValueError(f"invalid IP address: {ip}")
+
+
+class CidrIndex(object):
+    """预编译的网段索引，按最长前缀匹配查找IP所属网段，支持 IPv4 和 IPv6
+
+    每个前缀长度一张 网络地址 -> 值 的哈希表，查找时从最长的前缀开始逐个掩码比对，
+    代价只和配置中不同前缀长度的个数有关，与网段数量无关。
+    """
+
+    def __init__(self, entries = None):
+        # 版本 -> {前缀长度: {网络地址: 值}}
+        self.tables = {4: {}, 6: {}}
+        # 版本 -> [(掩码, 哈希表)]，按前缀长度从长到短排列
+        self.masks = {4: [], 6: []}
+        # 无法解析成IP/网段的条目，按字符串精确匹配
+        self.names = set()
+        for entry, value in entries or []:
+            self.add(entry, value)
+
+    def add(self, cidr: str, value = True):
+        """添加网段（或单个IP），同一网段重复添加时保留先添加的值"""
+        network = ipaddress.ip_network(cidr.strip(), strict=False)
+        version, bits = network.version, ADDRESS_BITS[network.version]
+        table = self.tables[version].setdefault(network.prefixlen, {})
+        table.setdefault(int(network.network_address), value)
+        self.masks[version] = [ (((1 << p) - 1) << (bits - p), self.tables[version][p])
+                                for p in sorted(self.tables[version], reverse=True) ]
+
+    def lookup(self, ip: str, default = None):
+        """返回包含该IP的最长前缀网段对应的值，非法地址抛出 ValueError"""
+        version, address = parse_ip(ip)
+        for mask, table in self.masks[version]:
+            value = table.get(address & mask)
+            if value is not None:
+                return value
+        return default
+
+    def __contains__(self, ip):
+        if ip in self.names:
+            return True
+        try:
+            return self.lookup(ip) is not None
+        except ValueError:
+            return False
+
+    def __len__(self):
+        return sum( len(t) for v in self.tables.values() for t in v.values() ) + len(self.names)
+
+    @classmethod
+    def from_list(cls, entries):
+        """从IP/网段字符串列表构建索引，用于排除列表；空字符串忽略，无法解析的按字符串精确匹配"""
+        index = cls()
+        for entry in entries:
+            entry = entry.strip()
+            if not entry:
+                continue
+            try:
+                index.add(entry)
+            except ValueError:
+                index.names.add(entry)
+        return index
@@ -1,15 +1,7 @@
 # -*- coding: utf-8 -*-
 
-import os
-import sys
-import json
-import time
-import logging
-import requests
-import ipaddress
-from typing import Dict, List, Any, Tuple
-import configparser
-from utils.config import *
+from utils.config import settings
+from utils.logger import logger
 
 
 def treename_c3_to_js(trees : list) -> list:
@@ -40,19 +32,12 @@ def treename_unzip(trees):
             trees_unzip.add('.'.join(parts[0:i]))
     return list(trees_unzip)
 
-def get_template_id_by_ip(ip: str) -> dict:
+def get_template_id_by_ip(ip: str, config = settings) -> dict:
 
-    """根据IP地址判断所属网段并返回对应的模板ID"""
+    """根据IP地址判断所属网段（最长前缀匹配）并返回对应的模板ID，config 为使用的配置"""
     try:
-        ip_obj = ipaddress.ip_address(ip)
-        
-        for mapping in IP_TEMPLATE_MAPPING:
-            for cidr in mapping["cidr"]:
-                if ip_obj in ipaddress.ip_network(cidr):
-                    return {"account_name": mapping["account_name"], "template_id": mapping["template_id"]}
-        
         # 如果IP不在任何配置的网段内，使用默认模板ID
-        return DEFAULT_TEMPLATE_ID
+        return config.IP_TEMPLATE_INDEX.lookup(ip, config.DEFAULT_TEMPLATE_ID)
     except ValueError:
         logger.error(f"Invalid IP address: {ip}")
-        return DEFAULT_TEMPLATE_ID
+        return config.DEFAULT_TEMPLATE_ID
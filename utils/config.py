@@ -1,37 +1,31 @@
 # -*- coding: utf-8 -*-
+"""同步配置
+
+配置在第一次使用时才读取：导入模块不读取 config.ini，也不编译网段索引。
+代码中通过 settings.XXX 访问，测试、压测或嵌入其他程序时可以用 configure(Settings(...)) 注入配置，
+不需要真实的 config.ini。
+
+服务、API、HttpTransport 和 RequestPolicy 都接受 settings 参数，传入时只使用这份配置，
+同一进程中可以有多份互不影响的配置；为 None 时使用当前配置（settings，即 get_settings()）。
+"""
 
 import os
-import sys
-import json
-import time
-import logging
-import requests
-import ipaddress
-from typing import Dict, List, Any, Tuple
+import re
+import threading
 import configparser
+from typing import Dict, List, Any
 from .logger import logger
+from .cidr import CidrIndex
 
-# 读取配置文件
-config = configparser.ConfigParser()
-config.read(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../config.ini'), encoding='utf-8')
-
-# JumpServer 配置
-JUMPSERVER_WEBURL = config.get('JumpServer', 'weburl')
-JUMPSERVER_KEY_ID = config.get('JumpServer', 'key_id')
-JUMPSERVER_SECRET = config.get('JumpServer', 'secret')
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
 
-# OpenC3 API 配置
-OpenC3_API_URL = config.get('OpenC3', 'api_url')
-OpenC3_API_KEY = config.get('OpenC3', 'api_key')
 
-# 排除删除的IP列表
-EXCLUDED_IPS = config.get('Settings', 'excluded_ips', fallback='').split(',')
+def default_config_file() -> str:
+    """可以通过环境变量 SYNC_CONFIG 指定其他配置文件"""
+    return os.environ.get('SYNC_CONFIG', os.path.join(BASE_DIR, 'config.ini'))
 
-# 默认模板ID
-DEFAULT_TEMPLATE_ID = {"account_name": config.get('Templates', 'account_name'),
-                       "template_id": config.get('Templates', 'template_id')}
 
-def load_template_mappings() -> List[Dict[str, Any]]:
+def load_template_mappings(config) -> List[Dict[str, Any]]:
     """从配置文件中加载IP模板映射"""
     template_mappings = []
     
@@ -48,6 +42,160 @@ def load_template_mappings() -> List[Dict[str, Any]]:
     logger.info(f"Loaded {len(template_mappings)} template mappings from config")
     return template_mappings
 
-# 加载IP模板映射
-IP_TEMPLATE_MAPPING = load_template_mappings()
+def build_template_index(template_mappings) -> CidrIndex:
+    """把IP模板映射编译成网段索引"""
+    index = CidrIndex()
+    for mapping in template_mappings:
+        for cidr in mapping["cidr"]:
+            try:
+                index.add(cidr, {"account_name": mapping["account_name"], "template_id": mapping["template_id"]})
+            except ValueError:
+                logger.error(f"Invalid CIDR in template mapping: {cidr}")
+    return index
+
+def load_jumpserver_targets(config) -> List[Dict[str, Any]]:
+    """加载同步目标：[JumpServer] 为默认目标（name 为空），[JumpServer:<name>] 为其他目标"""
+    targets = []
+    for section in config.sections():
+        if section == 'JumpServer':
+            name = ''
+        elif section.startswith('JumpServer:'):
+            name = section.split(':', 1)[1].strip()
+            # 目标名称用作状态子目录和统计标签
+            if not re.fullmatch(r'[A-Za-z0-9_.-]+', name) or name in ('.', '..'):
+                logger.error(f"Invalid JumpServer target name: {section}")
+                continue
+        else:
+            continue
+        if not config.get(section, 'weburl', fallback=''):
+            continue
+        targets.append({"name": name, "weburl": config.get(section, 'weburl'),
+                        "key_id": config.get(section, 'key_id'), "secret": config.get(section, 'secret')})
+
+    logger.info(f"Loaded {len(targets)} JumpServer targets from config")
+    return targets
+
+
+class Settings(object):
+    """
+    一份完整的同步配置，属性名与原来的模块级常量相同
+    path 为配置文件，values 为 {段: {键: 值}}，两者都提供时 values 覆盖文件中的值；没有提供的配置使用默认值
+    """
+
+    def __init__(self, path = None, values = None):
+        config = configparser.ConfigParser()
+        if path:
+            config.read(path, encoding='utf-8')
+        if values:
+            config.read_dict(values)
+        self.path = path
+        self.config = config
+
+        # JumpServer 配置，[JumpServer:<name>] 可以配置更多同步目标（见 JUMPSERVER_TARGETS）
+        self.JUMPSERVER_WEBURL = config.get('JumpServer', 'weburl', fallback='')
+        self.JUMPSERVER_KEY_ID = config.get('JumpServer', 'key_id', fallback='')
+        self.JUMPSERVER_SECRET = config.get('JumpServer', 'secret', fallback='')
+        # 列表接口分页大小及并发获取的页数
+        self.JUMPSERVER_PAGE_SIZE = config.getint('JumpServer', 'page_size', fallback=500)
+        self.JUMPSERVER_PAGE_WORKERS = config.getint('JumpServer', 'page_workers', fallback=4)
+        # 批量删除每批的对象数量，0 表示不使用批量删除接口
+        self.JUMPSERVER_BULK_DELETE_SIZE = config.getint('JumpServer', 'bulk_delete_size', fallback=500)
+
+        # OpenC3 API 配置
+        self.OpenC3_API_URL = config.get('OpenC3', 'api_url', fallback='')
+        self.OpenC3_API_KEY = config.get('OpenC3', 'api_key', fallback='')
+        # 流式解析主机数据，关闭后一次性读取整个响应
+        self.OpenC3_STREAM = config.getboolean('OpenC3', 'stream', fallback=True)
+
+        # 排除删除的IP列表，支持单个IP和网段
+        self.EXCLUDED_IPS = CidrIndex.from_list(config.get('Settings', 'excluded_ips', fallback='').split(','))
+
+        # 并发创建主机的线程数
+        self.HOST_WORKERS = config.getint('Settings', 'workers', fallback=8)
+
+        # 删除保护：一次计划删除的主机或授权规则超过已有数量的 max_delete_ratio 时整个删除阶段不执行，
+        # 删除数量不超过 max_delete_min 时不检查；max_delete_ratio 为 0 时不限制
+        self.MAX_DELETE_RATIO = config.getfloat('Settings', 'max_delete_ratio', fallback=0.2)
+        self.MAX_DELETE_MIN = config.getint('Settings', 'max_delete_min', fallback=10)
+
+        # 增量同步的状态目录，以及两次全量同步的最大间隔（秒）
+        self.STATE_DIR = os.path.join(BASE_DIR, config.get('Settings', 'state_dir', fallback='logs'))
+        self.FULL_SYNC_INTERVAL = config.getint('Settings', 'full_sync_interval', fallback=3600)
+
+        # 守护进程模式下两次同步之间的间隔和随机抖动（秒）
+        self.DAEMON_INTERVAL = config.getfloat('Daemon', 'interval', fallback=300)
+        self.DAEMON_JITTER = config.getfloat('Daemon', 'jitter', fallback=30)
+
+        # 变更通知接收端：监听地址（"port" 或 "host:port"，为空时不启动）、合并窗口（秒）和校验 token
+        self.RECEIVER_LISTEN = config.get('Receiver', 'listen', fallback='')
+        self.RECEIVER_WINDOW = config.getfloat('Receiver', 'window', fallback=5)
+        self.RECEIVER_TOKEN = config.get('Receiver', 'token', fallback='')
+        self.RECEIVER_MIN_INTERVAL = config.getfloat('Receiver', 'min_interval', fallback=60)
+
+        # 每次运行结束后导出统计数据：JSON 文件和 node_exporter textfile（为空时不导出）
+        self.METRICS_JSON_FILE = config.get('Metrics', 'json_file', fallback='logs/metrics.json')
+        self.METRICS_TEXTFILE = config.get('Metrics', 'textfile', fallback='')
+        self.METRICS_JSON_FILE = self.METRICS_JSON_FILE and os.path.join(BASE_DIR, self.METRICS_JSON_FILE)
+        self.METRICS_TEXTFILE = self.METRICS_TEXTFILE and os.path.join(BASE_DIR, self.METRICS_TEXTFILE)
+
+        # HTTP 连接池配置
+        self.HTTP_POOL_SIZE = config.getint('Http', 'pool_size', fallback=10)
+        self.HTTP_CONNECT_TIMEOUT = config.getfloat('Http', 'connect_timeout', fallback=5)
+        self.HTTP_READ_TIMEOUT = config.getfloat('Http', 'read_timeout', fallback=60)
+        self.HTTP_GZIP = config.getboolean('Http', 'gzip', fallback=True)
+
+        # 请求策略：失败重试次数和指数退避（秒），读/写请求每秒限速（0 表示不限速）及突发数量，
+        # 请求延迟超过 target_latency 秒时降低并发（0 表示只按错误调整）
+        self.HTTP_MAX_RETRIES = config.getint('Http', 'max_retries', fallback=3)
+        self.HTTP_BACKOFF = config.getfloat('Http', 'backoff', fallback=0.5)
+        self.HTTP_BACKOFF_MAX = config.getfloat('Http', 'backoff_max', fallback=30)
+        self.HTTP_READ_RATE = config.getfloat('Http', 'read_rate', fallback=0)
+        self.HTTP_WRITE_RATE = config.getfloat('Http', 'write_rate', fallback=0)
+        self.HTTP_BURST = config.getint('Http', 'burst', fallback=10)
+        self.HTTP_TARGET_LATENCY = config.getfloat('Http', 'target_latency', fallback=0)
+
+        # 默认模板ID
+        self.DEFAULT_TEMPLATE_ID = {"account_name": config.get('Templates', 'account_name', fallback=''),
+                                    "template_id": config.get('Templates', 'template_id', fallback='')}
+
+        # 同步目标和IP模板映射
+        self.JUMPSERVER_TARGETS = load_jumpserver_targets(config)
+        self.IP_TEMPLATE_MAPPING = load_template_mappings(config)
+        self.IP_TEMPLATE_INDEX = build_template_index(self.IP_TEMPLATE_MAPPING)
+
+
+# 当前配置，第一次使用时从配置文件读取
+current_settings = None
+settings_lock = threading.Lock()
+
+
+def get_settings() -> Settings:
+    global current_settings
+    if current_settings is None:
+        with settings_lock:
+            if current_settings is None:
+                current_settings = Settings(default_config_file())
+    return current_settings
+
+
+def configure(settings: Settings):
+    """注入配置，之后的 get_settings() / settings.XXX 都使用它"""
+    global current_settings
+    current_settings = settings
+
+
+class LazySettings(object):
+    """当前配置的代理，访问属性时才读取配置"""
+
+    def __getattr__(self, name):
+        return getattr(get_settings(), name)
+
+
+settings = LazySettings()
+
 
+def __getattr__(name):
+    """兼容 from utils.config import HOST_WORKERS 的写法，访问时才读取配置"""
+    if name[:1].isupper():
+        return getattr(get_settings(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""写操作日志：记录每次 JumpServer 写请求的意图和结果，同步中断后可以用 --resume 继续
+
+每次执行非空的计划前把计划和执行后要保存的快照哈希保存成检查点（<name>.checkpoint，JSON），
+执行过程中每个写请求发出前追加一条 intent，返回后追加 done 或 failed（<name>.jsonl，每行一条 JSON），
+计划执行完成后追加 end 并删除检查点。检查点存在说明上一次执行被中断。
+
+    {"event": "begin", "run": "...", "time": ...}
+    {"event": "intent", "seq": 1, "op": "add_host", "key": "10.0.0.1", "time": ...}
+    {"event": "done", "seq": 1, "id": "...", "time": ...}
+    {"event": "end", "result": {...}, "time": ...}
+
+每条记录写入后立即 flush，进程被杀死或 OOM 时已写入的记录不会丢失；检查点写入时 fsync。
+"""
+
+import os
+import glob
+import json
+import time
+import uuid
+import functools
+import threading
+from utils.logger import logger
+
+
+def outcome_of(result):
+    """把写方法的返回值转换成 (是否成功, 对象ID)"""
+    if isinstance(result, bool):
+        return result, None
+    if isinstance(result, int):
+        return result in [200, 201, 204], None
+    if isinstance(result, tuple):
+        ok, body = result
+        return ok, body.get("id") if isinstance(body, dict) else None
+    if isinstance(result, dict):
+        return "id" in result, result.get("id")
+    return bool(result), None
+
+
+def journaled(op, key):
+    """
+    装饰 JumpServerAPI 的写方法：self.journal 不为空时在请求前后记录意图和结果
+    key 接收方法的参数，返回被修改对象的标识（节点 full_value、主机IP、规则名称或对象ID）
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            journal = self.journal
+            if journal is None:
+                return func(self, *args, **kwargs)
+            seq = journal.intent(op, key(*args, **kwargs))
+            try:
+                result = func(self, *args, **kwargs)
+            except Exception as e:
+                journal.outcome(seq, False, error=str(e))
+                raise
+            journal.outcome(seq, *outcome_of(result))
+            return result
+        return wrapper
+    return decorator
+
+
+class Journal(object):
+    """一个状态目录下的写操作日志，name 区分同一目标的多个分片"""
+
+    def __init__(self, state_dir, name = 'journal'):
+        os.makedirs(state_dir, exist_ok=True)
+        self.path = os.path.join(state_dir, f"{name}.jsonl")
+        self.checkpoint_path = os.path.join(state_dir, f"{name}.checkpoint")
+        self.file = None
+        self.seq = 0
+        self.lock = threading.Lock()
+        self.logger = logger
+
+    @classmethod
+    def interrupted(cls, state_dir) -> list:
+        """状态目录下所有被中断（检查点仍然存在）的日志"""
+        names = sorted( os.path.basename(x)[:-len(".checkpoint")] for x in glob.glob(os.path.join(state_dir, "*.checkpoint")) )
+        return [ cls(state_dir, x) for x in names ]
+
+    def is_interrupted(self) -> bool:
+        return os.path.exists(self.checkpoint_path)
+
+    def write(self, record):
+        record["time"] = round(time.time(), 3)
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def begin(self, checkpoint):
+        """开始执行一个新计划：保存检查点，上一次的日志保留为 <name>.jsonl.1"""
+        checkpoint = dict(checkpoint, run=uuid.uuid4().hex)
+        tmp = f"{self.checkpoint_path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f, ensure_ascii=False, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(self.path):
+            os.replace(self.path, f"{self.path}.1")
+        os.replace(tmp, self.checkpoint_path)
+        self.file = open(self.path, 'a', encoding='utf-8')
+        self.seq = 0
+        self.write({"event": "begin", "run": checkpoint["run"]})
+
+    def load(self):
+        """读取检查点内容"""
+        with open(self.checkpoint_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def reopen(self, run):
+        """继续执行被中断的计划，之后的记录追加到原来的日志中"""
+        self.seq = max([ x.get("seq", 0) for x in self.records() ] or [0])
+        self.file = open(self.path, 'a', encoding='utf-8')
+        self.write({"event": "resume", "run": run})
+
+    def records(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # 进程在写入一行的过程中退出
+                    continue
+
+    def replay(self):
+        """返回 (已完成的 (op, key) 集合, 结果未知的 (op, key) 集合)，批量删除展开成逐个对象的 delete"""
+        intents, done = {}, set()
+        for record in self.records():
+            event = record.get("event")
+            if event == "intent":
+                key = record["key"]
+                if record["op"] == "bulk_delete":
+                    intents[record["seq"]] = [ ("delete", x) for x in key ]
+                else:
+                    intents[record["seq"]] = [ (record["op"], key) ]
+            elif event == "done":
+                done.update(intents.pop(record["seq"], []))
+            elif event == "failed":
+                intents.pop(record["seq"], None)
+        pending = set( x for items in intents.values() for x in items ) - done
+        return done, pending
+
+    def intent(self, op, key) -> int:
+        with self.lock:
+            self.seq += 1
+            seq = self.seq
+        self.write({"event": "intent", "seq": seq, "op": op, "key": key})
+        return seq
+
+    def outcome(self, seq, ok, id = None, error = None):
+        record = {"event": "done" if ok else "failed", "seq": seq}
+        if id is not None:
+            record["id"] = id
+        if error is not None:
+            record["error"] = error
+        self.write(record)
+
+    def finish(self, result = None):
+        """计划执行完成：追加 end 并删除检查点；没有 begin / reopen（空计划）时什么都不做"""
+        if self.file is None:
+            return
+        self.write({"event": "end", "result": result or {}})
+        self.close()
+        self.discard()
+
+    def discard(self):
+        """删除检查点，被中断的计划不再需要继续"""
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import json
+import codecs
+
+WHITESPACE = ' \t\n\r'
+
+
+class JsonStream(object):
+    """增量解析 {"key": [...], ...} 形式的 JSON 响应
+
+    iter_array(key) 按顺序逐个产出顶层对象中 key 数组的元素，不需要把整个响应体
+    读进内存；顶层的其他字段（例如 stat）解析后保存在 fields 中。
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json_decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.fields = {}
+
+    def fill(self) -> bool:
+        """读取下一块数据追加到缓冲区，没有更多数据时返回 False"""
+        if self.eof:
+            return False
+        for chunk in self.chunks:
+            text = self.text_decoder.decode(chunk)
+            if text:
+                self.buf = self.buf[self.pos:] + text
+                self.pos = 0
+                return True
+        self.buf = self.buf[self.pos:] + self.text_decoder.decode(b'', final=True)
+        self.pos = 0
+        self.eof = True
+        return False
+
+    def peek(self) -> str:
+        """跳过空白并返回下一个字符，数据结束时返回空字符串"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, chars):
+        ch = self.peek()
+        if not ch or ch not in chars:
+            raise ValueError(f"Invalid JSON stream: expected {chars!r} at offset {self.pos}, got {ch!r}")
+        self.pos += 1
+        return ch
+
+    def value(self):
+        """解析下一个完整的 JSON 值"""
+        self.peek()
+        while True:
+            try:
+                obj, end = self.json_decoder.raw_decode(self.buf, self.pos)
+                # 数字可能被分块截断，值后面必须还有字符才能确认已经完整
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+    def iter_array(self, key):
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            name = self.value()
+            self.expect(':')
+            if name == key and self.peek() == '[':
+                self.pos += 1
+                if self.peek() == ']':
+                    self.pos += 1
+                else:
+                    while True:
+                        yield self.value()
+                        if self.expect(',]') == ']':
+                            break
+            else:
+                self.fields[name] = self.value()
+            if self.expect(',}') == '}':
+                return
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+import os
+import fcntl
+from utils.logger import logger
+
+
+class RunLock(object):
+    """基于 flock 的进程锁，保证同一个状态目录同时只有一次同步在运行
+
+    cron 单次运行、守护进程和变更通知处理使用同一个锁文件，进程退出时锁自动释放。
+    每次 acquire 都打开新的文件描述符，所以同一进程内的多个线程之间同样互斥。
+    """
+
+    def __init__(self, state_dir):
+        os.makedirs(state_dir, exist_ok=True)
+        self.path = os.path.join(state_dir, 'sync.lock')
+        self.fd = None
+        self.logger = logger
+
+    def acquire(self, blocking = False) -> bool:
+        """获取锁，非阻塞模式下锁已被持有时返回 False"""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        self.fd = fd
+        return True
+
+    def release(self):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *args):
+        self.release()
@@ -2,22 +2,34 @@
 
 import os
 import sys
-import json
-import time
 import logging
-import requests
-import ipaddress
-from typing import Dict, List, Any, Tuple
-import configparser
-
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../logs/sync.log'))
-    ]
-)
+
+LOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../logs/sync.log')
+
+# 导入时只获取 logger，输出由命令行入口调用 setup_logging 配置
 logger = logging.getLogger('sync')
 
+
+def setup_logging(log_file = LOG_FILE, level = logging.INFO):
+    """配置日志输出到标准输出和日志文件（log_file 为空时只输出到标准输出）"""
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if log_file:
+        os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+        handlers.append(logging.FileHandler(log_file))
+    logging.basicConfig(
+        level=level,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=handlers
+    )
+
+
+class TargetLogger(logging.LoggerAdapter):
+    """在日志前加上同步目标名称，多个 JumpServer 目标并发同步时区分日志来源"""
+
+    def process(self, msg, kwargs):
+        return f"[{self.extra['target']}] {msg}", kwargs
+
+
+def logger_for(target):
+    """默认目标（名称为空）直接使用 logger"""
+    return TargetLogger(logger, {"target": target}) if target else logger
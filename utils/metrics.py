@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from utils.phase import current_target
+
+# 请求耗时直方图的桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class EndpointStats(object):
+    """一个 (目标, 阶段, 接口) 的请求统计"""
+
+    __slots__ = ("calls", "errors", "bytes_sent", "bytes_received", "seconds", "buckets")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.seconds = 0.0
+        # 每个桶单独计数，导出时再累加成 Prometheus 的 le 格式
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def observe(self, seconds, error, bytes_sent, bytes_received):
+        self.calls += 1
+        self.errors += 1 if error else 0
+        self.bytes_sent += bytes_sent
+        self.bytes_received += bytes_received
+        self.seconds += seconds
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def merge(self, other):
+        self.calls += other.calls
+        self.errors += other.errors
+        self.bytes_sent += other.bytes_sent
+        self.bytes_received += other.bytes_received
+        self.seconds += other.seconds
+        self.buckets = [ x + y for x, y in zip(self.buckets, other.buckets) ]
+
+    def to_dict(self):
+        cumulative, total = {}, 0
+        for le, count in zip(list(LATENCY_BUCKETS) + ["+Inf"], self.buckets):
+            total += count
+            cumulative[str(le)] = total
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "seconds": round(self.seconds, 6),
+            "buckets": cumulative,
+        }
+
+
+class Metrics(object):
+    """一次同步运行的统计：按阶段和接口记录请求数、错误数、耗时直方图和传输字节数
+
+    请求在 HttpTransport 中记录，阶段通过 utils.phase 的 hook 切换。
+    多个 JumpServer 目标并发同步时每个目标有各自的当前阶段，请求按 transport 所属的目标归类；
+    默认目标和 OpenC3 的目标名称为空。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = {}
+            self.phases = {}
+            # 目标 -> 当前阶段
+            self.current_phases = {}
+            self.started = time.time()
+
+    def observe_request(self, endpoint, seconds, error = False, bytes_sent = 0, bytes_received = 0, target = ''):
+        with self.lock:
+            key = (target, self.current_phases.get(target, "other"), endpoint)
+            stats = self.endpoints.get(key)
+            if stats is None:
+                stats = self.endpoints[key] = EndpointStats()
+            stats.observe(seconds, error, bytes_sent, bytes_received)
+
+    @contextmanager
+    def phase(self, name):
+        """phase hook：切换当前线程所属目标的当前阶段并记录阶段耗时"""
+        target = current_target()
+        with self.lock:
+            previous = self.current_phases.get(target, "other")
+            self.current_phases[target] = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                key = (target, name)
+                self.phases[key] = self.phases.get(key, 0.0) + time.perf_counter() - start
+                self.current_phases[target] = previous
+
+    def dump(self):
+        """导出原始统计，用于把分片子进程的统计合并到主进程"""
+        with self.lock:
+            return dict(self.endpoints), dict(self.phases)
+
+    def merge(self, endpoints, phases):
+        """合并 dump 的结果：请求统计累加，并发运行的阶段耗时取最大值"""
+        with self.lock:
+            for key, stats in endpoints.items():
+                if key in self.endpoints:
+                    self.endpoints[key].merge(stats)
+                else:
+                    self.endpoints[key] = stats
+            for key, seconds in phases.items():
+                self.phases[key] = max(self.phases.get(key, 0.0), seconds)
+
+    def to_dict(self, success = True):
+        with self.lock:
+            return {
+                "started": self.started,
+                "duration": round(time.time() - self.started, 6),
+                "success": success,
+                # 其他目标的阶段名称为 "<target>/<phase>"
+                "phases": { f"{target}/{name}" if target else name: round(v, 6)
+                            for (target, name), v in self.phases.items() },
+                "endpoints": [ dict(target=target, phase=phase, endpoint=endpoint, **stats.to_dict())
+                               for (target, phase, endpoint), stats in sorted(self.endpoints.items()) ],
+            }
+
+    @staticmethod
+    def to_prometheus(data) -> str:
+        """生成 node_exporter textfile collector 格式"""
+        lines = []
+
+        def metric(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def labels(**kwargs):
+            # 默认目标不输出 target 标签，与只有一个目标时的输出保持一致
+            return ",".join( f'{k}="{v}"' for k, v in kwargs.items() if k != "target" or v )
+
+        metric("openc3_jumpserver_sync_last_run_timestamp_seconds", "gauge", "Start time of the last sync run.")
+        lines.append(f"openc3_jumpserver_sync_last_run_timestamp_seconds {data['started']}")
+        metric("openc3_jumpserver_sync_duration_seconds", "gauge", "Wall time of the last sync run.")
+        lines.append(f"openc3_jumpserver_sync_duration_seconds {data['duration']}")
+        metric("openc3_jumpserver_sync_success", "gauge", "Whether the last sync run finished without an exception.")
+        lines.append(f"openc3_jumpserver_sync_success {int(data['success'])}")
+
+        metric("openc3_jumpserver_sync_phase_duration_seconds", "gauge", "Wall time per sync phase.")
+        for key, seconds in data["phases"].items():
+            target, _, phase = key.rpartition("/")
+            lines.append(f"openc3_jumpserver_sync_phase_duration_seconds{{{labels(target=target, phase=phase)}}} {seconds}")
+
+        counters = (
+            ("openc3_jumpserver_http_requests_total", "calls", "HTTP requests per phase and endpoint."),
+            ("openc3_jumpserver_http_errors_total", "errors", "Failed HTTP requests (exception or status >= 400)."),
+            ("openc3_jumpserver_http_sent_bytes_total", "bytes_sent", "Request body bytes sent."),
+            ("openc3_jumpserver_http_received_bytes_total", "bytes_received", "Response body bytes received."),
+        )
+        for name, field, help_text in counters:
+            metric(name, "counter", help_text)
+            for x in data["endpoints"]:
+                lines.append(f"{name}{{{labels(target=x['target'], phase=x['phase'], endpoint=x['endpoint'])}}} {x[field]}")
+
+        name = "openc3_jumpserver_http_request_duration_seconds"
+        metric(name, "histogram", "HTTP request latency per phase and endpoint.")
+        for x in data["endpoints"]:
+            for le, count in x["buckets"].items():
+                lines.append(f"{name}_bucket{{{labels(target=x['target'], phase=x['phase'], endpoint=x['endpoint'], le=le)}}} {count}")
+            lines.append(f"{name}_sum{{{labels(target=x['target'], phase=x['phase'], endpoint=x['endpoint'])}}} {x['seconds']}")
+            lines.append(f"{name}_count{{{labels(target=x['target'], phase=x['phase'], endpoint=x['endpoint'])}}} {x['calls']}")
+
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def write_atomic(path, content):
+        """先写临时文件再改名，避免 node_exporter 读到写了一半的文件"""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp, path)
+
+    def export(self, json_file = None, textfile = None, success = True):
+        data = self.to_dict(success)
+        if json_file:
+            self.write_atomic(json_file, json.dumps(data, indent=2, ensure_ascii=False))
+        if textfile:
+            self.write_atomic(textfile, self.to_prometheus(data))
+        return data
+
+
+metrics = Metrics()
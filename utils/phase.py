@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from contextlib import contextmanager, ExitStack
+from utils.logger import logger_for
+
+# 每个 hook 接收阶段名称，返回一个上下文管理器，用于在阶段前后做统计
+phase_hooks = []
+
+# 当前线程正在同步的 JumpServer 目标
+local = threading.local()
+
+
+def add_phase_hook(hook):
+    """注册 hook，已经注册过时不重复注册"""
+    if hook not in phase_hooks:
+        phase_hooks.append(hook)
+
+
+def remove_phase_hook(hook):
+    if hook in phase_hooks:
+        phase_hooks.remove(hook)
+
+
+def current_target() -> str:
+    return getattr(local, 'target', '')
+
+
+@contextmanager
+def target_scope(name):
+    """标记当前线程中的阶段属于哪个同步目标"""
+    previous, local.target = current_target(), name
+    try:
+        yield
+    finally:
+        local.target = previous
+
+
+@contextmanager
+def phase(name):
+    """标记同步过程中的一个阶段，记录开始/结束日志并调用已注册的 hook"""
+    log = logger_for(current_target())
+    log.info(f"{name} start.")
+    with ExitStack() as stack:
+        for hook in list(phase_hooks):
+            stack.enter_context(hook(name))
+        yield
+    log.info(f"{name} done.")
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from utils.logger import logger
+from utils import config
+
+# 可以安全重试的方法；其他方法只在服务端明确没有处理请求（429/503）时重试
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+REJECTED_STATUSES = (429, 503)
+
+
+class TokenBucket(object):
+    """令牌桶限速，rate 为每秒请求数，0 表示不限速"""
+
+    def __init__(self, rate, burst = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AimdLimiter(object):
+    """AIMD 并发控制：请求成功且延迟正常时并发上限缓慢增加，出错或延迟过高时减半
+
+    每个窗口（约等于当前上限个请求）内最多减半一次，避免一批并发请求同时失败时上限降到最低。
+    """
+
+    def __init__(self, maximum, minimum = 1, target_latency = 0):
+        self.maximum = max(1, maximum)
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.target_latency = target_latency
+        self.limit = float(self.maximum)
+        self.inflight = 0
+        # 第一次出错时立即减半
+        self.since_decrease = self.maximum
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while self.inflight >= int(self.limit):
+                self.cond.wait()
+            self.inflight += 1
+
+    def release(self, latency, overloaded):
+        with self.cond:
+            self.inflight -= 1
+            self.since_decrease += 1
+            if overloaded or (self.target_latency and latency > self.target_latency):
+                if self.since_decrease >= self.limit:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    # 减半前已经发出的请求属于上一个窗口，不计入下一个窗口
+                    self.since_decrease = -self.inflight
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.cond.notify_all()
+
+
+class RequestPolicy(object):
+    """HttpTransport 使用的请求策略：读写分别限速和控制并发，失败时按指数退避加随机抖动重试
+
+    读请求为 GET/HEAD/OPTIONS，其他方法为写请求；响应带 Retry-After 时按服务端要求等待。
+    参数为空时使用 [Http] 配置中的值。
+    """
+
+    def __init__(self, max_retries = None, backoff = None, backoff_max = None,
+                 read_rate = None, write_rate = None, burst = None,
+                 concurrency = None, target_latency = None, settings = None):
+        settings = settings or config.settings
+        pick = lambda value, default: default if value is None else value
+        self.max_retries = pick(max_retries, settings.HTTP_MAX_RETRIES)
+        self.backoff = pick(backoff, settings.HTTP_BACKOFF)
+        self.backoff_max = pick(backoff_max, settings.HTTP_BACKOFF_MAX)
+        burst = pick(burst, settings.HTTP_BURST)
+        self.buckets = {"read": TokenBucket(pick(read_rate, settings.HTTP_READ_RATE), burst),
+                        "write": TokenBucket(pick(write_rate, settings.HTTP_WRITE_RATE), burst)}
+        concurrency = pick(concurrency, settings.HTTP_POOL_SIZE)
+        target_latency = pick(target_latency, settings.HTTP_TARGET_LATENCY)
+        self.limiters = { x: AimdLimiter(concurrency, 1, target_latency) for x in ("read", "write") }
+        self.logger = logger
+
+    @staticmethod
+    def kind_of(method) -> str:
+        return "read" if method in ('GET', 'HEAD', 'OPTIONS') else "write"
+
+    def should_retry(self, method, attempt, status = None) -> bool:
+        """status 为 None 表示连接失败或超时"""
+        if attempt >= self.max_retries:
+            return False
+        if method in IDEMPOTENT_METHODS:
+            return status is None or status in RETRY_STATUSES
+        return status in REJECTED_STATUSES
+
+    @staticmethod
+    def retry_after(response):
+        """解析 Retry-After（秒数或 HTTP 日期），没有时返回 None"""
+        value = response.headers.get('Retry-After') if response is not None else None
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def delay(self, attempt, response = None) -> float:
+        retry_after = self.retry_after(response)
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        # full jitter
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+
+    def execute(self, method, send):
+        """按策略执行 send()，send 每次调用发出一次请求并返回 response"""
+        import requests
+        kind = self.kind_of(method)
+        attempt = 0
+        while True:
+            self.buckets[kind].acquire()
+            limiter = self.limiters[kind]
+            limiter.acquire()
+            start = time.perf_counter()
+            response = None
+            try:
+                response = send()
+            except (requests.ConnectionError, requests.Timeout) as e:
+                limiter.release(time.perf_counter() - start, True)
+                if not self.should_retry(method, attempt):
+                    raise
+                self.logger.warning(f"{method} request failed ({type(e).__name__}), retry {attempt + 1}/{self.max_retries}")
+            except Exception:
+                limiter.release(time.perf_counter() - start, False)
+                raise
+            else:
+                status = response.status_code
+                limiter.release(time.perf_counter() - start, status == 429 or status >= 500)
+                if not self.should_retry(method, attempt, status):
+                    return response
+                self.logger.warning(f"{method} {response.request.path_url} returned {status}, retry {attempt + 1}/{self.max_retries}")
+                response.close()
+            time.sleep(self.delay(attempt, response))
+            attempt += 1
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""--profile：按阶段记录 CPU（cProfile）、内存分配（tracemalloc）和最慢的 HTTP 请求
+
+结果写入一个目录，默认目标的文件在目录下，其他目标在 <target>/ 子目录下：
+
+    <phase>.pstats      cProfile 数据，可以用 python -m pstats 或 snakeviz 查看
+    <phase>.alloc.txt   阶段结束时相对阶段开始增长最多的分配位置
+    http_slowest.txt    耗时最长的 N 个请求（目标、阶段、接口、路径、状态码、请求和响应字节数）
+    summary.txt         每个阶段 CPU 耗时最多的函数、内存峰值和最慢的请求
+
+Python 3.11 及以前 cProfile 只能统计开启它的线程，所以阶段中新建的工作线程（ThreadPoolExecutor）也单独开启一个 cProfile，
+合并到新建线程时最近开始的阶段。Python 3.12 起 cProfile 基于 sys.monitoring，同一时间只能有一个 cProfile 在运行，
+但它能统计所有线程：整次运行只开启一个 cProfile，每个阶段开始和结束时把之前的数据归入当时最近开始的阶段。
+多个 JumpServer 目标并发同步时 CPU 数据的归属和内存数据只是近似值。
+"""
+
+import io
+import os
+import sys
+import time
+import heapq
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from utils.logger import logger
+from utils.phase import add_phase_hook, remove_phase_hook, current_target
+from utils.transport import add_request_hook, remove_request_hook
+
+# 一个 cProfile 统计所有线程（Python 3.12 起）
+SHARED_PROFILE = sys.version_info >= (3, 12)
+
+# tracemalloc 不统计的文件
+ALLOC_EXCLUDES = (tracemalloc.__file__, "<frozen importlib._bootstrap>", "<frozen importlib._bootstrap_external>", "<unknown>")
+
+
+class PhaseProfile(object):
+    """一个 (目标, 阶段) 的统计，同一阶段多次运行时累加"""
+
+    def __init__(self):
+        self.profiles = []
+        self.allocations = []
+        self.seconds = 0.0
+        self.peak = 0
+
+
+class Profiler(object):
+    """通过 phase hook 和 request hook 收集统计，start() 之后运行同步，stop() 之后 report() 写入 out_dir
+
+    shared 为空时按 Python 版本选择：整次运行一个 cProfile（3.12 起），或每个线程一个 cProfile。
+    """
+
+    def __init__(self, out_dir, top = 20, shared = None):
+        self.out_dir = out_dir
+        self.top = top
+        self.shared = SHARED_PROFILE if shared is None else shared
+        # shared 时整次运行共用的 cProfile
+        self.profile = None
+        self.phases = {}
+        # 正在运行的 (目标, 阶段)，新建的工作线程归属最后一个
+        self.active = []
+        # 目标 -> 当前阶段，用于给请求归类
+        self.current_phases = {}
+        # 最慢请求的小顶堆
+        self.slowest = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.logger = logger
+
+    def start(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+        tracemalloc.start()
+        if self.shared:
+            self.profile = self.enable(cProfile.Profile())
+        else:
+            threading.setprofile(self.thread_started)
+        add_phase_hook(self.phase)
+        add_request_hook(self.request)
+
+    def stop(self):
+        remove_request_hook(self.request)
+        remove_phase_hook(self.phase)
+        if self.shared:
+            self.split()
+            if self.profile is not None:
+                self.profile.disable()
+                self.profile = None
+        else:
+            threading.setprofile(None)
+        tracemalloc.stop()
+
+    def enable(self, profile):
+        """开启 cProfile，已经有其他 profiler 在运行时（Python 3.12 起同一时间只能有一个）返回 None"""
+        try:
+            profile.enable()
+            return profile
+        except ValueError as e:
+            self.logger.warning(f"cProfile disabled: {str(e)}")
+            return None
+
+    def split(self):
+        """shared 时把上一次拆分之后的 cProfile 数据归入最近开始的阶段，没有阶段在运行时丢弃"""
+        with self.lock:
+            if self.profile is None:
+                return
+            self.profile.disable()
+            if self.active and self.profile.getstats():
+                self.phases[self.active[-1]].profiles.append(pstats.Stats(self.profile))
+            self.profile.clear()
+            self.profile.enable()
+
+    def phase_of(self, key) -> PhaseProfile:
+        with self.lock:
+            if key not in self.phases:
+                self.phases[key] = PhaseProfile()
+            return self.phases[key]
+
+    def thread_started(self, frame, event, arg):
+        """threading.setprofile 的回调，在新线程的第一个事件中调用一次；不能抛出异常，否则工作线程直接退出"""
+        sys.setprofile(None)
+        with self.lock:
+            key = self.active[-1] if self.active else None
+        if key is None:
+            return
+        # 这个线程中再开始的阶段不再单独开启 cProfile
+        self.local.profiling = True
+        profile = self.enable(cProfile.Profile())
+        if profile is not None:
+            self.phase_of(key).profiles.append(profile)
+
+    @contextmanager
+    def phase(self, name):
+        """phase hook：当前线程没有在统计其他阶段时开启 cProfile，并在阶段前后各取一次内存快照"""
+        key = (current_target(), name)
+        stats = self.phase_of(key)
+        if self.shared:
+            self.split()
+        with self.lock:
+            self.active.append(key)
+            previous = self.current_phases.get(key[0], "other")
+            self.current_phases[key[0]] = name
+        profile = None
+        if not self.shared and not getattr(self.local, 'profiling', False):
+            profile = cProfile.Profile()
+        before = self.snapshot()
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        if profile is not None:
+            profile = self.enable(profile)
+        if profile is not None:
+            stats.profiles.append(profile)
+            self.local.profiling = True
+        try:
+            yield
+        finally:
+            if self.shared:
+                self.split()
+            if profile is not None:
+                profile.disable()
+                self.local.profiling = False
+            stats.seconds += time.perf_counter() - start
+            stats.peak = max(stats.peak, tracemalloc.get_traced_memory()[1] - base)
+            stats.allocations.append(self.snapshot().compare_to(before, 'lineno')[:self.top])
+            with self.lock:
+                self.active.remove(key)
+                self.current_phases[key[0]] = previous
+
+    @staticmethod
+    def snapshot():
+        return tracemalloc.take_snapshot().filter_traces([ tracemalloc.Filter(False, x) for x in ALLOC_EXCLUDES ])
+
+    def request(self, target, endpoint, path, seconds, status, bytes_sent, bytes_received):
+        """request hook：保留耗时最长的 top 个请求"""
+        with self.lock:
+            item = (seconds, target, self.current_phases.get(target, "other"), endpoint, path, status, bytes_sent, bytes_received)
+            if len(self.slowest) < self.top:
+                heapq.heappush(self.slowest, item)
+            elif seconds > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, item)
+
+    def path_of(self, target, name) -> str:
+        directory = os.path.join(self.out_dir, target) if target else self.out_dir
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, name)
+
+    def format_calls(self) -> str:
+        lines = [f"{'seconds':>9} {'status':>6} {'sent':>9} {'received':>10}  target/phase  endpoint  path"]
+        for seconds, target, phase, endpoint, path, status, sent, received in sorted(self.slowest, reverse=True):
+            name = f"{target}/{phase}" if target else phase
+            lines.append(f"{seconds:>9.3f} {status or '-':>6} {sent:>9} {received:>10}  {name}  {endpoint}  {path}")
+        return "\n".join(lines) + "\n"
+
+    def report(self) -> str:
+        """写入所有结果文件，返回 summary.txt 的路径"""
+        summary = io.StringIO()
+        for (target, name), stats in sorted(self.phases.items()):
+            title = f"{target}/{name}" if target else name
+            summary.write(f"=== {title}: {stats.seconds:.3f}s, peak {stats.peak / 1024 / 1024:.1f} MiB above phase start\n")
+
+            # 同一阶段中所有线程（或 shared 时每一段）的 cProfile 合并成一个文件
+            profiles = [ x for x in stats.profiles if not isinstance(x, cProfile.Profile) or x.getstats() ]
+            if profiles:
+                data = pstats.Stats(stream=summary).add(*profiles)
+                data.dump_stats(self.path_of(target, f"{name}.pstats"))
+                data.sort_stats('tottime').print_stats(self.top)
+
+            with open(self.path_of(target, f"{name}.alloc.txt"), 'w', encoding='utf-8') as f:
+                for i, allocations in enumerate(stats.allocations):
+                    f.write(f"--- run {i + 1}\n")
+                    for x in allocations:
+                        f.write(f"{x}\n")
+            summary.write("\n")
+
+        calls = self.format_calls()
+        with open(self.path_of('', "http_slowest.txt"), 'w', encoding='utf-8') as f:
+            f.write(calls)
+        summary.write(f"=== {len(self.slowest)} slowest HTTP calls\n{calls}")
+
+        path = self.path_of('', "summary.txt")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(summary.getvalue())
+        return path
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""OpenC3 变更通知接收端（只依赖标准库）
+
+    POST /notify
+    X-Sync-Token: <[Receiver] token>
+
+    {"ip": "10.0.0.1"}                                  主机新增、删除或服务树变化
+    {"treename": "biz.app", "level": "1"}               用户授权变化
+    {"rule": "C3_biz.app_level_1"}
+    [{"ip": ...}, {"treename": ..., "level": ...}]      一次提交多个事件
+
+通知只说明哪些对象发生了变化，对象的内容在处理时重新从 OpenC3 获取。
+只写端口时只监听 127.0.0.1；监听其他地址时必须配置 token。
+"""
+
+import json
+import hmac
+import time
+import ipaddress
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from utils.logger import logger
+from utils.snapshot import rule_name_of
+
+# 通知内容的最大字节数，超过时返回 413
+MAX_BODY = 1024 * 1024
+
+
+class EventQueue(object):
+    """
+    合并变更通知：收到第一个事件后再等待 window 秒，把这段时间内的事件一起处理
+    每批事件都要重新获取 OpenC3 全量数据，两批之间至少间隔 min_interval 秒，期间的事件合并到下一批
+    """
+
+    def __init__(self, window = 5.0, min_interval = 0.0):
+        self.window = window
+        self.min_interval = min_interval
+        self.cond = threading.Condition()
+        self.ips = set()
+        self.rules = set()
+        # 当前这批中第一个事件的接收时间（time.time()）
+        self.since = None
+        # 上一批取出的时间（time.monotonic()）
+        self.last = None
+
+    def put(self, ips = (), rules = ()):
+        with self.cond:
+            if (ips or rules) and not (self.ips or self.rules):
+                self.since = time.time()
+            self.ips.update(ips)
+            self.rules.update(rules)
+            self.cond.notify()
+
+    def take(self, stopped: threading.Event):
+        """阻塞直到有事件，返回合并后的 (ips, rules, 第一个事件的接收时间)；stopped 被设置时返回 None"""
+        with self.cond:
+            while not (self.ips or self.rules):
+                if stopped.is_set():
+                    return None
+                self.cond.wait(1)
+        delay = self.window
+        if self.last is not None:
+            delay = max(delay, self.last + self.min_interval - time.monotonic())
+        if stopped.wait(delay):
+            return None
+        with self.cond:
+            batch = self.ips, self.rules, self.since
+            self.ips, self.rules = set(), set()
+            self.last = time.monotonic()
+        return batch
+
+
+def parse_events(body):
+    """把通知内容解析成 (ips, rules)，格式不正确时抛出 ValueError"""
+    events = body if isinstance(body, list) else [body]
+    ips, rules = set(), set()
+    for event in events:
+        if not isinstance(event, dict):
+            raise ValueError(f"invalid event: {event!r}")
+        if event.get("ip"):
+            ips.add(str(event["ip"]))
+        elif event.get("rule"):
+            rules.add(str(event["rule"]))
+        elif event.get("treename") and event.get("level") is not None:
+            rules.add(rule_name_of({"treename": event["treename"], "level": str(event["level"])}))
+        else:
+            raise ValueError(f"event needs ip, rule or treename and level: {event!r}")
+    return ips, rules
+
+
+class NotifyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    queue: EventQueue = None
+    token = ''
+    max_body = MAX_BODY
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, code, obj):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        # 请求体没有读取，连接不能再复用
+        if length < 0:
+            self.close_connection = True
+            return self.send(400, {"detail": "Invalid Content-Length."})
+        if length > self.max_body:
+            self.close_connection = True
+            return self.send(413, {"detail": f"Request body larger than {self.max_body} bytes."})
+        data = self.rfile.read(length) if length else b''
+        if self.path.rstrip('/') != '/notify':
+            return self.send(404, {"detail": "Not found."})
+        if self.token and not hmac.compare_digest(self.headers.get('X-Sync-Token', ''), self.token):
+            return self.send(403, {"detail": "Invalid token."})
+        try:
+            ips, rules = parse_events(json.loads(data or b'null'))
+        except ValueError as e:
+            return self.send(400, {"detail": str(e)})
+        self.queue.put(ips, rules)
+        logger.info(f"Received change notification: {len(ips)} hosts, {len(rules)} rules")
+        self.send(202, {"hosts": len(ips), "rules": len(rules)})
+
+
+def is_loopback(host) -> bool:
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def make_receiver(listen, queue: EventQueue, token = '', max_body = MAX_BODY) -> ThreadingHTTPServer:
+    """
+    listen 为 "port" 或 "host:port"，只写端口时监听 127.0.0.1
+    监听非回环地址而 token 为空时抛出 ValueError，避免任何人都可以触发同步
+    """
+    host, _, port = listen.rpartition(':')
+    host = host or '127.0.0.1'
+    if not token and not is_loopback(host):
+        raise ValueError(f"[Receiver] token is required to listen on {host}")
+    handler = type('BoundNotifyHandler', (NotifyHandler,), {"queue": queue, "token": token, "max_body": max_body})
+    server = ThreadingHTTPServer((host, int(port)), handler)
+    server.daemon_threads = True
+    return server
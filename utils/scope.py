@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""同步范围：限定一次同步只处理部分服务树
+
+主机、JumpServer 上的主机和授权规则都可能属于多个服务树，以排序后的第一个服务树决定归属，
+这样多个互不重叠的范围（分片）之间每个对象只属于一个范围。
+"""
+
+import abc
+from collections import Counter
+from utils import common
+
+
+def rule_trees(rule_name) -> list:
+    """从 C3_<treename>_level_<level> 中取出服务树列表"""
+    treename = rule_name[len("C3_"):].rsplit("_level_", 1)[0]
+    return [ x.strip() for x in treename.split(',') if x.strip() ]
+
+
+class Scope(abc.ABC):
+    """范围的公共逻辑，子类实现 contains(treename)"""
+
+    @abc.abstractmethod
+    def contains(self, treename) -> bool:
+        """服务树（a.b.c 格式）是否在范围内"""
+
+    def owns(self, trees) -> bool:
+        """对象是否属于这个范围，trees 为对象所在的服务树，没有服务树时 treename 为空"""
+        trees = [ x for x in trees if x ]
+        return self.contains(min(trees) if trees else '')
+
+    def contains_node(self, full_value) -> bool:
+        """JumpServer 节点（full_value）是否在范围内"""
+        return self.contains(common.treename_js_to_c3([full_value])[0])
+
+    def owns_nodes(self, full_values) -> bool:
+        """按所在节点判断 JumpServer 上的主机是否属于这个范围，只看 C3 下的节点"""
+        return self.owns(common.treename_js_to_c3( x for x in full_values if x.startswith("/DEFAULT/C3/") ))
+
+    def owns_rule(self, rule_name) -> bool:
+        return self.owns(rule_trees(rule_name))
+
+
+class TreeScope(Scope):
+    """--tree：一个或多个服务树子树，不在子树中的对象不会被修改"""
+
+    def __init__(self, roots):
+        self.roots = tuple(sorted(set( x.strip().strip('.') for x in roots if x.strip().strip('.') )))
+        if not self.roots:
+            raise ValueError("tree scope needs at least one treename")
+
+    def contains(self, treename) -> bool:
+        return any( treename == x or treename.startswith(x + '.') for x in self.roots )
+
+    def __str__(self):
+        return ",".join(self.roots)
+
+
+class ShardScope(Scope):
+    """分片同步中的一个分片：按服务树子树划分，对象属于 assignment 中最长的匹配前缀所在的分片，
+    没有匹配前缀的对象（没有服务树的主机、已经不存在的顶层服务树下的节点和规则）属于第 0 个分片
+
+    shared 为被继续拆分的上级服务树，多个分片都有其下的子树，任何分片都不会删除这些节点。
+    """
+
+    def __init__(self, assignment, index, count, shared = ()):
+        # 服务树前缀 -> 分片序号
+        self.assignment = assignment
+        self.index = index
+        self.count = count
+        self.shared = frozenset(shared)
+
+    def contains(self, treename) -> bool:
+        parts = treename.split('.') if treename else []
+        for i in range(len(parts), 0, -1):
+            index = self.assignment.get('.'.join(parts[:i]))
+            if index is not None:
+                return index == self.index
+        return self.index == 0
+
+    def contains_node(self, full_value) -> bool:
+        return common.treename_js_to_c3([full_value])[0] not in self.shared and super().contains_node(full_value)
+
+    @property
+    def trees(self) -> list:
+        return sorted( k for k, v in self.assignment.items() if v == self.index )
+
+    @classmethod
+    def split(cls, c3_hosts, count) -> list:
+        """
+        按主机数量把服务树子树分配到 count 个分片，每次分给当前主机最少的分片
+        从顶层服务树开始，子树数量少于 count 或最大的子树超过平均值时继续拆分最大的可拆分子树，
+        被拆分的服务树本身只保留直接在其下的主机，作为一个单独的子树参与分配
+        """
+        # 每个前缀下的主机数量（含下级）和直接在其下的主机数量，主机以排序后的第一个服务树为准
+        weights = Counter()
+        direct = Counter()
+        children = {}
+        for host in c3_hosts:
+            if not host.trees:
+                continue
+            tree = min(host.trees)
+            direct[tree] += 1
+            parts = tree.split('.')
+            for i in range(1, len(parts) + 1):
+                prefix = '.'.join(parts[:i])
+                weights[prefix] += 1
+                if i > 1:
+                    children.setdefault('.'.join(parts[:i - 1]), set()).add(prefix)
+
+        total = sum(direct.values())
+        units = Counter({ x: weights[x] for x in weights if '.' not in x })
+        shared = set()
+        while True:
+            expandable = [ x for x in units if x not in shared and x in children ]
+            if not expandable:
+                break
+            heaviest = max(units, key=lambda x: (units[x], x))
+            if len(units) >= count and (heaviest not in expandable or units[heaviest] * count <= total):
+                break
+            tree = heaviest if heaviest in expandable else max(expandable, key=lambda x: (units[x], x))
+            shared.add(tree)
+            units[tree] = direct[tree]
+            for child in children[tree]:
+                units[child] = weights[child]
+
+        load = [0] * count
+        assignment = {}
+        for tree in sorted(units, key=lambda x: (-units[x], x)):
+            index = load.index(min(load))
+            assignment[tree] = index
+            load[index] += units[tree]
+        return [ cls(assignment, i, count, shared) for i in range(count) ]
+
+    def __str__(self):
+        return f"{self.index + 1}/{self.count} ({len(self.trees)} trees)"
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import hashlib
+from typing import Dict, List, Any
+from utils.logger import logger
+
+
+def content_hash(obj) -> str:
+    return hashlib.sha1(json.dumps(obj, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def rule_name_of(user: Dict[str, Any]) -> str:
+    return f"C3_{user['treename']}_level_{user['level']}"
+
+
+class SnapshotDelta(object):
+    """两次运行之间 OpenC3 数据的变化"""
+
+    def __init__(self, changed_hosts, removed_ips, changed_rules, hosts_total = 0, rules_total = 0):
+        # 新增或内容有变化的主机（同一IP的所有主机记录）
+        self.changed_hosts = changed_hosts
+        # 已从 OpenC3 消失的IP
+        self.removed_ips = removed_ips
+        # 用户集合有变化的授权规则名称，包括已不存在的规则
+        self.changed_rules = changed_rules
+        # 快照中的主机IP数量和授权规则数量，用于删除保护
+        self.hosts_total = hosts_total
+        self.rules_total = rules_total
+
+    def __bool__(self):
+        return bool(self.changed_hosts or self.removed_ips or self.changed_rules)
+
+
+class Snapshot(object):
+    """记录上一次同步时每台主机、每个用户授权的内容哈希，用于增量同步
+
+    数据保存在 state_dir/snapshot.db (SQLite)。
+    """
+
+    def __init__(self, state_dir):
+        # 只在打开快照时导入，只用到 rule_name_of 的模块不需要
+        import sqlite3
+
+        os.makedirs(state_dir, exist_ok=True)
+        self.path = os.path.join(state_dir, 'snapshot.db')
+        self.conn = sqlite3.connect(self.path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS hosts (ip TEXT PRIMARY KEY, hash TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS users (hash TEXT PRIMARY KEY, rule TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        """)
+        self.logger = logger
+
+    def get_meta(self, key, default = None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def is_full_due(self, interval) -> bool:
+        """快照为空、上次同步有失败或距离上次全量同步超过 interval 秒时需要全量同步"""
+        if self.get_meta('dirty', '1') == '1':
+            return True
+        return time.time() - float(self.get_meta('last_full', 0)) >= interval
+
+    @staticmethod
+    def hash_hosts(c3_hosts) -> Dict[str, str]:
+        hosts_by_ip = {}
+        for host in c3_hosts:
+            hosts_by_ip.setdefault(host.ip, []).append(host.key())
+        return { ip: content_hash(hosts) for ip, hosts in hosts_by_ip.items() }
+
+    @staticmethod
+    def hash_users(c3_users) -> Dict[str, str]:
+        return { content_hash(user): rule_name_of(user) for user in c3_users }
+
+    def diff(self, c3_hosts, c3_users) -> SnapshotDelta:
+        """计算当前 OpenC3 数据与快照的差异"""
+        old_hosts = dict(self.conn.execute("SELECT ip, hash FROM hosts"))
+        new_hosts = self.hash_hosts(c3_hosts)
+        changed_ips = set( ip for ip, h in new_hosts.items() if old_hosts.get(ip) != h )
+        changed_hosts = [ x for x in c3_hosts if x.ip in changed_ips ]
+        removed_ips = set(old_hosts) - set(new_hosts)
+
+        old_users = dict(self.conn.execute("SELECT hash, rule FROM users"))
+        new_users = self.hash_users(c3_users)
+        changed_rules = set( rule for h, rule in new_users.items() if h not in old_users )
+        changed_rules |= set( rule for h, rule in old_users.items() if h not in new_users )
+
+        return SnapshotDelta(changed_hosts, removed_ips, changed_rules, len(old_hosts), len(set(old_users.values())))
+
+    def save(self, c3_hosts, c3_users, full = False, dirty = False):
+        """保存本次同步后的状态；dirty 为 True 时下一次运行强制全量同步"""
+        self.save_hashes(self.hash_hosts(c3_hosts), self.hash_users(c3_users), full, dirty)
+
+    def save_hashes(self, hosts, users, full = False, dirty = False):
+        """同 save，hosts / users 为 hash_hosts / hash_users 的结果（写操作日志检查点中保存的内容）"""
+        with self.conn:
+            self.conn.execute("DELETE FROM hosts")
+            self.conn.executemany("INSERT INTO hosts (ip, hash) VALUES (?, ?)", hosts.items())
+            self.conn.execute("DELETE FROM users")
+            self.conn.executemany("INSERT INTO users (hash, rule) VALUES (?, ?)", users.items())
+            if full:
+                self.conn.execute("REPLACE INTO meta (key, value) VALUES ('last_full', ?)", (str(time.time()),))
+            self.conn.execute("REPLACE INTO meta (key, value) VALUES ('dirty', ?)", ('1' if dirty else '0',))
+
+    def set_dirty(self):
+        """只标记下一次运行需要全量同步，不修改快照内容"""
+        with self.conn:
+            self.conn.execute("REPLACE INTO meta (key, value) VALUES ('dirty', '1')")
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+import re
+import time
+import threading
+from collections import Counter
+from urllib.parse import urlsplit
+from utils.metrics import metrics
+from utils.policy import RequestPolicy
+from utils import config
+
+# URL 中的对象ID（UUID 或数字），统计时归并成 {id}
+ID_PATTERN = re.compile(r'/(?:[0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{12}|\d+)(?=/|$)')
+
+
+# 每个 hook 在一次请求结束后调用：hook(target, endpoint, path, seconds, status, bytes_sent, bytes_received)，
+# path 包含查询参数，请求异常时 status 为 None
+request_hooks = []
+
+
+def add_request_hook(hook):
+    request_hooks.append(hook)
+
+
+def remove_request_hook(hook):
+    if hook in request_hooks:
+        request_hooks.remove(hook)
+
+
+def endpoint_of(method, url) -> str:
+    """把请求归类成 "METHOD /path/{id}/" 形式的接口名"""
+    return f"{method} {ID_PATTERN.sub('/{id}', urlsplit(url).path)}"
+
+
+class HttpTransport(object):
+    """基于连接池的 HTTP 传输层，JumpServerAPI 和 OpenC3API 共用
+
+    所有请求复用同一个 requests.Session（keep-alive），连接池大小、超时、
+    是否启用 gzip 均可配置。sign_date 为 True 时每个请求单独生成 date 头，
+    保证 HTTP 签名在长时间运行时不会使用过期的时间。
+    限速、并发控制和重试由 policy（RequestPolicy）负责，每次重试都会重新签名。
+    target 为所属的 JumpServer 同步目标名称，用于统计。pool_size、timeout、gzip 为空时使用配置中的值。
+    """
+
+    def __init__(self, headers=None, auth=None, sign_date=False,
+                 pool_size=None, timeout=None, gzip=None, policy=None, target='', settings=None):
+        # requests 导入较慢，只在真正需要发请求时导入
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        settings = settings or config.settings
+        if pool_size is None:
+            pool_size = settings.HTTP_POOL_SIZE
+        if timeout is None:
+            timeout = (settings.HTTP_CONNECT_TIMEOUT, settings.HTTP_READ_TIMEOUT)
+        if gzip is None:
+            gzip = settings.HTTP_GZIP
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update(headers or {})
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate' if gzip else 'identity'
+        self.session.auth = auth
+        self.sign_date = sign_date
+        self.timeout = timeout
+        # 按接口统计的请求次数
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        self.policy = policy or RequestPolicy(concurrency=pool_size, settings=settings)
+        self.target = target
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.policy.execute(method, lambda: self.send(method, url, **kwargs))
+
+    def send(self, method, url, **kwargs):
+        """发出一次请求并记录统计，重试时 kwargs 会被再次传入，不能修改"""
+        headers = dict(kwargs.get('headers') or {})
+        if self.sign_date:
+            headers['date'] = time.asctime(time.localtime(time.time()))
+        endpoint = endpoint_of(method, url)
+        with self.lock:
+            self.calls[endpoint] += 1
+
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, url, **{**kwargs, 'headers': headers})
+        except Exception:
+            seconds, sent = time.perf_counter() - start, self.body_size(kwargs.get('data'))
+            metrics.observe_request(endpoint, seconds, error=True, bytes_sent=sent, target=self.target)
+            for hook in list(request_hooks):
+                hook(self.target, endpoint, urlsplit(url).path, seconds, None, sent, 0)
+            raise
+
+        # 优先使用 Content-Length（开启 gzip 时为压缩后的大小），流式读取时不提前读取响应体
+        received = response.headers.get('Content-Length')
+        if received is None and not kwargs.get('stream'):
+            received = len(response.content)
+        seconds, sent, received = time.perf_counter() - start, self.body_size(response.request.body), int(received or 0)
+        metrics.observe_request(endpoint, seconds, error=response.status_code >= 400,
+                                bytes_sent=sent, bytes_received=received, target=self.target)
+        for hook in list(request_hooks):
+            hook(self.target, endpoint, response.request.path_url, seconds, response.status_code, sent, received)
+        return response
+
+    @staticmethod
+    def body_size(body) -> int:
+        if isinstance(body, str):
+            return len(body.encode('utf-8'))
+        return len(body) if isinstance(body, bytes) else 0
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request('PATCH', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def close(self):
+        self.session.close()